@@ -1,6 +1,7 @@
 #include <ESP8266WiFi.h>
 #include <WiFiClient.h>
 #include <ESP8266WebServer.h>
+#include <WiFiUdp.h>
 #include <ArduinoJson.h>
 #include <EEPROM.h>
 #include <TuyaSmartDevice.h>  // Biblioteca para comunicarse con dispositivos Tuya
@@ -18,6 +19,18 @@ const char* deviceIp = "TU_DEVICE_IP";     // IP local del dispositivo (opcional
 // Servidor web en puerto 80
 ESP8266WebServer server(80);
 
+// Transporte UDP binario para comandos "set" (protocolo en bulb_udp.py)
+// petición: magic | tipo | seq (2 bytes) | estado | brillo
+// ack:      magic | 0x81 | seq (2 bytes) | estado | brillo | resultado
+#define UDP_COMMAND_PORT 4210
+#define UDP_MAGIC 0xB5
+#define UDP_TYPE_SET 0x01
+#define UDP_TYPE_STATUS 0x02
+#define UDP_TYPE_ACK 0x81
+#define UDP_NO_BRIGHTNESS 0xFF
+#define EEPROM_SAVE_DELAY 2000   // Espera tras el último cambio por UDP antes de escribir EEPROM
+WiFiUDP udp;
+
 // ======== PINES Y CONSTANTES ========
 #define PIN_LED_STATUS D0     // GPIO16 - LED para indicar estado
 #define RECONNECT_INTERVAL 30000  // Intervalo para reintentar conexión en ms
@@ -36,6 +49,14 @@ unsigned long lastReconnectAttempt = 0; // Último intento de reconexión
 unsigned long lastHeartbeat = 0;   // Último ping para verificar conexión
 int reconnectCount = 0;       // Contador de intentos de reconexión
 
+// Último comando UDP (para reconocer retransmisiones)
+bool haveUdpSeq = false;
+uint16_t lastUdpSeq = 0;
+IPAddress lastUdpIp;
+uint16_t lastUdpPort = 0;
+bool stateDirty = false;            // Cambios por UDP pendientes de guardar en EEPROM
+unsigned long stateChangedAt = 0;
+
 // Estado del sistema
 DynamicJsonDocument deviceState(256);
 
@@ -73,6 +94,11 @@ void setup() {
   // Iniciar servidor HTTP
   server.begin();
   Serial.println("Servidor HTTP iniciado en puerto 80");
+  
+  // Iniciar transporte UDP de comandos
+  udp.begin(UDP_COMMAND_PORT);
+  Serial.print("Comandos UDP en puerto ");
+  Serial.println(UDP_COMMAND_PORT);
   Serial.print("Accede a la interfaz web en http://");
   Serial.print(WiFi.localIP());
   Serial.println("/");
@@ -86,6 +112,9 @@ void setup() {
 
 // ======== BUCLE PRINCIPAL ========
 void loop() {
+  // Comandos UDP primero: son los de menor latencia
+  handleUdpCommands();
+  
   // Manejar clientes web
   server.handleClient();
   
@@ -101,8 +130,11 @@ void loop() {
   // Verificar tiempo desde último comando para gestión de emergencia
   checkEmergencyMode();
   
-  // Pequeña pausa para estabilidad
-  delay(50);
+  // Guardar en EEPROM los cambios recibidos por UDP
+  saveStateIfDirty();
+  
+  // Pausa corta: cede tiempo al WiFi sin retrasar los comandos UDP
+  delay(5);
 }
 
 // ======== FUNCIONES DE CONFIGURACIÓN ========
@@ -231,16 +263,25 @@ void checkEmergencyMode() {
 
 // ======== FUNCIONES DE PROCESAMIENTO DE COMANDOS ========
 
-// Procesa un comando recibido en formato JSON
-void processCommand(String command) {
+// Registra la llegada de un comando y sale del modo emergencia
+void noteCommandReceived(bool reply) {
   // Actualizar tiempo de último comando
   lastCommandTime = millis();
   
   // Salir de modo emergencia si estábamos en él
   if (emergencyMode) {
     emergencyMode = false;
-    sendStatusMessage("Modo emergencia desactivado");
+    if (reply) {
+      sendStatusMessage("Modo emergencia desactivado");
+    } else {
+      Serial.println("Modo emergencia desactivado");
+    }
   }
+}
+
+// Procesa un comando recibido en formato JSON
+void processCommand(String command) {
+  noteCommandReceived(true);
   
   // Analizar JSON
   DynamicJsonDocument doc(256);
@@ -267,7 +308,7 @@ void processCommand(String command) {
     int brightness = doc["params"]["brightness"] | -1;
     
     // Aplicar cambios al foco
-    setBulbState(state, brightness);
+    setBulbState(state, brightness, true);
     
     // Guardar estado en memoria persistente
     saveStateToEEPROM();
@@ -294,8 +335,67 @@ void processCommand(String command) {
   }
 }
 
+// Atiende los datagramas UDP pendientes (comandos binarios)
+void handleUdpCommands() {
+  int size = udp.parsePacket();
+  while (size > 0) {
+    uint8_t packet[8];
+    int len = udp.read(packet, sizeof(packet));
+    if (len >= 6 && packet[0] == UDP_MAGIC) {
+      uint16_t seq = ((uint16_t)packet[2] << 8) | packet[3];
+      IPAddress remoteIp = udp.remoteIP();
+      uint16_t remotePort = udp.remotePort();
+      // Una retransmisión del último comando solo recibe de nuevo su ack
+      bool duplicate = haveUdpSeq && seq == lastUdpSeq &&
+                       remoteIp == lastUdpIp && remotePort == lastUdpPort;
+      uint8_t result = 0;
+      
+      if (packet[1] == UDP_TYPE_SET) {
+        if (!duplicate) {
+          noteCommandReceived(false);
+          int brightness = packet[5] == UDP_NO_BRIGHTNESS ? -1 : packet[5];
+          setBulbState(packet[4] ? "on" : "off", brightness, false);
+          // La EEPROM se escribe después, fuera del camino del ack
+          stateDirty = true;
+          stateChangedAt = millis();
+        }
+      } else if (packet[1] != UDP_TYPE_STATUS) {
+        result = 1;
+      }
+      
+      haveUdpSeq = true;
+      lastUdpSeq = seq;
+      lastUdpIp = remoteIp;
+      lastUdpPort = remotePort;
+      sendUdpAck(remoteIp, remotePort, seq, result);
+    }
+    size = udp.parsePacket();
+  }
+}
+
+// Responde a un comando UDP con el estado ya aplicado
+void sendUdpAck(IPAddress ip, uint16_t port, uint16_t seq, uint8_t result) {
+  uint8_t ack[7] = {
+    UDP_MAGIC, UDP_TYPE_ACK, (uint8_t)(seq >> 8), (uint8_t)(seq & 0xFF),
+    (uint8_t)(bulbState ? 1 : 0), (uint8_t)bulbBrightness, result
+  };
+  udp.beginPacket(ip, port);
+  udp.write(ack, sizeof(ack));
+  udp.endPacket();
+}
+
+// Guarda el estado cuando lleva EEPROM_SAVE_DELAY ms sin cambios por UDP
+void saveStateIfDirty() {
+  if (stateDirty && millis() - stateChangedAt > EEPROM_SAVE_DELAY) {
+    stateDirty = false;
+    updateDeviceState();
+    saveStateToEEPROM();
+  }
+}
+
 // Establece el estado del foco (encendido/apagado y brillo)
-void setBulbState(String state, int brightness) {
+// Con reply=false (comandos UDP) no se responde por HTTP
+void setBulbState(String state, int brightness, bool reply) {
   bool stateOn = (state == "on");
   
   if (stateOn) {
@@ -312,13 +412,13 @@ void setBulbState(String state, int brightness) {
       smartBulb.turnOn();
     }
     bulbState = true;
-    sendStatusMessage("Foco encendido");
+    if (reply) sendStatusMessage("Foco encendido");
   } else {
     // Apagar foco
     Serial.println("Apagando foco");
     smartBulb.turnOff();
     bulbState = false;
-    sendStatusMessage("Foco apagado");
+    if (reply) sendStatusMessage("Foco apagado");
   }
   
   // Indicación visual de cambio
@@ -561,9 +661,9 @@ void handleControl() {
   
   // Si recibimos un comando de encendido/apagado, procesarlo
   if (state == "on") {
-    setBulbState("on", -1);
+    setBulbState("on", -1, true);
   } else if (state == "off") {
-    setBulbState("off", -1);
+    setBulbState("off", -1, true);
   }
   
   // Guardar cambios en memoria no volátil
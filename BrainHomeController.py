@@ -1,7 +1,6 @@
 import time
 import json
 import threading
-import numpy as np
 import tkinter as tk
 from tkinter import ttk, messagebox
 from matplotlib.figure import Figure
@@ -10,6 +9,19 @@ import requests
 import socket
 import queue
 import os
+import random
+
+from calibration import best_threshold
+from tracing import tracer
+from metrics import registry, serve_metrics
+from dispatch import HandlerExecutor
+from adaptive import AdaptiveThresholds
+from intent import IntentClassifier
+from worker import WorkerClient
+from sampleclock import SampleClock
+from bulb_udp import UdpCommandTransport
+from net_stream import StreamServer
+import profiling
 
 # --- Internacionalización básica (es/en) ---
 LANG = "es"
@@ -27,6 +39,7 @@ STRINGS = {
         "signal_quality": "Calidad de señal",
         "calibration_started": "Calibración iniciada. Sigue las instrucciones...",
         "calibration_done": "Calibración completada.",
+        "calibration_failed": "Calibración fallida: no se distinguen las fases. Se conservan los umbrales anteriores.",
         "apply": "Aplicar",
         "reconnect": "Reconectar",
         "calibrate": "Calibrar Señales",
@@ -59,6 +72,7 @@ STRINGS = {
         "signal_quality": "Signal quality",
         "calibration_started": "Calibration started. Follow the instructions...",
         "calibration_done": "Calibration completed.",
+        "calibration_failed": "Calibration failed: the phases could not be told apart. Previous thresholds kept.",
         "apply": "Apply",
         "reconnect": "Reconnect",
         "calibrate": "Calibrate Signals",
@@ -84,6 +98,7 @@ def _(key):
 
 # --- Utilidades para persistencia de calibración ---
 CALIBRATION_FILE = "calibration.json"
+MAX_TEXT_LINES = 500  # Líneas que conservan los registros de comandos y logs de la GUI
 def save_calibration(thresholds):
     try:
         with open(CALIBRATION_FILE, "w") as f:
@@ -101,10 +116,60 @@ def load_calibration():
             return None
     return None
 
+def apply_calibration(processor, cal):
+    """Aplica a un procesador los umbrales y ventanas de una calibración guardada"""
+    if not cal:
+        return False
+    processor.attention_threshold = cal.get("attention", processor.attention_threshold)
+    processor.meditation_threshold = cal.get("meditation", processor.meditation_threshold)
+    processor.blink_threshold = cal.get("blink", processor.blink_threshold)
+    processor.attention_window = cal.get("attention_window", processor.attention_window)
+    processor.meditation_window = cal.get("meditation_window", processor.meditation_window)
+    return True
+
+def attach_optional_stages(processor, cal=None):
+    """Conecta las etapas opcionales activadas por entorno (umbrales adaptativos, clasificador)"""
+    # Umbrales adaptativos: se restauran las estadísticas guardadas si las hay
+    if os.environ.get("BRAINBULB_ADAPTIVE_THRESHOLDS") == "1":
+        if cal and cal.get("adaptive"):
+            adaptive = AdaptiveThresholds.from_dict(cal["adaptive"])
+        else:
+            adaptive = AdaptiveThresholds()
+        adaptive.attach_processor(processor)
+    # Clasificador de intenciones entrenado con intent.py
+    if os.environ.get("BRAINBULB_CLASSIFIER"):
+        try:
+            IntentClassifier.load(os.environ["BRAINBULB_CLASSIFIER"]).attach_processor(processor)
+        except ValueError as e:
+            print(f"Clasificador no conectado, se usan las reglas de umbral: {e}")
+
+def start_stream_server(thinkgear):
+    """Difunde por TCP los eSense de ThinkGear si BRAINBULB_STREAM_PORT está definido
+
+    Solo en 127.0.0.1 salvo que BRAINBULB_STREAM_HOST indique otra interfaz
+    (p. ej. 0.0.0.0): el flujo no tiene autenticación.
+    """
+    if not os.environ.get("BRAINBULB_STREAM_PORT") or thinkgear is None:
+        return None
+    server = StreamServer(os.environ.get("BRAINBULB_STREAM_HOST", "127.0.0.1"),
+                          int(os.environ["BRAINBULB_STREAM_PORT"]))
+    return server.start().attach_thinkgear(thinkgear)
+
 class ThinkGearClient:
-    """Cliente para conectarse al ThinkGear Connector mediante socket TCP"""
+    """Cliente para conectarse al ThinkGear Connector mediante socket TCP
+    
+    Con reconnect=True la conexión está supervisada: un error, un cierre del
+    conector o un silencio más largo que stall_timeout (varios periodos de
+    eSense, que llega una vez por segundo) cierran el socket y se reconecta
+    con backoff exponencial con jitter. Los handlers registrados pertenecen
+    al cliente y se conservan entre reconexiones.
+    """
     
-    def __init__(self, host='127.0.0.1', port=13854):
+    ESENSE_INTERVAL = 1.0  # El conector envía eSense una vez por segundo
+    MAX_LINE = 64 * 1024   # Longitud máxima de una línea sin '\r' antes de descartarla
+    
+    def __init__(self, host='127.0.0.1', port=13854, reconnect=False,
+                 stall_timeout=3.0, min_backoff=0.05, max_backoff=0.5):
         self.host = host
         self.port = port
         self.socket = None
@@ -112,6 +177,20 @@ class ThinkGearClient:
         self.running = False
         self.signal_quality = 200  # 0 = excelente, 200 = muy mala
         
+        # Supervisión de la conexión
+        self.reconnect = reconnect
+        self.stall_timeout = stall_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.last_data_time = None
+        self.last_outage = None  # Duración del último corte de datos (s)
+        self._outage_start = None
+        
+        # Reloj de muestras de eSense (1 Hz) anclado a time.monotonic()
+        self.clock = SampleClock(1.0, creep=0.05, resync=1.5)
+        self.sample_time = None  # Marca de tiempo del último dato recibido
+        self._arrival = None
+        
         # Callbacks
         self.attention_handlers = []
         self.meditation_handlers = []
@@ -120,53 +199,171 @@ class ThinkGearClient:
         
         # Thread para la lectura de datos
         self.thread = None
+        
+        self._bind_metrics()
+    
+    def _bind_metrics(self):
+        """Métricas etiquetadas con la dirección actual del conector"""
+        labels = {"host": f"{self.host}:{self.port}"}
+        self.bytes_counter = registry.counter(
+            "thinkgear_bytes_read_total", "Bytes recibidos del ThinkGear Connector", labels)
+        self.messages_counter = registry.counter(
+            "thinkgear_messages_total", "Mensajes JSON procesados", labels)
+        self.json_errors_counter = registry.counter(
+            "thinkgear_json_errors_total", "Líneas JSON no válidas", labels)
+        self.reconnects_counter = registry.counter(
+            "thinkgear_reconnects_total", "Reconexiones tras perder el conector", labels)
+        self.stalls_counter = registry.counter(
+            "thinkgear_stalls_total", "Conexiones cerradas por falta de datos", labels)
+        self.outage_counter = registry.counter(
+            "thinkgear_outage_seconds_total", "Segundos sin datos por cortes de conexión", labels)
+        self.lost_counter = registry.counter(
+            "thinkgear_esense_lost_total", "Mensajes eSense perdidos estimados durante los cortes", labels)
+        self.outage_gauge = registry.gauge(
+            "thinkgear_last_outage_seconds", "Duración del último corte de datos", labels)
+        self.overflow_counter = registry.counter(
+            "thinkgear_line_overflows_total", "Líneas descartadas por superar MAX_LINE", labels)
     
     def connect(self):
-        """Conecta con el ThinkGear Connector"""
+        """Conecta con el ThinkGear Connector
+        
+        En modo supervisado el hilo lector se arranca aunque falle el primer
+        intento y sigue reintentando en segundo plano.
+        """
+        self.running = True
+        success = self._open_socket()
+        if success or self.reconnect:
+            if not success:
+                self._outage_start = time.monotonic()
+            # Iniciar thread de lectura
+            self.thread = threading.Thread(target=self._read_data_loop)
+            self.thread.daemon = True
+            self.thread.start()
+        else:
+            self.running = False
+        return success
+    
+    def reconnect_to(self, host=None, port=None):
+        """Reconecta (opcionalmente a otra dirección) conservando los handlers"""
+        self.disconnect()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+        host = host or self.host
+        port = port or self.port
+        if (host, port) != (self.host, self.port):
+            self.host, self.port = host, port
+            self._bind_metrics()
+        self._outage_start = None
+        return self.connect()
+    
+    def disconnect(self):
+        """Desconecta del ThinkGear Connector"""
+        self.running = False
+        if self.socket:
+            try:
+                self.socket.close()
+            except:
+                pass
+        self.connected = False
+    
+    def _open_socket(self, quiet=False):
+        """Abre el socket y envía la configuración; devuelve True si lo consigue"""
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.host, self.port))
+            sock = socket.create_connection((self.host, self.port), timeout=2.0)
             
             # Enviar comando para activar la salida de datos JSON
             init_json_cmd = '{"enableRawOutput": false, "format": "Json"}'
-            self.socket.sendall(init_json_cmd.encode('utf-8'))
+            sock.sendall(init_json_cmd.encode('utf-8'))
             
+            # El timeout de lectura hace de watchdog de datos
+            if self.stall_timeout:
+                sock.settimeout(min(0.5, self.stall_timeout))
+            else:
+                sock.settimeout(None)
+            self.socket = sock
             self.connected = True
-            self.running = True
-            
-            # Iniciar thread de lectura
-            self.thread = threading.Thread(target=self._read_data_loop)
-            self.thread.daemon = True
-            self.thread.start()
             
             print(f"Conectado a ThinkGear en {self.host}:{self.port}")
             return True
         except Exception as e:
-            print(f"Error conectando con ThinkGear: {e}")
+            if not quiet:
+                print(f"Error conectando con ThinkGear: {e}")
             self.connected = False
             return False
     
-    def disconnect(self):
-        """Desconecta del ThinkGear Connector"""
-        self.running = False
+    def _close_socket(self):
+        self.connected = False
         if self.socket:
             try:
                 self.socket.close()
-            except:
+            except Exception:
                 pass
-        self.connected = False
+    
+    def _reopen_with_backoff(self):
+        """Reintenta la conexión con backoff exponencial y jitter hasta lograrlo o parar"""
+        delay = self.min_backoff
+        while self.running:
+            if self._open_socket(quiet=True):
+                self.reconnects_counter.inc()
+                return True
+            # Jitter: evita que varios clientes reintenten a la vez
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, self.max_backoff)
+        return False
+    
+    def _record_outage(self, now):
+        """Contabiliza el corte que termina con los primeros datos tras reconectar"""
+        outage = now - self._outage_start
+        self._outage_start = None
+        self.last_outage = outage
+        self.outage_counter.inc(outage)
+        self.outage_gauge.set(outage)
+        self.lost_counter.inc(max(0, round(outage / self.ESENSE_INTERVAL) - 1))
+        print(f"Datos de ThinkGear recuperados tras {outage * 1000:.0f} ms")
     
     def _read_data_loop(self):
-        """Bucle de lectura de datos desde el socket"""
+        """Bucle de lectura de datos; en modo supervisado restablece la conexión"""
+        while self.running:
+            if not self.connected and not self._reopen_with_backoff():
+                break
+            reason = self._read_socket()
+            self._close_socket()
+            if not self.running or not self.reconnect:
+                break
+            if reason == 'stall':
+                self.stalls_counter.inc()
+            if self._outage_start is None:
+                self._outage_start = self.last_data_time or time.monotonic()
+    
+    def _read_socket(self):
+        """Lee del socket actual hasta perderlo; devuelve 'eof', 'error', 'stall' o None si se para"""
         buffer = ""
+        sock = self.socket
+        self.last_data_time = last_data = time.monotonic()
         
-        while self.running and self.connected:
+        while self.running:
             try:
                 # Leer datos del socket
-                data = self.socket.recv(1024).decode('utf-8')
-                if not data:
-                    self.connected = False
-                    break
+                raw = sock.recv(1024)
+            except socket.timeout:
+                if time.monotonic() - last_data > self.stall_timeout:
+                    print(f"ThinkGear sin datos durante {self.stall_timeout:g} s")
+                    return 'stall'
+                continue
+            except Exception as e:
+                if self.running:
+                    print(f"Error leyendo datos de ThinkGear: {e}")
+                return 'error'
+            if not raw:
+                return 'eof'
+            try:
+                self.bytes_counter.inc(len(raw))
+                self.last_data_time = self._arrival = last_data = time.monotonic()
+                if self._outage_start is not None:
+                    self._record_outage(last_data)
+                data = raw.decode('utf-8')
+                if tracer.enabled:
+                    tracer.begin()
                 
                 # Añadir al buffer y procesar líneas completas
                 buffer += data
@@ -175,15 +372,20 @@ class ThinkGearClient:
                 for i in range(len(lines) - 1):
                     try:
                         self._process_json_data(lines[i])
+                        self.messages_counter.inc()
                     except json.JSONDecodeError:
-                        pass
+                        self.json_errors_counter.inc()
                 
                 buffer = lines[-1]
+                if len(buffer) > self.MAX_LINE:
+                    # Basura sin separador: descartarla en vez de acumularla
+                    self.overflow_counter.inc()
+                    buffer = ""
                 
             except Exception as e:
                 print(f"Error leyendo datos de ThinkGear: {e}")
-                self.connected = False
-                break
+                return 'error'
+        return None
     
     def _process_json_data(self, line):
         """Procesa una línea de datos en formato JSON"""
@@ -192,6 +394,12 @@ class ThinkGearClient:
             
         data = json.loads(line)
         
+        # Marca de tiempo: reloj de eSense o, para parpadeos, hora de llegada
+        if 'eSense' in data:
+            self.sample_time = self.clock.tick(self._arrival)
+        elif self._arrival is not None:
+            self.sample_time = self._arrival
+        
         # Procesar cada tipo de dato
         if 'poorSignalLevel' in data:
             value = data['poorSignalLevel']
@@ -218,14 +426,18 @@ class ThinkGearClient:
 class BrainSignalProcessor:
     """Procesa y analiza señales cerebrales para detectar patrones e intenciones"""
     
-    def __init__(self, calibration_time=30):
+    def __init__(self, calibration_time=20):
         self.attention_buffer = []
         self.meditation_buffer = []
         self.blink_buffer = []
+        self.feature_buffers = {}  # Rasgos adicionales (p. ej. 'engagement' de spectral.py)
+        self.feature_producers = set()  # Rasgos adicionales con una fuente conectada
         self.buffer_size = 100
         self.attention_threshold = 60
         self.meditation_threshold = 70
         self.blink_threshold = 80
+        self.attention_window = 5
+        self.meditation_window = 5
         self.calibration_time = calibration_time
         self.calibrated = False
         self.gesture_patterns = {
@@ -234,9 +446,28 @@ class BrainSignalProcessor:
             'ajustar_brillo': {'blink': 'triple', 'duration': 3},
         }
         self.detected_gestures = []
+        self.gesture_handlers = []
+        # Rechazo de artefactos opcional (artifacts.ArtifactRejector.attach_processor)
+        self.artifact_gate = None
+        self.artifact_policy = 'suppress'
+        self.artifact_gestures = []
+        self.suppressed_gestures = 0
+        # Umbrales adaptativos opcionales (adaptive.AdaptiveThresholds.attach_processor)
+        self.adaptive = None
+        # Clasificador de intenciones opcional (intent.IntentClassifier.attach_processor)
+        self.classifier = None
+        # Reloj monotónico de referencia; las marcas de tiempo de las muestras
+        # (SampleClock) están en esta misma base
+        self.clock = time.monotonic
+        self.last_timestamp = None
     
-    def update(self, signal_type, value):
-        """Actualiza los buffers con nuevos valores"""
+    def update(self, signal_type, value, timestamp=None):
+        """Actualiza los buffers con nuevos valores
+        
+        `timestamp` es la marca del reloj de muestras del dato; sin ella se
+        usa la hora de self.clock al recibirlo.
+        """
+        self.last_timestamp = self.clock() if timestamp is None else timestamp
         if signal_type == 'attention':
             self.attention_buffer.append(value)
             if len(self.attention_buffer) > self.buffer_size:
@@ -249,7 +480,16 @@ class BrainSignalProcessor:
             self.blink_buffer.append(value)
             if len(self.blink_buffer) > self.buffer_size:
                 self.blink_buffer.pop(0)
+        else:
+            # Los rasgos adicionales se almacenan pero no disparan la detección
+            buffer = self.feature_buffers.setdefault(signal_type, [])
+            buffer.append(value)
+            if len(buffer) > self.buffer_size:
+                buffer.pop(0)
+            return
         
+        if self.adaptive is not None:
+            self.adaptive.observe(signal_type, value)
         self._detect_patterns()
     
     def calibrate(self, callback=None):
@@ -262,76 +502,158 @@ class BrainSignalProcessor:
         threading.Thread(target=self._calibration_thread, daemon=True).start()
 
     def _calibration_thread(self):
-        # Calibración interactiva: 15s relajación, 15s concentración
-        print("Iniciando calibración. Relájate durante los primeros 15 segundos...")
-        time.sleep(15)
-        att_relax = self.attention_buffer[-20:] if len(self.attention_buffer) >= 20 else self.attention_buffer[:]
-        med_relax = self.meditation_buffer[-20:] if len(self.meditation_buffer) >= 20 else self.meditation_buffer[:]
-        print("Ahora concéntrate intensamente durante 15 segundos...")
+        # Calibración interactiva: relajación y concentración, calibration_time/2 cada una
+        phase = self.calibration_time / 2.0
+        print(f"Iniciando calibración. Relájate durante los primeros {phase:.0f} segundos...")
+        time.sleep(phase)
+        att_relax = self.attention_buffer[:]
+        med_relax = self.meditation_buffer[:]
+        print(f"Ahora concéntrate intensamente durante {phase:.0f} segundos...")
         self.attention_buffer = []
         self.meditation_buffer = []
-        time.sleep(15)
-        att_focus = self.attention_buffer[-20:] if len(self.attention_buffer) >= 20 else self.attention_buffer[:]
-        med_focus = self.meditation_buffer[-20:] if len(self.meditation_buffer) >= 20 else self.meditation_buffer[:]
-        # Calcular umbrales
-        if att_relax and att_focus:
-            self.attention_threshold = int((np.mean(att_relax) + np.mean(att_focus)) / 2)
-        if med_relax and med_focus:
-            self.meditation_threshold = int((np.mean(med_relax) + np.mean(med_focus)) / 2)
+        time.sleep(phase)
+        att_focus = self.attention_buffer[:]
+        med_focus = self.meditation_buffer[:]
+        # Buscar umbral y ventana que mejor separan ambas fases
+        att = best_threshold(att_relax, att_focus)
+        # La meditación debe superar el umbral durante la relajación
+        med = best_threshold(med_focus, med_relax)
+        if att is None or med is None:
+            # Sin separación entre fases: conservar los umbrales anteriores
+            print("Calibración fallida: las fases no se distinguen, se conservan los umbrales anteriores.")
+            if self._calibration_callback:
+                self._calibration_callback(False)
+            return
+        self.attention_threshold = att['threshold']
+        self.attention_window = att['window']
+        self.meditation_threshold = med['threshold']
+        self.meditation_window = med['window']
+        if self.adaptive is not None:
+            # Los umbrales adaptativos parten de los calibrados
+            self.adaptive.anchor('attention', self.attention_threshold)
+            self.adaptive.anchor('meditation', self.meditation_threshold)
         self.calibrated = True
         # Guardar calibración
-        save_calibration({
-            "attention": self.attention_threshold,
-            "meditation": self.meditation_threshold,
-            "blink": self.blink_threshold
-        })
+        save_calibration(self.get_calibration())
         if self._calibration_callback:
-            self._calibration_callback()
+            self._calibration_callback(True)
         print("Calibración completada.")
     
+    def get_calibration(self):
+        """Devuelve los parámetros de detección actuales para persistirlos"""
+        calibration = {
+            "attention": self.attention_threshold,
+            "meditation": self.meditation_threshold,
+            "blink": self.blink_threshold,
+            "attention_window": self.attention_window,
+            "meditation_window": self.meditation_window
+        }
+        if self.adaptive is not None:
+            calibration["adaptive"] = self.adaptive.to_dict()
+        return calibration
+    
     def _detect_patterns(self):
         """Detecta patrones específicos en las señales cerebrales"""
-        # Detección de picos de atención para encender
-        if len(self.attention_buffer) >= 5:
-            recent_attention = self.attention_buffer[-5:]
-            if max(recent_attention) > self.attention_threshold and \
-               recent_attention[-1] > self.attention_threshold and \
-               recent_attention[0] < self.attention_threshold * 0.7:
-                self.detected_gestures.append(('foco_on', time.time()))
-        
-        # Detección de picos de meditación para apagar
-        if len(self.meditation_buffer) >= 5:
-            recent_meditation = self.meditation_buffer[-5:]
-            if max(recent_meditation) > self.meditation_threshold and \
-               recent_meditation[-1] > self.meditation_threshold and \
-               recent_meditation[0] < self.meditation_threshold * 0.7:
-                self.detected_gestures.append(('foco_off', time.time()))
-                
+        if self.classifier is not None:
+            # El clasificador sustituye a las reglas de atención y meditación
+            gesture = self.classifier.predict(self)
+            if gesture is not None:
+                self._emit_gesture(gesture)
+        else:
+            # Detección de picos de atención para encender
+            if len(self.attention_buffer) >= self.attention_window:
+                recent_attention = self.attention_buffer[-self.attention_window:]
+                if max(recent_attention) > self.attention_threshold and \
+                   recent_attention[-1] > self.attention_threshold and \
+                   recent_attention[0] < self.attention_threshold * 0.7:
+                    self._emit_gesture('foco_on')
+            
+            # Detección de picos de meditación para apagar
+            if len(self.meditation_buffer) >= self.meditation_window:
+                recent_meditation = self.meditation_buffer[-self.meditation_window:]
+                if max(recent_meditation) > self.meditation_threshold and \
+                   recent_meditation[-1] > self.meditation_threshold and \
+                   recent_meditation[0] < self.meditation_threshold * 0.7:
+                    self._emit_gesture('foco_off')
+                    
         # Detección de triple parpadeo para ajustar brillo
         if len(self.blink_buffer) >= 10:
             recent_blinks = self.blink_buffer[-10:]
             blink_count = sum(1 for b in recent_blinks if b > self.blink_threshold)
             if blink_count >= 3:
-                self.detected_gestures.append(('ajustar_brillo', time.time()))
+                self._emit_gesture('ajustar_brillo')
         
         # Limitar el historial de gestos detectados
         if len(self.detected_gestures) > 20:
             self.detected_gestures = self.detected_gestures[-20:]
     
+    def _emit_gesture(self, gesture):
+        """Registra un gesto detectado y notifica a los handlers"""
+        # El gesto lleva la marca de la muestra que lo completó
+        timestamp = self.last_timestamp
+        if self.artifact_gate is not None and self.artifact_gate.is_artifact():
+            if self.artifact_policy == 'suppress':
+                self.suppressed_gestures += 1
+                registry.counter("brainbulb_gestures_suppressed_total",
+                                 "Gestos suprimidos por artefactos").inc()
+                return
+            self.artifact_gestures.append((gesture, timestamp))
+            if len(self.artifact_gestures) > 20:
+                self.artifact_gestures = self.artifact_gestures[-20:]
+        trace = None
+        if tracer.enabled:
+            current = tracer.current()
+            if current is not None:
+                trace = current.fork()
+                tracer.stamp(trace, 'detected')
+        self.detected_gestures.append((gesture, timestamp, trace))
+        registry.counter("brainbulb_gestures_total", "Gestos detectados",
+                         {"gesture": gesture}).inc()
+        for handler in self.gesture_handlers:
+            handler(gesture, timestamp)
+    
     def get_command(self):
         """Devuelve el comando más reciente si existe y lo elimina de la lista"""
+        return self.pop_command()[0]
+    
+    def pop_command(self):
+        """Como get_command, pero devuelve (comando, traza)
+        
+        La traza (None si el trazado está desactivado) se pasa explícitamente
+        a SmartBulbController.send_command para cerrar la latencia del gesto.
+        """
         if self.detected_gestures:
-            gesture, timestamp = self.detected_gestures.pop(0)
-            if time.time() - timestamp < 3:  # Solo comandos recientes
-                return gesture
-        return None
+            gesture, timestamp, trace = self.detected_gestures.pop(0)
+            if self.clock() - timestamp < 3:  # Solo comandos recientes
+                if trace is not None:
+                    tracer.stamp(trace, 'dequeued')
+                return gesture, trace
+        return None, None
 
 class SmartBulbController:
-    """Gestiona la comunicación con el foco inteligente a través del ESP8266"""
+    """Gestiona la comunicación con el foco inteligente a través del ESP8266
+    
+    Con udp_port (o BRAINBULB_UDP_PORT) los comandos "set" van por el
+    transporte UDP binario de bulb_udp.py y HTTP queda como respaldo: si no
+    llega el ack se repite por HTTP y, tras UDP_MAX_FAILURES fallos seguidos,
+    UDP se deja de intentar durante UDP_COOLDOWN segundos.
+    """
+    
+    STATUS_INTERVAL = 5  # Segundos entre consultas de estado
+    RECONNECT_INTERVAL = 5  # Espera máxima entre intentos de reconexión
+    MIN_RECONNECT_DELAY = 0.25  # Primer reintento; se duplica hasta RECONNECT_INTERVAL
+    FAILURES_BEFORE_DISCONNECT = 2  # Fallos de red seguidos que marcan la desconexión
+    UDP_MAX_FAILURES = 3
+    UDP_COOLDOWN = 30
     
-    def __init__(self, ip_address, port=80):
+    def __init__(self, ip_address, port=80, udp_port=None):
         self.ip_address = ip_address
         self.port = port
+        if udp_port is None and os.environ.get("BRAINBULB_UDP_PORT"):
+            udp_port = int(os.environ["BRAINBULB_UDP_PORT"])
+        self.udp = UdpCommandTransport(ip_address, udp_port) if udp_port else None
+        self._udp_failures = 0
+        self._udp_retry_at = 0.0
         self.base_url = f"http://{ip_address}:{port}"
         self.connected = False
         self.bulb_status = {
@@ -339,6 +661,18 @@ class SmartBulbController:
             "brightness": 100
         }
         self.lock = threading.Lock()
+        self._http_counters = {}
+        self._failures = 0
+        if self.udp is not None:
+            for p in (50, 99):
+                registry.gauge(f"esp8266_udp_rtt_p{p}_seconds",
+                               f"Percentil {p} de ida y vuelta de los comandos UDP",
+                               {"esp": ip_address},
+                               fn=lambda p=p, udp=self.udp: udp.latency.percentile(p) / 1e9)
+        # Como mucho un hilo de polling y uno de reconexión por controlador
+        self._closed = threading.Event()
+        self._threads = {}
+        self._threads_lock = threading.Lock()
         self.connect()
         
     def connect(self):
@@ -348,7 +682,7 @@ class SmartBulbController:
             if response.status_code == 200:
                 self.connected = True
                 self._process_response(response.json())
-                threading.Thread(target=self._status_polling, daemon=True).start()
+                self._start_thread(self._status_polling)
                 print(f"Conectado a ESP8266 en {self.ip_address}")
                 return True
             else:
@@ -358,11 +692,28 @@ class SmartBulbController:
         except Exception as e:
             print(f"Error al conectar con ESP8266: {e}")
             self.connected = False
-            threading.Thread(target=self._auto_reconnect, daemon=True).start()
+            self._start_thread(self._auto_reconnect)
             return False
     
-    def send_command(self, command, params=None):
-        """Envía un comando al ESP8266"""
+    def _start_thread(self, target):
+        """Arranca `target` en un hilo salvo que ya haya uno vivo o el controlador esté cerrado"""
+        with self._threads_lock:
+            thread = self._threads.get(target.__name__)
+            if self._closed.is_set() or (thread is not None and thread.is_alive()):
+                return
+            thread = threading.Thread(target=target, daemon=True)
+            self._threads[target.__name__] = thread
+            thread.start()
+    
+    def close(self):
+        """Detiene el polling y la reconexión (al sustituir el controlador)"""
+        self._closed.set()
+        self.connected = False
+        if self.udp is not None:
+            self.udp.close()
+    
+    def send_command(self, command, params=None, trace=None):
+        """Envía un comando al ESP8266; `trace` es la traza del gesto que lo originó"""
         if not self.connected:
             return False
             
@@ -374,63 +725,125 @@ class SmartBulbController:
         
         if params:
             cmd_obj["params"] = params
+        
+        if (self.udp is not None and command == "set" and params
+                and time.monotonic() >= self._udp_retry_at):
+            if self._send_udp(params, trace):
+                return True
             
         with self.lock:
             try:
+                if trace is not None:
+                    tracer.stamp(trace, 'sent')
                 response = requests.post(
                     f"{self.base_url}/command",
                     json=cmd_obj,
                     timeout=2
                 )
+                if trace is not None:
+                    tracer.finish(trace, 'response')
                 
                 if response.status_code == 200:
+                    self._failures = 0
                     try:
                         resp_data = response.json()
                         self._process_response(resp_data)
+                        self._count_http("command", "ok")
                         return True
                     except ValueError:
                         print("Respuesta no válida del ESP8266")
+                        self._count_http("command", "invalid")
                         return False
                 else:
                     print(f"Error enviando comando: Status code {response.status_code}")
+                    self._count_http("command", "http_error")
+                    # Igual que en el polling de estado: cuenta para la desconexión
+                    self._transport_failed()
                     return False
             except Exception as e:
                 print(f"Error enviando comando: {e}")
-                self.connected = False
+                self._count_http("command", "failure")
+                self._transport_failed()
                 return False
     
-    def turn_on(self):
+    def _send_udp(self, params, trace):
+        """Envía un set por UDP; False si hay que recurrir a HTTP"""
+        if trace is not None:
+            tracer.stamp(trace, 'sent')
+        response = self.udp.send_set(params.get("state", "on"), params.get("brightness"))
+        if response is not None and response["status"] == "ok":
+            if trace is not None:
+                tracer.finish(trace, 'response')
+            self._process_response(response)
+            self._count_http("command", "ok", transport="udp")
+            self._udp_failures = 0
+            return True
+        self._count_http("command", "failure" if response is None else "invalid", transport="udp")
+        self._udp_failures += 1
+        if self._udp_failures >= self.UDP_MAX_FAILURES:
+            print(f"UDP sin respuesta del ESP8266; se usa HTTP durante {self.UDP_COOLDOWN} s")
+            self._udp_retry_at = time.monotonic() + self.UDP_COOLDOWN
+            self._udp_failures = 0
+        return False
+    
+    def turn_on(self, trace=None):
         """Enciende el foco"""
-        return self.send_command("set", {"state": "on"})
+        return self.send_command("set", {"state": "on"}, trace)
     
-    def turn_off(self):
+    def turn_off(self, trace=None):
         """Apaga el foco"""
-        return self.send_command("set", {"state": "off"})
+        return self.send_command("set", {"state": "off"}, trace)
     
-    def set_brightness(self, brightness):
+    def set_brightness(self, brightness, trace=None):
         """Ajusta el brillo del foco (0-100)"""
         brightness = max(1, min(100, brightness))
-        return self.send_command("set", {"state": "on", "brightness": brightness})
+        return self.send_command("set", {"state": "on", "brightness": brightness}, trace)
     
     def _status_polling(self):
         """Thread que realiza polling del estado del foco"""
-        while self.connected:
+        while self.connected and not self._closed.is_set():
             try:
                 response = requests.get(f"{self.base_url}/status", timeout=2)
                 if response.status_code == 200:
+                    self._failures = 0
                     try:
                         self._process_response(response.json())
+                        self._count_http("status", "ok")
                     except ValueError:
                         print("Datos de estado no válidos")
+                        self._count_http("status", "invalid")
                 else:
                     print(f"Error obteniendo estado: Status code {response.status_code}")
-                    self.connected = False
+                    self._count_http("status", "http_error")
+                    self._transport_failed()
             except Exception as e:
                 print(f"Error en polling de estado: {e}")
-                self.connected = False
-                break
+                self._count_http("status", "failure")
+                self._transport_failed()
             
-            time.sleep(5)  # Polling cada 5 segundos
+            self._closed.wait(self.STATUS_INTERVAL)
+    
+    def _transport_failed(self):
+        """Tolera un fallo aislado; varios seguidos marcan la desconexión y arrancan la reconexión"""
+        self._failures += 1
+        if self._failures >= self.FAILURES_BEFORE_DISCONNECT and self.connected:
+            self.connected = False
+            self._start_thread(self._auto_reconnect)
+    
+    def _count_http(self, endpoint, result, transport="http"):
+        """Incrementa el contador de peticiones al ESP8266 por endpoint, resultado y transporte"""
+        counter = self._http_counters.get((endpoint, result, transport))
+        if counter is None:
+            if transport == "http":
+                counter = registry.counter(
+                    "esp8266_http_requests_total", "Peticiones HTTP al ESP8266",
+                    {"esp": self.ip_address, "endpoint": endpoint, "result": result})
+            else:
+                counter = registry.counter(
+                    "esp8266_udp_commands_total", "Comandos UDP al ESP8266",
+                    {"esp": self.ip_address, "result": result})
+            self._http_counters[(endpoint, result, transport)] = counter
+        counter.inc()
     
     def _process_response(self, response):
         """Procesa respuestas JSON del ESP8266"""
@@ -444,15 +857,19 @@ class SmartBulbController:
         return self.bulb_status
 
     def _auto_reconnect(self):
-        """Reconexión automática si se pierde la conexión"""
+        """Reconexión automática si se pierde la conexión (espera creciente entre intentos)"""
+        delay = self.MIN_RECONNECT_DELAY
         while not self.connected:
             try:
-                time.sleep(5)
+                if self._closed.wait(delay):
+                    break
+                delay = min(delay * 2, self.RECONNECT_INTERVAL)
                 response = requests.get(f"{self.base_url}/status", timeout=2)
                 if response.status_code == 200:
+                    self._failures = 0
                     self.connected = True
                     self._process_response(response.json())
-                    threading.Thread(target=self._status_polling, daemon=True).start()
+                    self._start_thread(self._status_polling)
                     print(f"Reconectado a ESP8266 en {self.ip_address}")
                     break
             except Exception:
@@ -471,20 +888,47 @@ class BrainBulbApp:
         self.queue = queue.Queue()
         self.log_queue = queue.Queue()
         self.signal_quality = 200
+        registry.gauge("brainbulb_gui_queue_depth", "Mensajes pendientes para la GUI",
+                       fn=self.queue.qsize)
+        
+        # Ejecución aislada de handlers (opcional)
+        self.handler_executor = None
+        self._processor_subscriber = None
+        if os.environ.get("BRAINBULB_ISOLATE_HANDLERS") == "1":
+            self.handler_executor = HandlerExecutor()
         
         # Detectar IP ESP8266 o usar default
         esp_ip = self._detect_esp8266_ip()
-        self.bulb_controller = SmartBulbController(esp_ip)
         
-        # Intentar conectar con ThinkGear
-        self.thinkgear = None
-        self.connect_thinkgear()
+        self.worker = None
+        if os.environ.get("BRAINBULB_WORKER") == "1":
+            # Adquisición, detección y foco en otro proceso; aquí solo sus vistas
+            self.worker = WorkerClient(esp_ip)
+            self.processor = self.worker.processor
+            self.bulb_controller = self.worker.bulb
+            self.thinkgear = self.worker.thinkgear
+        else:
+            # Una sola vez por proceso: el procesador de la aplicación (no los de
+            # las reproducciones offline, que no deben quedar retenidos)
+            registry.gauge("brainbulb_gesture_queue_depth", "Gestos pendientes de ejecutar",
+                           fn=lambda: len(self.processor.detected_gestures))
+            self.bulb_controller = SmartBulbController(esp_ip)
+            
+            # Intentar conectar con ThinkGear
+            self.thinkgear = None
+            self.connect_thinkgear()
+        # Difusión a suscriptores remotos (opcional)
+        self.stream_server = None if self.worker else start_stream_server(self.thinkgear)
         
         # Cargar calibración
         self._load_calibration()
         
         # Configurar interfaz
         self._setup_ui()
+        if self.worker is not None:
+            self.blink_brightness.config(
+                command=lambda value: self.worker.send('blink_brightness', int(value)))
+            self.worker.start(self.blink_brightness.get())
         
         # Iniciar threads
         self.running = True
@@ -499,18 +943,12 @@ class BrainBulbApp:
     def connect_thinkgear(self):
         """Intenta conectar con el servicio ThinkGear"""
         try:
-            self.thinkgear = ThinkGearClient()
+            # Conexión supervisada: si el conector no está, se sigue intentando
+            self.thinkgear = ThinkGearClient(reconnect=True)
+            self._register_thinkgear_handlers()
             success = self.thinkgear.connect()
             
             if success:
-                # Registrar handlers
-                self.thinkgear.attention_handlers.append(
-                    lambda value: self.processor.update('attention', value))
-                self.thinkgear.meditation_handlers.append(
-                    lambda value: self.processor.update('meditation', value))
-                self.thinkgear.blink_handlers.append(
-                    lambda value: self.processor.update('blink', value))
-                    
                 print("Conectado a ThinkGear")
                 return True
             else:
@@ -520,14 +958,34 @@ class BrainBulbApp:
             print(f"Error conectando con ThinkGear: {e}")
             return False
     
+    def _register_thinkgear_handlers(self):
+        """Conecta las señales de ThinkGear con el procesador
+
+        Con BRAINBULB_ISOLATE_HANDLERS=1 el procesador se ejecuta fuera del
+        hilo lector, en una única cola acotada (conserva el orden de eventos).
+        """
+        update = self.processor.update
+        thinkgear = self.thinkgear
+        if self.handler_executor is not None:
+            if self._processor_subscriber is None:
+                self._processor_subscriber = self.handler_executor.subscribe(
+                    update, maxsize=256, policy='drop-oldest', name='processor')
+            update = self._processor_subscriber
+        thinkgear.attention_handlers.append(
+            lambda value: update('attention', value, thinkgear.sample_time))
+        thinkgear.meditation_handlers.append(
+            lambda value: update('meditation', value, thinkgear.sample_time))
+        thinkgear.blink_handlers.append(
+            lambda value: update('blink', value, thinkgear.sample_time))
+    
     def _load_calibration(self):
         """Carga calibración desde archivo si existe"""
         cal = load_calibration()
-        if cal:
-            self.processor.attention_threshold = cal.get("attention", self.processor.attention_threshold)
-            self.processor.meditation_threshold = cal.get("meditation", self.processor.meditation_threshold)
-            self.processor.blink_threshold = cal.get("blink", self.processor.blink_threshold)
+        if apply_calibration(self.processor, cal):
             print(_("calibration_loaded"))
+        # En modo worker las etapas opcionales viven en el proceso del worker
+        if self.worker is None:
+            attach_optional_stages(self.processor, cal)
     
     def _setup_ui(self):
         """Configura la interfaz gráfica"""
@@ -631,6 +1089,14 @@ class BrainBulbApp:
                                   command=self._start_calibration)
         btn_calibrate.pack(side="left", padx=5)
         
+        # Perfilado bajo demanda (pilas de todos los hilos y, opcionalmente, memoria)
+        self.btn_profile = ttk.Button(frame_actions, text="Perfilar",
+                                      command=self._start_profiling)
+        self.btn_profile.pack(side="left", padx=5)
+        self.profile_memory = tk.BooleanVar(value=False)
+        ttk.Checkbutton(frame_actions, text="Memoria (tracemalloc)",
+                        variable=self.profile_memory).pack(side="left", padx=5)
+        
         # Añadir logs
         frame_logs = ttk.LabelFrame(parent, text=_("logs"))
         frame_logs.pack(fill="both", expand=True, padx=10, pady=5)
@@ -775,6 +1241,13 @@ class BrainBulbApp:
         self.processor.attention_threshold = self.attention_threshold.get()
         self.processor.meditation_threshold = self.meditation_threshold.get()
         self.processor.blink_threshold = self.blink_threshold.get()
+        if self.processor.adaptive is not None:
+            self.processor.adaptive.anchor('attention', self.processor.attention_threshold)
+            self.processor.adaptive.anchor('meditation', self.processor.meditation_threshold)
+        if self.worker is not None:
+            self.worker.set_thresholds(self.processor.attention_threshold,
+                                       self.processor.meditation_threshold,
+                                       self.processor.blink_threshold)
         print(f"Umbrales aplicados: Atención={self.processor.attention_threshold}, "
               f"Meditación={self.processor.meditation_threshold}, Parpadeo={self.processor.blink_threshold}")
         self._save_calibration()
@@ -794,45 +1267,60 @@ class BrainBulbApp:
             messagebox.showerror(_("error"), _("invalid_port"))
             return
         
+        if self.worker is not None:
+            self.worker.reconnect(new_esp8266_ip, new_esp8266_port,
+                                  self.thinkgear_host.get(), int(self.thinkgear_port.get()))
+            print("Dispositivos reconectados")
+            return
+        
         if new_esp8266_ip != self.bulb_controller.ip_address or new_esp8266_port != self.bulb_controller.port:
+            previous = self.bulb_controller
             self.bulb_controller = SmartBulbController(new_esp8266_ip, new_esp8266_port)
+            previous.close()  # Sus hilos de polling/reconexión terminan
         
-        # Reconectar ThinkGear
+        # Reconectar ThinkGear (los handlers ya registrados se conservan)
+        host = self.thinkgear_host.get()
+        port = int(self.thinkgear_port.get())
         if self.thinkgear:
-            self.thinkgear.disconnect()
-            
-        self.thinkgear = ThinkGearClient(
-            host=self.thinkgear_host.get(),
-            port=int(self.thinkgear_port.get())
-        )
-        self.thinkgear.connect()
-        
-        # Registrar handlers
-        if self.thinkgear.connected:
-            self.thinkgear.attention_handlers.append(
-                lambda value: self.processor.update('attention', value))
-            self.thinkgear.meditation_handlers.append(
-                lambda value: self.processor.update('meditation', value))
-            self.thinkgear.blink_handlers.append(
-                lambda value: self.processor.update('blink', value))
+            self.thinkgear.reconnect_to(host, port)
+        else:
+            self.thinkgear = ThinkGearClient(host=host, port=port, reconnect=True)
+            self._register_thinkgear_handlers()
+            self.thinkgear.connect()
         
         print("Dispositivos reconectados")
     
     def _start_calibration(self):
         """Inicia el proceso de calibración"""
-        def on_done():
-            messagebox.showinfo(_("info"), _("calibration_done"))
+        def on_done(ok):
+            if ok:
+                messagebox.showinfo(_("info"), _("calibration_done"))
+            else:
+                messagebox.showwarning(_("error"), _("calibration_failed"))
         self.processor.calibrate(callback=on_done)
         messagebox.showinfo(_("info"), _("calibration_started"))
     
+    def _start_profiling(self):
+        """Perfila la aplicación (o el worker) durante profiling.DEFAULT_SECONDS segundos"""
+        def on_done(result, error):
+            if error is not None:
+                self._log(f"Perfilado no realizado: {error}")
+                return
+            self._log(f"Perfil guardado en {result['stacks']} ({result['samples']} muestras)")
+            if result.get('allocations'):
+                self._log(f"Informe de memoria en {result['allocations']}")
+        
+        seconds = profiling.DEFAULT_SECONDS
+        memory = self.profile_memory.get()
+        if self.worker is not None:
+            self.worker.profile(seconds, memory, callback=on_done)
+        else:
+            profiling.profile_async(seconds, memory, callback=on_done)
+        self._log(f"Perfilando durante {seconds} s...")
+    
     def _save_calibration(self):
         """Guarda calibración actual"""
-        thresholds = {
-            "attention": self.processor.attention_threshold,
-            "meditation": self.processor.meditation_threshold,
-            "blink": self.processor.blink_threshold
-        }
-        if save_calibration(thresholds):
+        if save_calibration(self.processor.get_calibration()):
             messagebox.showinfo(_("info"), _("calibration_saved"))
         else:
             messagebox.showerror(_("error"), "No se pudo guardar calibración.")
@@ -861,10 +1349,7 @@ class BrainBulbApp:
             while True:
                 msg = self.queue.get_nowait()
                 if msg["type"] == "log":
-                    self.logs_text.config(state="normal")
-                    self.logs_text.insert("end", msg["text"] + "\n")
-                    self.logs_text.see("end")
-                    self.logs_text.config(state="disabled")
+                    self._append_text(self.logs_text, msg["text"] + "\n")
         except queue.Empty:
             pass
         self.root.after(500, self._process_queue)
@@ -872,6 +1357,16 @@ class BrainBulbApp:
     def _log(self, text):
         self.queue.put({"type": "log", "text": text})
     
+    def _append_text(self, widget, text, max_lines=MAX_TEXT_LINES):
+        """Añade texto a un registro de solo lectura conservando las últimas max_lines líneas"""
+        widget.config(state="normal")
+        widget.insert("end", text)
+        excess = int(widget.index("end-1c").split(".")[0]) - 1 - max_lines
+        if excess > 0:
+            widget.delete("1.0", f"{excess + 1}.0")
+        widget.see("end")
+        widget.config(state="disabled")
+    
     def _control_loop(self):
         """Bucle principal de control que ejecuta comandos detectados"""
         last_signal_quality = 200
@@ -907,24 +1402,23 @@ class BrainBulbApp:
                         self._log(f"{_('signal_quality')}: {q}")
                 
                 # Procesar comandos mentales
-                command = self.processor.get_command()
+                command, trace = self.processor.pop_command()
                 if command:
                     # Actualizar UI
-                    self.commands_text.config(state="normal")
-                    self.commands_text.insert("end", f"{time.strftime('%H:%M:%S')}: {command}\n")
-                    self.commands_text.see("end")
-                    self.commands_text.config(state="disabled")
+                    self._append_text(self.commands_text, f"{time.strftime('%H:%M:%S')}: {command}\n")
                     
                     # Log
                     self._log(f"{time.strftime('%H:%M:%S')}: {command}")
                     
-                    # Enviar comando al foco
-                    if command == "foco_on":
-                        self.bulb_controller.turn_on()
+                    # Enviar comando al foco (en modo worker ya lo ha hecho el worker)
+                    if self.worker is not None:
+                        pass
+                    elif command == "foco_on":
+                        self.bulb_controller.turn_on(trace)
                     elif command == "foco_off":
-                        self.bulb_controller.turn_off()
+                        self.bulb_controller.turn_off(trace)
                     elif command == "ajustar_brillo":
-                        self.bulb_controller.set_brightness(self.blink_brightness.get())
+                        self.bulb_controller.set_brightness(self.blink_brightness.get(), trace)
                 
                 time.sleep(0.1)
             except Exception as e:
@@ -933,6 +1427,12 @@ class BrainBulbApp:
 
 # Punto de entrada principal
 if __name__ == "__main__":
+    # Exposición de métricas opcional para un scraper local
+    # (con /profile para perfilar sin GUI)
+    if os.environ.get("BRAINBULB_METRICS_PORT"):
+        serve_metrics(int(os.environ["BRAINBULB_METRICS_PORT"]),
+                      routes={'/profile': profiling.http_route})
     root = tk.Tk()
     app = BrainBulbApp(root)
+    profiling.install_signal_handler(log=app._log)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,142 @@
+'''
+Umbrales adaptativos en línea para BrainSignalProcessor.
+
+Los niveles de atención y meditación de una misma persona derivan mucho a lo
+largo de una sesión larga, y un umbral fijo acaba disparando de más o de
+menos. AdaptiveThresholds mantiene por señal una media y una varianza con
+ponderación exponencial (O(1) por muestra) y deriva el umbral como
+
+    umbral = media + k * desviación
+
+recortado a [min_threshold, max_threshold]. El umbral del procesador solo
+se mueve cuando el objetivo se aleja `hysteresis` puntos o más (histéresis),
+así que no oscila con el ruido. Las muestras por encima de media + 3σ se
+recortan antes de actualizar las estadísticas para que los propios gestos no
+arrastren la línea base.
+
+Las estadísticas se exportan dentro de calibration.json (clave "adaptive")
+y se restauran al arrancar, sin repetir el calentamiento.
+
+Uso:
+    adaptive = AdaptiveThresholds(halflife=300)
+    adaptive.attach_processor(processor)
+'''
+import math
+
+SIGNALS = ('attention', 'meditation')
+
+
+class EWStats(object):
+    """Media y varianza con ponderación exponencial, actualizadas en O(1)"""
+
+    def __init__(self, halflife=300.0, mean=0.0, var=0.0, count=0):
+        self.halflife = halflife
+        self.alpha = 1.0 - 0.5 ** (1.0 / halflife)
+        self.mean = mean
+        self.var = var
+        self.count = count
+
+    def push(self, x):
+        if self.count == 0:
+            self.mean = float(x)
+            self.var = 0.0
+        else:
+            diff = x - self.mean
+            incr = self.alpha * diff
+            self.mean += incr
+            self.var = (1.0 - self.alpha) * (self.var + diff * incr)
+        self.count += 1
+
+    @property
+    def std(self):
+        return math.sqrt(self.var)
+
+    def to_dict(self):
+        return {'mean': self.mean, 'var': self.var, 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, data, halflife=300.0):
+        return cls(halflife, data.get('mean', 0.0), data.get('var', 0.0),
+                   data.get('count', 0))
+
+
+class AdaptiveThresholds(object):
+    """Deriva attention_threshold y meditation_threshold de estadísticas en línea"""
+
+    def __init__(self, halflife=300.0, k=2.0, hysteresis=3, warmup=60,
+                 min_threshold=30, max_threshold=95, clip_sigma=3.0):
+        self.halflife = halflife
+        self.k = {signal: k for signal in SIGNALS}
+        self.hysteresis = hysteresis
+        self.warmup = warmup
+        self.min_threshold = min_threshold
+        self.max_threshold = max_threshold
+        self.clip_sigma = clip_sigma
+        self.stats = {signal: EWStats(halflife) for signal in SIGNALS}
+        self.updates = 0
+        self.processor = None
+
+    def attach_processor(self, processor):
+        """Conecta el adaptador: BrainSignalProcessor.update() le pasa cada muestra"""
+        processor.adaptive = self
+        self.processor = processor
+
+    def observe(self, signal_type, value):
+        """Actualiza las estadísticas de la señal y, si procede, su umbral"""
+        stats = self.stats.get(signal_type)
+        if stats is None:
+            return
+        if stats.count >= self.warmup:
+            # Recortar los picos para que los gestos no arrastren la línea base
+            value = min(value, stats.mean + self.clip_sigma * stats.std)
+        stats.push(value)
+        if stats.count < self.warmup or self.processor is None:
+            return
+        name = signal_type + '_threshold'
+        target = self.target(signal_type)
+        if abs(target - getattr(self.processor, name)) >= self.hysteresis:
+            setattr(self.processor, name, target)
+            self.updates += 1
+
+    def target(self, signal_type):
+        """Umbral que corresponde a las estadísticas actuales"""
+        stats = self.stats[signal_type]
+        target = int(round(stats.mean + self.k[signal_type] * stats.std))
+        return max(self.min_threshold, min(self.max_threshold, target))
+
+    def anchor(self, signal_type, threshold):
+        """Ajusta k para que el umbral actual sea `threshold` (tras calibrar o fijarlo a mano)"""
+        stats = self.stats.get(signal_type)
+        if stats is None or stats.count < self.warmup or stats.std <= 0:
+            return
+        self.k[signal_type] = (threshold - stats.mean) / stats.std
+
+    def ready(self, signal_type):
+        return self.stats[signal_type].count >= self.warmup
+
+    def to_dict(self):
+        """Estado exportable a calibration.json"""
+        return {
+            'halflife': self.halflife,
+            'k': dict(self.k),
+            'hysteresis': self.hysteresis,
+            'warmup': self.warmup,
+            'min_threshold': self.min_threshold,
+            'max_threshold': self.max_threshold,
+            'clip_sigma': self.clip_sigma,
+            'stats': {signal: stats.to_dict() for signal, stats in self.stats.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        adaptive = cls(halflife=data.get('halflife', 300.0),
+                       hysteresis=data.get('hysteresis', 3),
+                       warmup=data.get('warmup', 60),
+                       min_threshold=data.get('min_threshold', 30),
+                       max_threshold=data.get('max_threshold', 95),
+                       clip_sigma=data.get('clip_sigma', 3.0))
+        adaptive.k.update(data.get('k', {}))
+        for signal, stats in data.get('stats', {}).items():
+            if signal in adaptive.stats:
+                adaptive.stats[signal] = EWStats.from_dict(stats, adaptive.halflife)
+        return adaptive
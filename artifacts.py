@@ -0,0 +1,233 @@
+'''
+Rechazo de artefactos por bloques sobre la señal cruda del headset.
+
+ArtifactRejector acumula las muestras de raw_value_handlers en bloques y
+evalúa cada bloque de forma vectorizada:
+
+ - saturación: muestras con |x| >= clip_level (el ADC del MindWave es de 12 bits)
+ - línea plana: bloques cuyo rango pico a pico no supera flat_range
+ - picos: z-score respecto a media/varianza móviles (exponenciales) de los
+   bloques limpios anteriores, típico de movimientos oculares
+
+Las estadísticas solo aprenden de muestras limpias, así que un cambio
+sostenido de la línea base (el electrodo se desplaza) marcaría todos los
+bloques siguientes como picos. Tras `reseed_blocks` bloques malos seguidos
+se vuelven a sembrar con la mediana y la dispersión robusta (MAD) del
+último bloque, de modo que el rechazador sigue a la nueva línea base.
+
+Mientras un bloque tenga más de max_bad_fraction muestras marcadas, y durante
+`hold` segundos después, el rechazador se considera en artefacto. Un
+BrainSignalProcessor conectado con attach_processor() suprime o anota los
+gestos detectados en ese intervalo.
+
+`python artifacts.py` ejecuta las comprobaciones de regresión del módulo.
+'''
+import sys
+
+import numpy as np
+
+
+class ArtifactRejector(object):
+    """Etapa de rechazo de artefactos por bloques sobre muestras crudas"""
+
+    def __init__(self, sample_rate=512, block=64, clip_level=2040, flat_range=1,
+                 z_threshold=6.0, alpha=0.05, max_bad_fraction=0.05, hold=1.0,
+                 reseed_blocks=16):
+        self.sample_rate = sample_rate
+        self.block = block
+        self.clip_level = clip_level
+        self.flat_range = flat_range
+        self.z_threshold = z_threshold
+        self.alpha = alpha
+        self.max_bad_fraction = max_bad_fraction
+        self.hold_samples = int(hold * sample_rate)
+        self.reseed_blocks = reseed_blocks
+
+        self._stage = np.zeros(block)
+        self._staged = 0
+        self._mean = None
+        self._var = None
+        self._since_bad = self.hold_samples
+        self._bad_run = 0
+        self.artifact = False
+        self.last_mask = np.zeros(block, dtype=bool)
+        self.last_flags = {}
+
+        # Contadores
+        self.blocks = 0
+        self.bad_blocks = 0
+        self.clipped_samples = 0
+        self.flat_blocks = 0
+        self.spike_samples = 0
+        self.reseeds = 0
+
+        # Callbacks: handler(rejector, flags)
+        self.artifact_handlers = []
+        self.clean_handlers = []
+
+        self.headset = None
+
+    def push_sample(self, value):
+        """Añade una muestra cruda; procesa el bloque cuando se completa"""
+        self._stage[self._staged] = value
+        self._staged += 1
+        if self._staged == self.block:
+            self._staged = 0
+            self.process(self._stage)
+
+    def push(self, samples):
+        """Añade un bloque arbitrario de muestras crudas"""
+        samples = np.asarray(samples, dtype=np.float64)
+        pos = 0
+        n = len(samples)
+        if self._staged:
+            take = min(self.block - self._staged, n)
+            self._stage[self._staged:self._staged + take] = samples[:take]
+            self._staged += take
+            pos = take
+            if self._staged == self.block:
+                self._staged = 0
+                self.process(self._stage)
+        while n - pos >= self.block:
+            self.process(samples[pos:pos + self.block])
+            pos += self.block
+        rest = n - pos
+        if rest:
+            self._stage[:rest] = samples[pos:]
+            self._staged = rest
+
+    def process(self, x):
+        """Evalúa un bloque y devuelve la máscara de muestras con artefacto"""
+        clip = np.abs(x) >= self.clip_level
+        flat = np.ptp(x) <= self.flat_range
+        if self._mean is None:
+            spike = np.zeros(len(x), dtype=bool)
+        else:
+            limit = self.z_threshold * np.sqrt(self._var)
+            spike = np.abs(x - self._mean) > limit
+        mask = clip | spike
+        if flat:
+            mask[:] = True
+
+        # Actualizar estadísticas solo con muestras limpias
+        clean = x[~mask]
+        if len(clean) > 1:
+            mean = clean.mean()
+            var = clean.var() + 1e-6
+            if self._mean is None:
+                self._mean, self._var = mean, var
+            else:
+                a = self.alpha
+                delta = mean - self._mean
+                self._mean += a * delta
+                self._var = (1 - a) * (self._var + a * delta * delta) + a * var
+
+        n_clip = int(clip.sum())
+        n_spike = int(spike.sum())
+        bad_fraction = float(mask.mean())
+        self.blocks += 1
+        self.clipped_samples += n_clip
+        self.spike_samples += n_spike
+        if flat:
+            self.flat_blocks += 1
+        self.last_mask = mask
+        self.last_flags = {
+            'clipped': n_clip,
+            'flat': bool(flat),
+            'spikes': n_spike,
+            'bad_fraction': bad_fraction,
+        }
+
+        if bad_fraction > self.max_bad_fraction:
+            self.bad_blocks += 1
+            self._since_bad = 0
+            self._bad_run += 1
+            if self._bad_run >= self.reseed_blocks and not flat:
+                self._reseed(x[~clip])
+        else:
+            self._since_bad += len(x)
+            self._bad_run = 0
+        self._update_state()
+        return mask
+
+    def _reseed(self, x):
+        # Demasiados bloques malos seguidos: la línea base ha cambiado y las
+        # estadísticas ya no la describen. Mediana y MAD ignoran los picos
+        # que pueda haber en el propio bloque.
+        if len(x) < 2:
+            return
+        median = np.median(x)
+        spread = 1.4826 * np.median(np.abs(x - median))
+        self._mean = median
+        self._var = spread * spread + 1e-6
+        self._bad_run = 0
+        self.reseeds += 1
+
+    def _update_state(self):
+        artifact = self._since_bad < self.hold_samples
+        if artifact != self.artifact:
+            self.artifact = artifact
+            handlers = self.artifact_handlers if artifact else self.clean_handlers
+            for handler in handlers:
+                handler(self, self.last_flags)
+
+    def is_artifact(self):
+        """True si hay un artefacto reciente en la señal"""
+        return self.artifact
+
+    def attach(self, headset):
+        """Recibe las muestras crudas desde raw_value_handlers del headset"""
+        self.headset = headset
+        headset.raw_value_handlers.append(self._on_raw_value)
+
+    def detach(self):
+        if self.headset is not None:
+            try:
+                self.headset.raw_value_handlers.remove(self._on_raw_value)
+            except ValueError:
+                pass
+            self.headset = None
+
+    def _on_raw_value(self, headset, value):
+        self.push_sample(value)
+
+    def attach_processor(self, processor, policy='suppress'):
+        """Conecta el rechazador a BrainSignalProcessor ('suppress' o 'annotate')"""
+        processor.artifact_gate = self
+        processor.artifact_policy = policy
+
+    def stats(self):
+        return {
+            'blocks': self.blocks,
+            'bad_blocks': self.bad_blocks,
+            'clipped_samples': self.clipped_samples,
+            'flat_blocks': self.flat_blocks,
+            'spike_samples': self.spike_samples,
+            'reseeds': self.reseeds,
+            'artifact': self.artifact,
+        }
+
+
+def check_baseline_shift(seconds=60, shift=200.0, sigma=15.0, seed=0):
+    """Regresión: tras un salto sostenido de la línea base el rechazador
+    debe volver a estado limpio en vez de quedarse en artefacto para siempre
+
+    Devuelve (ok, stats).
+    """
+    rng = np.random.default_rng(seed)
+    rejector = ArtifactRejector()
+    n = seconds * rejector.sample_rate
+    before = rng.normal(0.0, sigma, n // 2)
+    after = rng.normal(shift, sigma, n - n // 2)
+    rejector.push(before)
+    rejector.push(after)
+    stats = rejector.stats()
+    # El salto puede marcar como malos unos pocos bloques, no la mitad final
+    ok = not stats['artifact'] and stats['bad_blocks'] <= 2 * rejector.reseed_blocks
+    return ok, stats
+
+
+if __name__ == '__main__':
+    ok, stats = check_baseline_shift()
+    print(f"baseline_shift: {'OK' if ok else 'FALLO'} {stats}")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,385 @@
+'''
+Benchmarks repetibles de las rutas críticas, con línea base almacenada.
+
+Cada caso ejecuta una operación muchas veces, repite la medida y se queda con
+la mejor repetición (ns por operación). Justo antes de cada caso se mide un
+bucle de calibración en Python puro y el resultado se guarda en unidades de
+ese bucle, así que la línea base no depende de la velocidad de la máquina
+ni de su frecuencia en ese momento. Los resultados se comparan con
+benchmark_baseline.json y el proceso termina con código 1 si algún caso es
+más lento que la línea base más la tolerancia; la tolerancia se amplía con
+el ruido medido (dispersión entre repeticiones) de la ejecución actual y de
+la línea base.
+
+Un caso puede devolver `run` o `(run, close)`; `close` se llama al final
+para borrar ficheros temporales o parar hilos y servidores.
+
+Uso:
+    python benchmark.py                  # comparar con la línea base
+    python benchmark.py --save           # guardar la línea base actual
+    python benchmark.py -k parse --tolerance 0.5
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'benchmark_baseline.json')
+CASES = []
+
+
+def case(ops):
+    """Registra un benchmark; la función recibe `ops` y ejecuta esa cantidad de operaciones"""
+    def register(fn):
+        CASES.append((fn.__name__.replace('bench_', ''), fn, ops))
+        return fn
+    return register
+
+
+def _byte_stream(seconds=20):
+    """Flujo de bytes como el del dongle: 512 paquetes raw y 1 eSense por segundo"""
+    from mindwave import encode_packet, RAW_VALUE, POOR_SIGNAL, ATTENTION, MEDITATION
+    rng = random.Random(0)
+    packets = []
+    for _second in range(seconds):
+        for _i in range(512):
+            raw = rng.randint(-2048, 2047) & 0xffff
+            packets.append(encode_packet([RAW_VALUE, 2, raw >> 8, raw & 0xff]))
+        packets.append(encode_packet([POOR_SIGNAL, 0, ATTENTION, rng.randint(0, 100),
+                                      MEDITATION, rng.randint(0, 100)]))
+    return packets
+
+
+def _headset():
+    from mindwave import Headset
+    headset = Headset('benchmark', open_serial=False)
+    headset.raw_value_handlers.append(lambda h, v: None)
+    headset.attention_handlers.append(lambda h, v: None)
+    return headset
+
+
+@case(ops=10240)
+def bench_parse_payload(ops):
+    from mindwave import Headset
+    listener = Headset.DongleListener(_headset())
+    payloads = [p[3:-1] for p in _byte_stream(20)][:ops]
+
+    def run():
+        parse = listener.parse_payload
+        for payload in payloads:
+            parse(payload)
+    return run
+
+
+@case(ops=10260)
+def bench_dongle_feed(ops):
+    """Bytes -> paquetes -> parse_payload, en lecturas de 64 bytes (ops = paquetes)"""
+    from mindwave import Headset
+    stream = b''.join(_byte_stream(20))
+    chunks = [stream[i:i + 64] for i in range(0, len(stream), 64)]
+
+    def run():
+        listener = Headset.DongleListener(_headset())
+        for chunk in chunks:
+            listener.feed(chunk)
+    return run
+
+
+@case(ops=5000)
+def bench_thinkgear_process_json(ops):
+    from BrainHomeController import ThinkGearClient
+    client = ThinkGearClient()
+    client.attention_handlers.append(lambda v: None)
+    client.meditation_handlers.append(lambda v: None)
+    client.blink_handlers.append(lambda v: None)
+    rng = random.Random(0)
+    lines = []
+    for i in range(ops):
+        if i % 10 == 9:
+            lines.append('{"blinkStrength": %d}' % rng.randint(30, 90))
+        else:
+            lines.append(json.dumps({'eSense': {'attention': rng.randint(0, 100),
+                                                'meditation': rng.randint(0, 100)},
+                                     'poorSignalLevel': 0}))
+
+    def run():
+        process = client._process_json_data
+        for line in lines:
+            process(line)
+    return run
+
+
+@case(ops=20000)
+def bench_processor_update(ops):
+    from BrainHomeController import BrainSignalProcessor
+    rng = random.Random(0)
+    kinds = ('attention', 'meditation', 'blink')
+    updates = [(kinds[i % 3], rng.randint(0, 100)) for i in range(ops)]
+
+    def run():
+        processor = BrainSignalProcessor()
+        update = processor.update
+        for kind, value in updates:
+            update(kind, value)
+    return run
+
+
+@case(ops=20000)
+def bench_offline_dequeue(ops):
+    from mindwave import OfflineHeadset
+    rng = random.Random(0)
+    fd, path = tempfile.mkstemp(suffix='.txt')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for i in range(ops):
+                f.write(f"{i} {rng.randint(-2048, 2047)} {rng.randint(0, 100)} "
+                        f"{rng.randint(0, 100)} 0\r\n")
+    except BaseException:
+        os.unlink(path)
+        raise
+
+    def run():
+        headset = OfflineHeadset(path)
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                for _ in range(ops):
+                    headset.dequeue()
+            finally:
+                sys.stdout = stdout
+        headset.close()
+    return run, lambda: os.unlink(path)
+
+
+class _BulbStandIn(BaseHTTPRequestHandler):
+    """Sustituto local de los endpoints /status y /command del ESP8266"""
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+        body = b'{"state": "on", "brightness": 100}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _reply
+    do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+@case(ops=200)
+def bench_send_command(ops):
+    from BrainHomeController import SmartBulbController
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _BulbStandIn)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            bulb = SmartBulbController('127.0.0.1', server.server_port)
+        finally:
+            sys.stdout = stdout
+
+    def run():
+        for i in range(ops):
+            bulb.send_command('set', {'state': 'on' if i % 2 else 'off'})
+
+    def close():
+        # Sin esto el polling de estado sigue golpeando el servidor en los casos siguientes
+        bulb.close()
+        server.shutdown()
+        server.server_close()
+    return run, close
+
+
+@case(ops=51200)
+def bench_band_power_engine(ops):
+    from spectral import BandPowerEngine
+    rng = random.Random(0)
+    samples = [rng.gauss(0, 50) for _ in range(ops)]
+
+    def run():
+        engine = BandPowerEngine()
+        push = engine.push_sample
+        for value in samples:
+            push(value)
+    return run
+
+
+@case(ops=51200)
+def bench_sliding_dft(ops):
+    from spectral import SlidingDFTTracker
+    rng = random.Random(0)
+    samples = [rng.gauss(0, 50) for _ in range(ops)]
+
+    def run():
+        tracker = SlidingDFTTracker()
+        push = tracker.push_sample
+        for value in samples:
+            push(value)
+    return run
+
+
+@case(ops=51200)
+def bench_artifact_rejector(ops):
+    from artifacts import ArtifactRejector
+    rng = random.Random(0)
+    samples = [rng.gauss(0, 50) for _ in range(ops)]
+
+    def run():
+        rejector = ArtifactRejector()
+        push = rejector.push_sample
+        for value in samples:
+            push(value)
+    return run
+
+
+CALIBRATION_OPS = 100000
+
+
+def _calibration(ops=CALIBRATION_OPS):
+    """Bucle de referencia: aritmética, diccionario y lista como en las rutas medidas"""
+    def run():
+        table = {}
+        values = []
+        total = 0
+        for i in range(ops):
+            total += (i * 7) % 13
+            table[i & 255] = total
+            values.append(total)
+            if len(values) > 64:
+                values.pop(0)
+    return run
+
+
+def measure(fn, ops, repeat=5):
+    """Coste por operación de un caso en unidades del bucle de calibración
+
+    Cada repetición del caso va precedida de una del bucle de calibración y
+    se toma el cociente de ambas, de modo que los cambios de frecuencia o de
+    carga que duran más que una repetición se cancelan. Devuelve (relativo,
+    ns, ruido): la mediana de los cocientes, el mejor ns por operación del
+    caso y la dispersión de los cocientes (recorrido intercuartílico /
+    mediana) como estimación del ruido.
+    """
+    calibrate = _calibration()
+    run = fn(ops)
+    close = None
+    if isinstance(run, tuple):
+        run, close = run
+    try:
+        calibrate()
+        run()  # calentamiento
+        ratios = []
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            calibrate()
+            unit = (time.perf_counter() - start) / CALIBRATION_OPS
+            start = time.perf_counter()
+            run()
+            elapsed = (time.perf_counter() - start) / ops
+            ratios.append(elapsed / unit)
+            best = elapsed if best is None or elapsed < best else best
+    finally:
+        if close is not None:
+            close()
+    ratios.sort()
+    median = ratios[len(ratios) // 2]
+    spread = ratios[(3 * len(ratios)) // 4] - ratios[len(ratios) // 4]
+    return median, best * 1e9, spread / median
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'system': platform.system(),
+    }
+
+
+def load_baseline(path=BASELINE_FILE):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks con línea base")
+    parser.add_argument('-k', dest='filter', default='', help="Ejecutar solo casos que contengan este texto")
+    parser.add_argument('--repeat', type=int, default=9)
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Regresión mínima permitida (0.25 = 25%%); se amplía con el ruido medido")
+    parser.add_argument('--noise-factor', type=float, default=3.0,
+                        help="La tolerancia de cada caso es al menos este factor por el ruido medido")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save', action='store_true', help="Guardar los resultados como línea base")
+    args = parser.parse_args(argv)
+
+    baseline = load_baseline(args.baseline)
+    reference = (baseline or {}).get('relative', {})
+    reference_noise = (baseline or {}).get('noise', {})
+    if baseline and 'relative' not in baseline:
+        print("Aviso: línea base en ns absolutos (formato antiguo); se ignora, use --save")
+    elif baseline and baseline.get('machine') != machine_info():
+        print("Aviso: la línea base se grabó en otra máquina; las comparaciones son orientativas")
+
+    results = {}
+    noise = {}
+    ns_results = {}
+    regressions = []
+    for name, fn, ops in CASES:
+        if args.filter not in name:
+            continue
+        relative, ns, case_noise = measure(fn, ops, args.repeat)
+        results[name] = relative
+        noise[name] = case_noise
+        ns_results[name] = ns
+        line = f"{name:<26} {ns / 1e3:10.3f} us/op {relative:10.2f} u  ruido {case_noise:5.1%}"
+        base = reference.get(name)
+        if base:
+            change = relative / base - 1.0
+            tolerance = max(args.tolerance, args.noise_factor *
+                            max(case_noise, reference_noise.get(name, 0.0)))
+            line += f"   base {base:10.2f} u  {change:+.1%} (tolerancia {tolerance:.0%})"
+            if change > tolerance:
+                line += "  REGRESIÓN"
+                regressions.append(name)
+        print(line)
+
+    if args.save:
+        merged = dict(reference) if args.filter else {}
+        merged.update(results)
+        merged_noise = dict(reference_noise) if args.filter else {}
+        merged_noise.update(noise)
+        merged_ns = dict(baseline.get('ns', {})) if args.filter and baseline else {}
+        merged_ns.update(ns_results)
+        with open(args.baseline, 'w') as f:
+            # 'ns' es solo informativo: las comparaciones usan 'relative'
+            json.dump({'machine': machine_info(), 'relative': merged, 'noise': merged_noise,
+                       'ns': merged_ns}, f, indent=2, sort_keys=True)
+        print(f"Línea base guardada en {args.baseline}")
+        return 0
+    if regressions:
+        print(f"Regresiones por encima de la tolerancia: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+'''
+Transporte UDP binario para los comandos del foco (ESP8266).
+
+Cada comando por HTTP es un POST completo con JSON que el ESP8266 tiene que
+aceptar, parsear y responder con WebServer. Este transporte envía los
+comandos "set" en un datagrama de 6 bytes y el firmware
+(BrainHomeController.ino, handleUdpCommands) responde con un ack de 7:
+
+    petición: magic (0xB5) | tipo | seq (uint16 BE) | estado | brillo
+    ack:      magic (0xB5) | 0x81 | seq (uint16 BE) | estado | brillo | resultado
+
+tipo 0x01 = set, 0x02 = estado; estado 0/1 = apagado/encendido; brillo
+1-100 o 0xFF para conservar el último. El ack devuelve el estado ya
+aplicado y resultado 0 (ok) o 1 (error).
+
+Si no llega el ack se retransmite el mismo seq con timeout creciente; el
+firmware reconoce el seq repetido y solo reenvía el ack, sin aplicar dos
+veces el comando. Si se agotan los reintentos SmartBulbController usa HTTP
+y, tras varios fallos seguidos, deja de intentar UDP durante un rato.
+
+Uso:
+    SmartBulbController(ip, udp_port=4210)    # o BRAINBULB_UDP_PORT=4210
+    python bulb_udp.py --commands 500 --loss 0.05   # contra el sustituto local
+    python bulb_udp.py --host 192.168.1.50          # contra el ESP8266 real
+'''
+import sys
+import time
+import random
+import socket
+import struct
+import argparse
+import threading
+
+from tracing import LatencyHistogram
+
+UDP_PORT = 4210
+MAGIC = 0xB5
+TYPE_SET = 0x01
+TYPE_STATUS = 0x02
+TYPE_ACK = 0x81
+NO_BRIGHTNESS = 0xFF
+
+REQUEST = struct.Struct('>BBHBB')
+ACK = struct.Struct('>BBHBBB')
+
+
+def encode_set(seq, state, brightness=None):
+    """Datagrama de un comando set; `state` es 'on' u 'off'"""
+    return REQUEST.pack(MAGIC, TYPE_SET, seq & 0xFFFF, 1 if state == 'on' else 0,
+                        NO_BRIGHTNESS if brightness is None else int(brightness))
+
+
+def decode_ack(data):
+    """(seq, respuesta) de un ack válido, o None"""
+    if len(data) < ACK.size:
+        return None
+    magic, kind, seq, state, brightness, result = ACK.unpack_from(data)
+    if magic != MAGIC or kind != TYPE_ACK:
+        return None
+    response = {'state': 'on' if state else 'off', 'brightness': brightness,
+                'status': 'ok' if result == 0 else 'error'}
+    return seq, response
+
+
+class UdpCommandTransport(object):
+    """Comandos set por UDP con número de secuencia, ack y retransmisión"""
+
+    def __init__(self, host, port=UDP_PORT, timeout=0.05, retries=2):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.retries = retries
+        self.seq = random.randrange(0x10000)
+        self.latency = LatencyHistogram()
+        self.retransmits = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Socket conectado: un puerto cerrado se detecta al momento (ICMP)
+        self.sock.connect(self.address)
+
+    def send_set(self, state, brightness=None):
+        """Envía un set y espera su ack; devuelve la respuesta o None si se agotan los reintentos"""
+        with self._lock:
+            self.seq = (self.seq + 1) & 0xFFFF
+            seq = self.seq
+            packet = encode_set(seq, state, brightness)
+            sock = self.sock
+            timeout = self.timeout
+            start = time.monotonic_ns()
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    self.retransmits += 1
+                try:
+                    sock.send(packet)
+                except OSError:
+                    break
+                deadline = time.monotonic() + timeout
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    sock.settimeout(remaining)
+                    try:
+                        data = sock.recv(64)
+                    except socket.timeout:
+                        break
+                    except OSError:
+                        # ICMP "port unreachable": nadie escucha, no tiene sentido reintentar
+                        self.failures += 1
+                        return None
+                    ack = decode_ack(data)
+                    if ack is not None and ack[0] == seq:
+                        self.latency.record(time.monotonic_ns() - start)
+                        return ack[1]
+                    # Acks retrasados de comandos anteriores: se ignoran
+                timeout *= 2
+            self.failures += 1
+            return None
+
+    def summary(self):
+        """Percentiles de ida y vuelta (µs), retransmisiones y fallos"""
+        summary = self.latency.summary()
+        summary['retransmits'] = self.retransmits
+        summary['failures'] = self.failures
+        return summary
+
+    def close(self):
+        self.sock.close()
+
+
+class UdpBulbStandIn(object):
+    """Sustituto local del lado UDP del firmware, con pérdida de paquetes opcional
+
+    Igual que handleUdpCommands(): aplica cada seq una sola vez y reenvía el
+    ack si llega repetido. `loss` descarta esa fracción de datagramas en
+    cada sentido.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, loss=0.0, delay=0.0, seed=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.settimeout(0.2)
+        self.loss = loss
+        self.delay = delay
+        self.rng = random.Random(seed)
+        self.state = {'state': 'off', 'brightness': 100}
+        self.applied = 0
+        self.duplicates = 0
+        self._last = None
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.sock.getsockname()[1]
+
+    def _run(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(64)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if len(data) < REQUEST.size or self.rng.random() < self.loss:
+                continue
+            magic, kind, seq, state, brightness = REQUEST.unpack_from(data)
+            if magic != MAGIC:
+                continue
+            result = 0
+            if kind == TYPE_SET:
+                if self._last == (addr, seq):
+                    self.duplicates += 1
+                else:
+                    if self.delay:
+                        time.sleep(self.delay)
+                    self.state['state'] = 'on' if state else 'off'
+                    if state and brightness != NO_BRIGHTNESS:
+                        self.state['brightness'] = brightness
+                    self.applied += 1
+            elif kind != TYPE_STATUS:
+                result = 1
+            self._last = (addr, seq)
+            if self.rng.random() < self.loss:
+                continue
+            ack = ACK.pack(MAGIC, TYPE_ACK, seq, self.state['state'] == 'on',
+                           self.state['brightness'], result)
+            try:
+                self.sock.sendto(ack, addr)
+            except OSError:
+                pass
+
+    def stop(self):
+        self.running = False
+        self.sock.close()
+
+
+def compare(host=None, udp_port=UDP_PORT, http_port=80, commands=500, loss=0.0):
+    """Percentiles de ida y vuelta por UDP y por HTTP (contra sustitutos locales si no hay host)"""
+    from http.server import ThreadingHTTPServer
+    from benchmark import _BulbStandIn
+    import requests
+
+    standins = []
+    if host is None:
+        udp_standin = UdpBulbStandIn(loss=loss)
+        http_standin = ThreadingHTTPServer(('127.0.0.1', 0), _BulbStandIn)
+        http_standin.daemon_threads = True
+        threading.Thread(target=http_standin.serve_forever, daemon=True).start()
+        standins = [udp_standin, http_standin]
+        host, udp_port, http_port = '127.0.0.1', udp_standin.port, http_standin.server_port
+
+    transport = UdpCommandTransport(host, udp_port)
+    for i in range(commands):
+        transport.send_set('on' if i % 2 else 'off', 1 + i % 100)
+
+    session = requests.Session()
+    http = LatencyHistogram()
+    for i in range(commands):
+        start = time.monotonic_ns()
+        try:
+            session.post(f"http://{host}:{http_port}/command", timeout=2,
+                         json={"cmd": "set", "params": {"state": 'on' if i % 2 else 'off'}})
+        except requests.RequestException:
+            continue
+        http.record(time.monotonic_ns() - start)
+
+    for standin in standins:
+        if isinstance(standin, UdpBulbStandIn):
+            standin.stop()
+        else:
+            standin.shutdown()
+    transport.close()
+    return {'udp': transport.summary(), 'http': http.summary()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Latencia de comandos UDP frente a HTTP")
+    parser.add_argument('--host', help="IP del ESP8266 (por defecto, sustitutos locales)")
+    parser.add_argument('--udp-port', type=int, default=UDP_PORT)
+    parser.add_argument('--http-port', type=int, default=80)
+    parser.add_argument('--commands', type=int, default=500)
+    parser.add_argument('--loss', type=float, default=0.0,
+                        help="Pérdida de datagramas del sustituto local (0-1)")
+    args = parser.parse_args(argv)
+    results = compare(args.host, args.udp_port, args.http_port, args.commands, args.loss)
+    for name, s in results.items():
+        if not s['count']:
+            print(f"{name:<5} sin respuestas")
+            continue
+        line = (f"{name:<5} n={s['count']:<5} p50={s['p50_us']:8.0f} us  p90={s['p90_us']:8.0f} us  "
+                f"p99={s['p99_us']:8.0f} us  max={s['max_us']:8.0f} us")
+        if 'retransmits' in s:
+            line += f"  retransmisiones={s['retransmits']} fallos={s['failures']}"
+        print(line)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
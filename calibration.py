@@ -0,0 +1,68 @@
+'''
+Motor de calibración vectorizado para BrainSignalProcessor.
+
+Recibe las muestras capturadas en las fases de relajación y concentración y
+evalúa en una sola pasada de NumPy toda una rejilla de umbrales y tamaños de
+ventana. Para cada combinación calcula la separación entre fases
+(P(alta > umbral) - P(baja > umbral), índice de Youden) sobre las medias de
+ventanas deslizantes y elige la que mejor las separa.
+'''
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+DEFAULT_THRESHOLDS = np.arange(1, 100)
+DEFAULT_WINDOWS = (3, 5, 7, 9)
+# Separación mínima (índice de Youden) para aceptar una calibración; por
+# debajo las fases no se distinguen y el umbral elegido sería arbitrario
+MIN_SEPARATION = 0.2
+
+
+def window_means(samples, window):
+    """Medias de todas las ventanas deslizantes de tamaño `window`"""
+    samples = np.asarray(samples, dtype=np.float64)
+    if len(samples) < window:
+        return None
+    return sliding_window_view(samples, window).mean(axis=1)
+
+
+def separation_grid(low, high, thresholds=DEFAULT_THRESHOLDS, windows=DEFAULT_WINDOWS):
+    """Matriz (ventanas x umbrales) con la separación entre la fase baja y la alta
+
+    Las combinaciones cuya ventana no cabe en alguna de las fases valen -inf.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    grid = np.full((len(windows), len(thresholds)), -np.inf)
+    for i, window in enumerate(windows):
+        low_means = window_means(low, window)
+        high_means = window_means(high, window)
+        if low_means is None or high_means is None:
+            continue
+        # (n_ventanas, 1) > (1, n_umbrales) -> tasa de ventanas sobre cada umbral
+        high_rate = (high_means[:, None] > thresholds[None, :]).mean(axis=0)
+        low_rate = (low_means[:, None] > thresholds[None, :]).mean(axis=0)
+        grid[i] = high_rate - low_rate
+    return grid
+
+
+def best_threshold(low, high, thresholds=DEFAULT_THRESHOLDS, windows=DEFAULT_WINDOWS,
+                   min_separation=MIN_SEPARATION):
+    """Elige el umbral y la ventana que mejor separan la fase baja de la alta
+
+    `high` es la fase en la que la señal debe superar el umbral. Ante empates
+    se prefiere la ventana más corta (menor latencia) y el umbral central del
+    tramo óptimo. Devuelve None si no hay datos suficientes o si la mejor
+    separación no supera `min_separation` (fases indistinguibles o invertidas).
+    """
+    thresholds = np.asarray(thresholds)
+    grid = separation_grid(low, high, thresholds, windows)
+    best = grid.max()
+    if not np.isfinite(best) or best <= min_separation:
+        return None
+    row = int(np.flatnonzero(grid.max(axis=1) == best)[0])
+    candidates = np.flatnonzero(grid[row] == best)
+    threshold = thresholds[candidates[len(candidates) // 2]]
+    return {
+        'threshold': int(threshold),
+        'window': int(windows[row]),
+        'score': float(best),
+    }
@@ -0,0 +1,131 @@
+'''
+Ejecución aislada de handlers con colas acotadas.
+
+Los handlers de Headset y ThinkGearClient se ejecutan en el hilo lector; uno
+lento retrasa la lectura del puerto y se pierden paquetes. HandlerExecutor
+envuelve cada suscriptor en una cola acotada atendida por su propio hilo:
+el hilo lector solo encola (coste constante) y la política de desbordamiento
+decide qué se pierde cuando el suscriptor no da abasto:
+
+ - 'drop-oldest':     descarta el evento más antiguo de la cola
+ - 'drop-newest':     descarta el evento que llega
+ - 'coalesce-latest': conserva solo el último evento pendiente
+
+Uso:
+    executor = HandlerExecutor()
+    slow = executor.subscribe(guardar_en_disco, maxsize=1024, policy='drop-oldest')
+    headset.raw_value_handlers.append(slow)
+'''
+import threading
+from collections import deque
+
+from metrics import registry
+
+POLICIES = ('drop-oldest', 'drop-newest', 'coalesce-latest')
+
+
+class Subscriber(object):
+    """Handler envuelto: al llamarlo encola los argumentos para su hilo"""
+
+    def __init__(self, handler, maxsize=256, policy='drop-oldest', name=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Política desconocida: {policy}")
+        self.handler = handler
+        self.maxsize = 1 if policy == 'coalesce-latest' else maxsize
+        self.policy = policy
+        self.name = name or getattr(handler, '__name__', 'handler')
+        self.dropped = 0
+        self.delivered = 0
+        self.errors = 0
+        self._queue = deque()
+        self._event = threading.Event()
+        self._idle = False
+        self.running = True
+        labels = {'subscriber': self.name, 'policy': policy}
+        self._dropped_counter = registry.counter(
+            'handler_events_dropped_total', 'Eventos descartados por desbordamiento', labels)
+        registry.gauge('handler_queue_depth', 'Eventos pendientes por suscriptor',
+                       {'subscriber': self.name}, fn=lambda: len(self._queue))
+        self.thread = threading.Thread(target=self._run, name=f"handler-{self.name}")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __call__(self, *args):
+        """Encola un evento (lo llama el hilo lector)"""
+        queue = self._queue
+        if len(queue) >= self.maxsize:
+            self.dropped += 1
+            self._dropped_counter.inc()
+            if self.policy == 'drop-newest':
+                return
+            if self.policy == 'coalesce-latest':
+                try:
+                    queue[-1] = args
+                    return
+                except IndexError:
+                    pass
+            else:
+                try:
+                    queue.popleft()
+                except IndexError:
+                    pass
+        queue.append(args)
+        if self._idle:
+            self._event.set()
+
+    def _run(self):
+        queue = self._queue
+        event = self._event
+        handler = self.handler
+        while self.running:
+            try:
+                args = queue.popleft()
+            except IndexError:
+                self._idle = True
+                if not queue:
+                    event.wait(0.5)
+                    event.clear()
+                self._idle = False
+                continue
+            try:
+                handler(*args)
+                self.delivered += 1
+            except Exception as e:
+                self.errors += 1
+                print(f"Error en handler {self.name}: {e}")
+
+    def pending(self):
+        return len(self._queue)
+
+    def stop(self):
+        self.running = False
+        self._event.set()
+
+    def stats(self):
+        return {
+            'policy': self.policy,
+            'pending': len(self._queue),
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
+
+
+class HandlerExecutor(object):
+    """Crea y supervisa suscriptores con colas acotadas"""
+
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, handler, maxsize=256, policy='drop-oldest', name=None):
+        subscriber = Subscriber(handler, maxsize, policy, name)
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def stop(self):
+        for subscriber in self.subscribers:
+            subscriber.stop()
+
+    def stats(self):
+        """Contadores por suscriptor, incluidos los eventos descartados"""
+        return {s.name: s.stats() for s in self.subscribers}
@@ -0,0 +1,322 @@
+'''
+Simulador del firmware del ESP8266 con inyección de fallos y generador de
+carga para SmartBulbController.
+
+ESP8266Simulator sirve /status, /command y /restart con las mismas
+respuestas JSON que BrainHomeController.ino y, según un perfil de fallos,
+añade a cada petición:
+
+ - latencia: fija, uniforme o lognormal (mediana y sigma)
+ - errores: respuesta 500 con una fracción `error_rate` de las peticiones
+ - resets: cierra la conexión con RST sin responder (`reset_rate`)
+ - cuelgues: no responde en `hang_seconds` (más que el timeout del cliente)
+ - caídas: durante outage(segundos) todas las peticiones se cortan, igual
+   que mientras el ESP8266 se reinicia tras /restart
+
+drive() lanza comandos contra un SmartBulbController conectado al
+simulador y mide comandos/s, latencias (p50/p99/máx), desconexiones y el
+tiempo de recuperación tras una caída.
+
+Uso:
+    python esp_sim.py --port 8080 --profile flaky     # solo el simulador
+    python esp_sim.py --drive                          # todos los perfiles
+    python esp_sim.py --drive --profile dropping --duration 20
+'''
+import sys
+import json
+import time
+import random
+import socket
+import struct
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tracing import LatencyHistogram
+
+
+class FaultProfile(object):
+    """Distribución de latencia y tasas de fallo de las respuestas simuladas"""
+
+    def __init__(self, name, latency='fixed', median=0.005, sigma=0.5, low=0.0, high=0.0,
+                 error_rate=0.0, reset_rate=0.0, hang_rate=0.0, hang_seconds=3.0,
+                 outage=0.0):
+        self.name = name
+        self.latency = latency
+        self.median = median
+        self.sigma = sigma
+        self.low = low
+        self.high = high
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.outage = outage  # Caída provocada a mitad de drive() (s)
+
+    def sample_latency(self, rng):
+        if self.latency == 'uniform':
+            return rng.uniform(self.low, self.high)
+        if self.latency == 'lognormal':
+            return rng.lognormvariate(0.0, self.sigma) * self.median
+        return self.median
+
+
+PROFILES = {
+    'ideal': FaultProfile('ideal'),
+    'slow': FaultProfile('slow', latency='lognormal', median=0.08, sigma=0.6),
+    'flaky': FaultProfile('flaky', latency='uniform', low=0.005, high=0.03,
+                          error_rate=0.05, reset_rate=0.05),
+    'dropping': FaultProfile('dropping', hang_rate=0.05),
+    'outage': FaultProfile('outage', outage=3.0),
+}
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    """Endpoints del firmware con los fallos del perfil activo"""
+
+    # WebServer del ESP8266 cierra la conexión tras cada respuesta
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/status':
+            self._respond(lambda: self.server.status())
+        elif path == '/restart':
+            self._respond(lambda: self.server.restart())
+        else:
+            self._respond(None, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        if self.path.split('?')[0] != '/command':
+            self._respond(None, 404)
+            return
+        self._respond(lambda: self.server.command(body))
+
+    def _respond(self, action, status=200):
+        server = self.server
+        fault = server.fault()
+        if fault == 'reset':
+            self._reset()
+            return
+        if fault == 'hang':
+            time.sleep(server.profile.hang_seconds)
+            self._reset()
+            return
+        time.sleep(server.profile.sample_latency(server.rng))
+        if fault == 'error':
+            status, payload = 500, {"status": "error", "error": "Error simulado"}
+        elif action is None:
+            payload = {"status": "error", "error": "Página no encontrada"}
+        else:
+            status, payload = action()
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _reset(self):
+        """Cierra la conexión con RST, sin respuesta"""
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class ESP8266Simulator(ThreadingHTTPServer):
+    """Servidor HTTP que imita al firmware con el perfil de fallos dado"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, profile=None, seed=0, restart_seconds=2.0):
+        ThreadingHTTPServer.__init__(self, (host, port), SimulatorHandler)
+        self.profile = profile or PROFILES['ideal']
+        self.rng = random.Random(seed)
+        self.restart_seconds = restart_seconds
+        self.started = time.monotonic()
+        self.bulb_state = False
+        self.brightness = 100
+        self.requests = 0
+        self.faults = {'error': 0, 'reset': 0, 'hang': 0, 'outage': 0}
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def outage(self, seconds):
+        """Corta todas las peticiones durante `seconds` segundos"""
+        self._down_until = time.monotonic() + seconds
+
+    def fault(self):
+        """Decide el fallo de la petición actual: None, 'error', 'reset' o 'hang'"""
+        with self._lock:
+            self.requests += 1
+            if time.monotonic() < self._down_until:
+                self.faults['outage'] += 1
+                return 'reset'
+            p = self.profile
+            draw = self.rng.random()
+            for name, rate in (('reset', p.reset_rate), ('hang', p.hang_rate),
+                               ('error', p.error_rate)):
+                if draw < rate:
+                    self.faults[name] += 1
+                    return name
+                draw -= rate
+            return None
+
+    # Respuestas equivalentes a sendStatusUpdate() / sendErrorMessage() del firmware
+
+    def status(self):
+        return 200, {
+            "status": "ok",
+            "timestamp": int((time.monotonic() - self.started) * 1000),
+            "state": "on" if self.bulb_state else "off",
+            "brightness": self.brightness,
+            "wifi_strength": -55,
+            "uptime": int(time.monotonic() - self.started),
+            "emergency_mode": False,
+        }
+
+    def command(self, body):
+        try:
+            doc = json.loads(body.decode('utf-8'))
+        except ValueError as e:
+            return 400, {"status": "error", "error": f"Comando JSON inválido: {e}"}
+        cmd = doc.get("cmd")
+        if cmd == "set":
+            params = doc.get("params") or {}
+            with self._lock:
+                self.bulb_state = params.get("state") == "on"
+                brightness = params.get("brightness", -1)
+                if self.bulb_state and 0 <= brightness <= 100:
+                    self.brightness = brightness
+            return self.status()
+        if cmd in ("get", "status"):
+            return self.status()
+        if cmd == "restart":
+            return self.restart()
+        return 400, {"status": "error", "error": f"Comando desconocido: {cmd}"}
+
+    def restart(self):
+        self.outage(self.restart_seconds)
+        self.started = time.monotonic() + self.restart_seconds
+        return 200, {"status": "ok", "message": "Reiniciando dispositivo..."}
+
+
+def drive(profile, duration=10.0, reconnect_interval=None, seed=0, log=print):
+    """Carga un SmartBulbController contra el simulador y devuelve las mediciones
+
+    Los comandos se envían seguidos desde un hilo, como el bucle de control
+    pero sin pausas. Si el perfil tiene `outage`, la caída se provoca a
+    mitad de la prueba y se mide el tiempo desde que el simulador vuelve
+    hasta el primer comando aceptado.
+    """
+    from BrainHomeController import SmartBulbController
+
+    sim = ESP8266Simulator(profile=profile, seed=seed).start()
+    bulb = SmartBulbController('127.0.0.1', sim.port)
+    if reconnect_interval is not None:
+        bulb.RECONNECT_INTERVAL = reconnect_interval
+    latency = LatencyHistogram()
+    counts = {'ok': 0, 'failed': 0, 'rejected': 0}
+    disconnects = 0
+    was_connected = bulb.connected
+    outage_end = None
+    recovery = None
+
+    start = time.monotonic()
+    i = 0
+    while time.monotonic() - start < duration:
+        now = time.monotonic()
+        if profile.outage and outage_end is None and now - start >= duration / 2 - profile.outage / 2:
+            sim.outage(profile.outage)
+            outage_end = now + profile.outage
+        if not bulb.connected:
+            counts['rejected'] += 1
+            time.sleep(0.01)
+        else:
+            t0 = time.monotonic_ns()
+            ok = bulb.set_brightness(1 + i % 100)
+            latency.record(time.monotonic_ns() - t0)
+            counts['ok' if ok else 'failed'] += 1
+            if ok and outage_end is not None and recovery is None and time.monotonic() > outage_end:
+                recovery = time.monotonic() - outage_end
+        if was_connected and not bulb.connected:
+            disconnects += 1
+        was_connected = bulb.connected
+        i += 1
+    elapsed = time.monotonic() - start
+
+    bulb.close()
+    sim.stop()
+    result = {
+        'profile': profile.name,
+        'commands_per_second': counts['ok'] / elapsed,
+        'ok': counts['ok'],
+        'failed': counts['failed'],
+        'rejected_while_disconnected': counts['rejected'],
+        'disconnects': disconnects,
+        'latency': latency.summary(),
+        'faults': dict(sim.faults),
+    }
+    if profile.outage:
+        result['recovery_seconds'] = recovery
+    return result
+
+
+def format_result(r):
+    s = r['latency']
+    line = (f"{r['profile']:<9} {r['commands_per_second']:8.1f} cmd/s  ok={r['ok']:<5} "
+            f"fallos={r['failed']:<4} desconexiones={r['disconnects']:<3}")
+    if s['count']:
+        line += (f" p50={s['p50_us'] / 1e3:7.1f} ms p99={s['p99_us'] / 1e3:7.1f} ms "
+                 f"máx={s['max_us'] / 1e3:7.1f} ms")
+    if 'recovery_seconds' in r:
+        recovery = r['recovery_seconds']
+        line += " recuperación=" + ("nunca" if recovery is None else f"{recovery:.2f} s")
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulador del ESP8266 con inyección de fallos")
+    parser.add_argument('--profile', choices=sorted(PROFILES), help="Perfil de fallos")
+    parser.add_argument('--port', type=int, default=8080, help="Puerto del simulador")
+    parser.add_argument('--drive', action='store_true',
+                        help="Medir SmartBulbController contra el simulador")
+    parser.add_argument('--duration', type=float, default=10.0, help="Segundos por perfil")
+    parser.add_argument('--reconnect-interval', type=float,
+                        help="RECONNECT_INTERVAL del controlador durante la medición")
+    args = parser.parse_args(argv)
+
+    if not args.drive:
+        sim = ESP8266Simulator(port=args.port, profile=PROFILES[args.profile or 'ideal'])
+        print(f"Simulador ESP8266 ({sim.profile.name}) en http://127.0.0.1:{sim.port}")
+        try:
+            sim.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    names = [args.profile] if args.profile else list(PROFILES)
+    for name in names:
+        print(format_result(drive(PROFILES[name], args.duration, args.reconnect_interval)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,283 @@
+'''
+Evaluación offline de BrainSignalProcessor sobre sesiones grabadas.
+
+Reproduce sesiones en el formato de OfflineHeadset (una línea por muestra
+cruda: "<t> <raw> <attention> <meditation> <blink>") a través de
+BrainSignalProcessor en un pool de procesos, una sesión por worker, y barre
+una rejilla de umbrales. Los resultados se emiten a medida que cada sesión
+termina.
+
+Si junto a la sesión existe "<sesion>.labels.json" con una lista de
+[gesto, inicio_s, fin_s], los gestos detectados fuera de esas ventanas se
+cuentan como falsos disparos.
+
+Con --classifier los gestos de atención y meditación los decide un
+intent.IntentClassifier entrenado con intent.py en vez de las reglas de
+umbral; si el modelo usa 'engagement', se calcula a partir de la señal cruda
+de la sesión igual que en el entrenamiento.
+
+Uso:
+    python evaluation.py grabaciones/*.txt --attention 50,60,70 --meditation 60,70,80
+    python evaluation.py grabaciones/*.txt --classifier intent_weights.npz
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+RAW_RATE = 512       # Muestras crudas por segundo
+ESENSE_EVERY = 512   # El headset emite attention/meditation a 1 Hz
+GESTURES = ('foco_on', 'foco_off', 'ajustar_brillo')
+SIGNALS = ('attention', 'meditation', 'blink')
+
+
+def load_session(path):
+    """Carga una sesión grabada como matriz (n, 4): raw, attention, meditation, blink"""
+    data = np.loadtxt(path, usecols=(1, 2, 3, 4), dtype=np.float64, ndmin=2)
+    return data.astype(np.int32)
+
+
+def load_labels(path):
+    """Carga las ventanas etiquetadas de una sesión, o None si no existen"""
+    labels_path = os.path.splitext(path)[0] + '.labels.json'
+    if not os.path.exists(labels_path):
+        return None
+    with open(labels_path, 'r') as f:
+        return [(g, float(start), float(end)) for g, start, end in json.load(f)]
+
+
+def esense_rows(n, esense_every=ESENSE_EVERY):
+    """Filas en las que se reproducen attention/meditation (0, 512, ...)"""
+    return np.arange(0, n, esense_every)
+
+
+def session_events(data, esense_every=ESENSE_EVERY, features=(), sample_rate=RAW_RATE):
+    """Convierte las filas de una sesión en eventos (fila, tipo, valor) ordenados
+
+    El tipo indexa SIGNALS + features. Los rasgos adicionales (solo
+    'engagement') se emiten en las mismas filas que eSense y antes que ellos.
+    """
+    esense = esense_rows(len(data), esense_every)
+    blink = data[:, 3]
+    prev = np.concatenate(([0], blink[:-1]))
+    blink_rows = np.flatnonzero((blink > 0) & (blink != prev))
+
+    rows = [esense, esense, blink_rows]
+    kinds = [np.zeros(len(esense), np.int8), np.ones(len(esense), np.int8),
+             np.full(len(blink_rows), 2, np.int8)]
+    values = [data[esense, 1], data[esense, 2], data[blink_rows, 3]]
+    if features:
+        from intent import engagement_series
+        for i, name in enumerate(features):
+            if name != 'engagement':
+                raise ValueError(f"Rasgo no disponible offline: {name}")
+            rows.append(esense)
+            kinds.append(np.full(len(esense), len(SIGNALS) + i, np.int8))
+            values.append(engagement_series(data[:, 0], esense + 1, sample_rate))
+    rows = np.concatenate(rows)
+    kinds = np.concatenate(kinds)
+    values = np.concatenate(values)
+    # Los rasgos adicionales van antes que los eSense de su misma fila
+    priority = np.where(kinds >= len(SIGNALS), -1, kinds)
+    order = np.lexsort((priority, rows))
+    return rows[order].tolist(), kinds[order].tolist(), values[order].tolist()
+
+
+def threshold_grid(attention=(60,), meditation=(70,), blink=(80,)):
+    """Devuelve todas las combinaciones de umbrales como lista de dicts"""
+    return [{'attention': a, 'meditation': m, 'blink': b}
+            for a, m, b in itertools.product(attention, meditation, blink)]
+
+
+def replay(events, config, sample_rate=RAW_RATE, classifier=None):
+    """Reproduce los eventos en un BrainSignalProcessor nuevo con la configuración dada
+
+    `classifier` es la ruta de unos pesos de intent.py; sus rasgos adicionales
+    deben venir en los eventos (session_events(..., features=extras)).
+    """
+    from BrainHomeController import BrainSignalProcessor
+
+    processor = BrainSignalProcessor()
+    processor.attention_threshold = config['attention']
+    processor.meditation_threshold = config['meditation']
+    processor.blink_threshold = config['blink']
+    signal_names = SIGNALS
+    if classifier is not None:
+        from intent import IntentClassifier
+        model = IntentClassifier.load(classifier)
+        # Los eventos de la sesión son la fuente de los rasgos adicionales
+        signal_names = SIGNALS + model.extras
+        processor.feature_producers.update(model.extras)
+        model.attach_processor(processor)
+
+    # Marcas del reloj de muestras: fila / frecuencia, reproducibles
+    detections = []
+    processor.gesture_handlers.append(
+        lambda gesture, timestamp: detections.append((gesture, timestamp)))
+
+    update = processor.update
+    rows, kinds, values = events
+    period = 1.0 / sample_rate
+    start = time.perf_counter()
+    for row, kind, value in zip(rows, kinds, values):
+        update(signal_names[kind], value, row * period)
+    elapsed = time.perf_counter() - start
+    return detections, elapsed
+
+
+def score(detections, labels):
+    """Cuenta detecciones por gesto y, si hay etiquetas, falsos disparos y aciertos"""
+    counts = dict.fromkeys(GESTURES, 0)
+    for gesture, _t in detections:
+        counts[gesture] = counts.get(gesture, 0) + 1
+    if labels is None:
+        return counts, None, None
+
+    false_triggers = dict.fromkeys(GESTURES, 0)
+    hit_windows = set()
+    for gesture, t in detections:
+        matched = False
+        for i, (label, start, end) in enumerate(labels):
+            if label == gesture and start <= t <= end:
+                hit_windows.add(i)
+                matched = True
+        if not matched:
+            false_triggers[gesture] = false_triggers.get(gesture, 0) + 1
+    return counts, false_triggers, (len(hit_windows), len(labels))
+
+
+def evaluate_session(path, configs, esense_every=ESENSE_EVERY, sample_rate=RAW_RATE,
+                     classifier=None):
+    """Evalúa una sesión con todas las configuraciones (se ejecuta en un worker)"""
+    data = load_session(path)
+    labels = load_labels(path)
+    features = ()
+    if classifier is not None:
+        from intent import IntentClassifier
+        features = IntentClassifier.load(classifier).extras
+    events = session_events(data, esense_every, features, sample_rate)
+    n_updates = len(events[0])
+    duration = len(data) / float(sample_rate)
+
+    results = []
+    for config in configs:
+        detections, elapsed = replay(events, config, sample_rate, classifier)
+        counts, false_triggers, hits = score(detections, labels)
+        result = {
+            'session': path,
+            'config': config,
+            'samples': len(data),
+            'duration_s': duration,
+            'updates': n_updates,
+            'detections': counts,
+            'false_triggers': false_triggers,
+            'false_trigger_rate_per_min': (
+                sum(false_triggers.values()) / (duration / 60.0)
+                if false_triggers is not None and duration > 0 else None),
+            'labeled_hits': hits,
+            'us_per_update': elapsed * 1e6 / n_updates if n_updates else 0.0,
+            'us_per_sample': elapsed * 1e6 / len(data) if len(data) else 0.0,
+        }
+        results.append(result)
+    return results
+
+
+def evaluate_sessions(paths, configs, workers=None, esense_every=ESENSE_EVERY,
+                      sample_rate=RAW_RATE, classifier=None):
+    """Generador que evalúa las sesiones en paralelo y entrega resultados al terminar cada una"""
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(evaluate_session, path, configs, esense_every, sample_rate,
+                               classifier): path
+                   for path in paths}
+        for future in as_completed(futures):
+            try:
+                for result in future.result():
+                    yield result
+            except Exception as e:
+                yield {'session': futures[future], 'error': str(e)}
+
+
+def summarize(results):
+    """Agrega los resultados por configuración de umbrales"""
+    summary = {}
+    for r in results:
+        if 'error' in r:
+            continue
+        key = (r['config']['attention'], r['config']['meditation'], r['config']['blink'])
+        s = summary.setdefault(key, {
+            'config': r['config'], 'sessions': 0, 'duration_s': 0.0,
+            'detections': dict.fromkeys(GESTURES, 0), 'false_triggers': 0,
+            'labeled_duration_s': 0.0, 'processing_s': 0.0, 'updates': 0})
+        s['sessions'] += 1
+        s['duration_s'] += r['duration_s']
+        for gesture, n in r['detections'].items():
+            s['detections'][gesture] = s['detections'].get(gesture, 0) + n
+        if r['false_triggers'] is not None:
+            s['false_triggers'] += sum(r['false_triggers'].values())
+            s['labeled_duration_s'] += r['duration_s']
+        s['processing_s'] += r['us_per_update'] * r['updates'] / 1e6
+        s['updates'] += r['updates']
+    for s in summary.values():
+        s['false_trigger_rate_per_min'] = (
+            s['false_triggers'] / (s['labeled_duration_s'] / 60.0)
+            if s['labeled_duration_s'] else None)
+        s['us_per_update'] = s['processing_s'] * 1e6 / s['updates'] if s['updates'] else 0.0
+    return list(summary.values())
+
+
+def _int_list(text):
+    return [int(v) for v in text.split(',') if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluación offline de detección de gestos")
+    parser.add_argument('sessions', nargs='+', help="Archivos de sesión grabados")
+    parser.add_argument('--attention', type=_int_list, default=[60])
+    parser.add_argument('--meditation', type=_int_list, default=[70])
+    parser.add_argument('--blink', type=_int_list, default=[80])
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--esense-every', type=int, default=ESENSE_EVERY,
+                        help="Filas entre valores eSense (512 = 1 Hz)")
+    parser.add_argument('--output', help="Archivo JSON Lines con los resultados por sesión")
+    parser.add_argument('--classifier', help="Pesos de intent.py (sustituyen a --attention/--meditation)")
+    args = parser.parse_args(argv)
+
+    configs = threshold_grid(args.attention, args.meditation, args.blink)
+    out = open(args.output, 'w') if args.output else None
+    results = []
+    start = time.time()
+    try:
+        for result in evaluate_sessions(args.sessions, configs, args.workers, args.esense_every,
+                                        classifier=args.classifier):
+            results.append(result)
+            if out:
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+            if 'error' in result:
+                print(f"Error en {result['session']}: {result['error']}", file=sys.stderr)
+            else:
+                print(f"{os.path.basename(result['session'])} {result['config']} "
+                      f"detecciones={result['detections']} "
+                      f"falsos={result['false_triggers']} "
+                      f"{result['us_per_update']:.1f} us/update")
+    finally:
+        if out:
+            out.close()
+
+    print(f"\n{len(args.sessions)} sesiones x {len(configs)} configuraciones "
+          f"en {time.time() - start:.1f} s")
+    for s in summarize(results):
+        rate = s['false_trigger_rate_per_min']
+        rate_txt = f"{rate:.2f}/min" if rate is not None else "n/d"
+        print(f"{s['config']} sesiones={s['sessions']} detecciones={s['detections']} "
+              f"falsos={rate_txt} {s['us_per_update']:.1f} us/update")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+'''
+Clasificador lineal de intenciones para BrainSignalProcessor.
+
+Sustituye las reglas de umbral de atención/meditación de _detect_patterns
+por una regresión logística multinomial sobre ventanas de eSense (y, si se
+desea, del índice de implicación 'engagement' de spectral.py). El triple
+parpadeo sigue detectándose con su regla.
+
+Entrenamiento offline, vectorizado por lotes con NumPy, a partir de sesiones
+grabadas en formato OfflineHeadset con su "<sesion>.labels.json" (las mismas
+que usa evaluation.py). La estandarización y la escala 0-100 de eSense se
+integran en los pesos, así que la inferencia es un único producto
+matriz-vector por ventana. Los pesos se guardan en un .npz de menos de
+2 KB.
+
+Uso:
+    python intent.py grabaciones/*.txt -o intent_weights.npz --window 5 --engagement
+    BRAINBULB_CLASSIFIER=intent_weights.npz python BrainHomeController.py
+'''
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from evaluation import load_session, load_labels, esense_rows, RAW_RATE, ESENSE_EVERY
+
+CLASSES = ('none', 'foco_on', 'foco_off')
+ENGAGEMENT_BANDS = {'theta': (4.0, 7.0), 'alpha': (8.0, 12.0), 'beta': (13.0, 30.0)}
+
+
+class IntentClassifier(object):
+    """Regresión logística multinomial con pesos precalculados para inferencia"""
+
+    def __init__(self, weights, bias, classes=CLASSES, window=5, extras=(), margin=0.0):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.bias = np.asarray(bias, dtype=np.float64)
+        self.classes = tuple(classes)
+        self.window = int(window)
+        self.extras = tuple(extras)
+        self.margin = margin
+        self._none = self.classes.index('none')
+        self._last = self._none
+        self.processor = None
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path, allow_pickle=False)
+        return cls(data['weights'], data['bias'], [str(c) for c in data['classes']],
+                   int(data['window']), [str(e) for e in data['extras']],
+                   float(data['margin']))
+
+    def save(self, path):
+        np.savez(path, weights=self.weights.astype(np.float32),
+                 bias=self.bias.astype(np.float32), classes=np.array(self.classes),
+                 window=self.window, extras=np.array(self.extras, dtype=str),
+                 margin=self.margin)
+
+    def attach_processor(self, processor):
+        """Conecta el clasificador: sustituye las reglas de atención y meditación
+
+        Lanza ValueError si el modelo usa rasgos adicionales que nada envía al
+        procesador (p. ej. 'engagement' sin spectral.SlidingDFTTracker
+        conectado antes): se evaluaría siempre con 0.0 en su lugar.
+        """
+        missing = [name for name in self.extras if name not in processor.feature_producers]
+        if missing:
+            raise ValueError(f"Rasgos sin productor conectado: {', '.join(missing)}")
+        processor.classifier = self
+        self.processor = processor
+
+    def features(self, processor):
+        """Vector de rasgos de la ventana actual del procesador, o None si aún no hay datos"""
+        window = self.window
+        attention = processor.attention_buffer
+        meditation = processor.meditation_buffer
+        if len(attention) < window or len(meditation) < window:
+            return None
+        x = attention[-window:] + meditation[-window:]
+        for name in self.extras:
+            buffer = processor.feature_buffers.get(name)
+            x.append(buffer[-1] if buffer else 0.0)
+        return x
+
+    def predict(self, processor):
+        """Devuelve el gesto al entrar en una clase distinta de 'none', si no None"""
+        x = self.features(processor)
+        if x is None:
+            return None
+        scores = np.dot(self.weights, x) + self.bias
+        best = int(scores.argmax())
+        if best != self._none and scores[best] - scores[self._none] < self.margin:
+            best = self._none
+        previous = self._last
+        self._last = best
+        if best == self._none or best == previous:
+            return None
+        return self.classes[best]
+
+
+def engagement_series(raw, rows, sample_rate=RAW_RATE, window=512):
+    """Índice beta / (theta + alfa + beta) en la ventana cruda que acaba en cada fila
+
+    Misma definición que SlidingDFTTracker.engagement(), calculada en bloque.
+    """
+    raw = np.asarray(raw, dtype=np.float64)
+    result = np.zeros(len(rows))
+    valid = rows >= window
+    if not valid.any():
+        return result
+    segments = sliding_window_view(raw, window)[rows[valid] - window]
+    spectrum = np.abs(np.fft.rfft(segments * np.hanning(window + 1)[:-1], axis=1)) ** 2
+    freqs = np.fft.rfftfreq(window, 1.0 / sample_rate)
+    powers = {name: spectrum[:, (freqs >= low) & (freqs <= high)].sum(axis=1)
+              for name, (low, high) in ENGAGEMENT_BANDS.items()}
+    total = powers['theta'] + powers['alpha'] + powers['beta']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result[valid] = np.where(total > 0, 100.0 * powers['beta'] / total, 0.0)
+    return result
+
+
+def session_dataset(path, window=5, extras=(), esense_every=ESENSE_EVERY,
+                    sample_rate=RAW_RATE, classes=CLASSES):
+    """Matriz de rasgos (n, 2*window + extras) y etiquetas de una sesión etiquetada"""
+    data = load_session(path)
+    labels = load_labels(path) or []
+    # Mismas filas que reproduce evaluation.session_events
+    rows = esense_rows(len(data), esense_every)
+    if len(rows) < window:
+        return np.zeros((0, 2 * window + len(extras))), np.zeros(0, dtype=np.int64)
+    attention = sliding_window_view(data[rows, 1].astype(np.float64), window)
+    meditation = sliding_window_view(data[rows, 2].astype(np.float64), window)
+    columns = [attention, meditation]
+    end_rows = rows[window - 1:]
+    for name in extras:
+        if name != 'engagement':
+            raise ValueError(f"Rasgo no disponible offline: {name}")
+        columns.append(engagement_series(data[:, 0], end_rows + 1, sample_rate)[:, None])
+    X = np.hstack(columns)
+
+    t = end_rows / float(sample_rate)
+    y = np.zeros(len(t), dtype=np.int64)
+    for gesture, start, end in labels:
+        if gesture in classes:
+            y[(t >= start) & (t <= end)] = classes.index(gesture)
+    return X, y
+
+
+def train(X, y, n_classes=len(CLASSES), l2=1e-3, epochs=500, lr=0.5, balanced=True):
+    """Regresión logística multinomial por descenso de gradiente en lote completo
+
+    Devuelve (pesos, sesgo) ya expresados sobre los rasgos sin estandarizar.
+    """
+    mean = X.mean(axis=0)
+    std = X.std(axis=0)
+    std[std == 0] = 1.0
+    Z = (X - mean) / std
+    n, d = Z.shape
+    Y = np.eye(n_classes)[y]
+    if balanced:
+        counts = np.bincount(y, minlength=n_classes).astype(np.float64)
+        sample_weight = (n / (n_classes * np.maximum(counts, 1)))[y]
+    else:
+        sample_weight = np.ones(n)
+    sample_weight /= sample_weight.sum()
+
+    W = np.zeros((n_classes, d))
+    b = np.zeros(n_classes)
+    for _ in range(epochs):
+        logits = Z @ W.T + b
+        logits -= logits.max(axis=1, keepdims=True)
+        P = np.exp(logits)
+        P /= P.sum(axis=1, keepdims=True)
+        G = (P - Y) * sample_weight[:, None]
+        W -= lr * (G.T @ Z + l2 * W)
+        b -= lr * G.sum(axis=0)
+
+    # Integrar la estandarización en los pesos: W·((x - μ)/σ) + b = W'·x + b'
+    weights = W / std
+    bias = b - weights @ mean
+    return weights, bias
+
+
+def report(classifier, X, y):
+    """Precisión y exhaustividad por clase sobre ventanas etiquetadas"""
+    predicted = (X @ classifier.weights.T + classifier.bias).argmax(axis=1)
+    lines = []
+    for i, name in enumerate(classifier.classes):
+        tp = int(((predicted == i) & (y == i)).sum())
+        precision = tp / max(1, int((predicted == i).sum()))
+        recall = tp / max(1, int((y == i).sum()))
+        lines.append(f"  {name:<10} precisión={precision:.2f} exhaustividad={recall:.2f} "
+                     f"(n={int((y == i).sum())})")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Entrena el clasificador de intenciones")
+    parser.add_argument('sessions', nargs='+', help="Sesiones grabadas con .labels.json")
+    parser.add_argument('-o', '--output', default='intent_weights.npz')
+    parser.add_argument('--window', type=int, default=5, help="Valores eSense por ventana")
+    parser.add_argument('--engagement', action='store_true',
+                        help="Añadir el índice de implicación (spectral.SlidingDFTTracker)")
+    parser.add_argument('--holdout', type=float, default=0.2,
+                        help="Fracción de sesiones reservada para validar")
+    parser.add_argument('--l2', type=float, default=1e-3)
+    parser.add_argument('--epochs', type=int, default=500)
+    parser.add_argument('--margin', type=float, default=0.0,
+                        help="Ventaja mínima del gesto sobre 'none' (logits)")
+    parser.add_argument('--esense-every', type=int, default=ESENSE_EVERY)
+    args = parser.parse_args(argv)
+
+    extras = ('engagement',) if args.engagement else ()
+    datasets = [session_dataset(path, args.window, extras, args.esense_every)
+                for path in args.sessions]
+    n_holdout = int(round(len(datasets) * args.holdout)) if len(datasets) > 1 else 0
+    train_sets = datasets[:len(datasets) - n_holdout]
+    holdout_sets = datasets[len(datasets) - n_holdout:]
+    X = np.vstack([X for X, _y in train_sets])
+    y = np.concatenate([y for _X, y in train_sets])
+    if not len(X):
+        print("No hay ventanas suficientes para entrenar", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    weights, bias = train(X, y, l2=args.l2, epochs=args.epochs)
+    print(f"{len(X)} ventanas, {X.shape[1]} rasgos, entrenado en "
+          f"{time.perf_counter() - start:.2f} s")
+    classifier = IntentClassifier(weights, bias, CLASSES, args.window, extras, args.margin)
+    print("Entrenamiento:\n" + report(classifier, X, y))
+    if holdout_sets:
+        Xh = np.vstack([X for X, _y in holdout_sets])
+        yh = np.concatenate([y for _X, y in holdout_sets])
+        print(f"Validación ({n_holdout} sesiones):\n" + report(classifier, Xh, yh))
+    classifier.save(args.output)
+    print(f"Pesos guardados en {args.output} ({os.path.getsize(args.output)} bytes)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+'''
+Registro de métricas de ejecución (contadores y gauges) para todo el pipeline.
+
+Los contadores son baratos de incrementar desde cualquier hilo: cada hilo
+escribe en su propia celda y las celdas se suman solo al leer. Los gauges
+guardan un valor o se calculan con una función en el momento de leerlos.
+
+registry.snapshot() devuelve un dict y registry.exposition() el formato de
+texto de Prometheus; serve_metrics() lo publica en http://127.0.0.1:<puerto>/metrics
+(y en las rutas extra que se le pasen, como /profile de profiling.py).
+'''
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in sorted(labels.items())) + '}'
+
+
+class Counter(object):
+    """Contador monotónico con una celda por hilo, agregado al leer"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help='', labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self._local = threading.local()
+        self._cells = []
+        self._base = 0
+        self._prune_at = 64
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        try:
+            self._local.cell[0] += n
+        except AttributeError:
+            self._new_cell()[0] += n
+
+    def _new_cell(self):
+        cell = [0]
+        self._local.cell = cell
+        with self._lock:
+            self._cells.append((threading.current_thread(), cell))
+            # Hilos de vida corta sin nadie que lea el contador: consolidar
+            # aquí también para que la lista no crezca sin límite
+            if len(self._cells) >= self._prune_at:
+                self._consolidate()
+                self._prune_at = max(64, 2 * len(self._cells))
+        return cell
+
+    def _consolidate(self):
+        """Suma a la base las celdas de hilos terminados (con el lock tomado)"""
+        alive = []
+        for thread, cell in self._cells:
+            if thread.is_alive():
+                alive.append((thread, cell))
+            else:
+                self._base += cell[0]
+        self._cells = alive
+
+    def value(self):
+        with self._lock:
+            self._consolidate()
+            return self._base + sum(cell[0] for _thread, cell in self._cells)
+
+
+class Gauge(object):
+    """Valor instantáneo, fijado con set() o calculado con `fn` al leer"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help='', labels=None, fn=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.fn = fn
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, fn):
+        self.fn = fn
+
+    def value(self):
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception:
+                return 0
+        return self._value
+
+
+class Registry(object):
+    """Colección de métricas identificadas por nombre y etiquetas"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = cls(name, help, labels, **kwargs)
+                    self._metrics[key] = metric
+        return metric
+
+    def counter(self, name, help='', labels=None):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', labels=None, fn=None):
+        gauge = self._get(Gauge, name, help, labels)
+        if fn is not None:
+            gauge.set_function(fn)
+        return gauge
+
+    def snapshot(self):
+        """Dict {'nombre{etiquetas}': valor} con todas las métricas"""
+        return {name + _label_text(m.labels): m.value()
+                for (name, _labels), m in sorted(self._metrics.items())}
+
+    def exposition(self):
+        """Texto en formato de exposición de Prometheus"""
+        lines = []
+        current = None
+        for (name, _labels), metric in sorted(self._metrics.items()):
+            if name != current:
+                current = name
+                if metric.help:
+                    lines.append(f"# HELP {name} {metric.help}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+            lines.append(f"{name}{_label_text(metric.labels)} {metric.value()}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def serve_metrics(port=9109, host='127.0.0.1', source=None, routes=None):
+    """Publica la exposición de métricas en un hilo HTTP en segundo plano
+
+    `routes` añade rutas extra: {'/ruta': fn(query) -> (content_type, cuerpo, cabeceras)},
+    con `query` tal como lo devuelve urllib.parse.parse_qs.
+    """
+    source = source or registry
+    routes = routes or {}
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            headers = {}
+            if url.path in ('/', '/metrics'):
+                content_type = 'text/plain; version=0.0.4'
+                body = source.exposition()
+            elif url.path in routes:
+                try:
+                    content_type, body, headers = routes[url.path](parse_qs(url.query))
+                except Exception as e:
+                    self.send_error(409 if isinstance(e, RuntimeError) else 400, str(e))
+                    return
+            else:
+                self.send_error(404)
+                return
+            body = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -9,34 +9,136 @@ This driver implements the serial protocol that is being used in the Mindwave Mo
 from __future__ import print_function
 
 import select, serial, threading
+from collections import namedtuple
 from pprint import pprint
 import time
 import datetime
 import os
 
+from tracing import tracer
+from metrics import registry
+from sampleclock import SampleClock
+
 # Byte codes
 CONNECT              = b'\xc0'
 DISCONNECT           = b'\xc1'
 AUTOCONNECT          = b'\xc2'
 SYNC                 = b'\xaa'
+SYNC_SYNC            = SYNC + SYNC
+MAX_PLENGTH          = 169
 EXCODE               = 0x55
 POOR_SIGNAL          = 0x02
 ATTENTION            = 0x04
 MEDITATION           = 0x05
 BLINK                = 0x16
-HEADSET_CONNECTED    = b'\xd0'
-HEADSET_NOT_FOUND    = b'\xd1'
-HEADSET_DISCONNECTED = b'\xd2'
-REQUEST_DENIED       = b'\xd3'
-STANDBY_SCAN         = b'\xd4'
+HEADSET_CONNECTED    = 0xd0
+HEADSET_NOT_FOUND    = 0xd1
+HEADSET_DISCONNECTED = 0xd2
+REQUEST_DENIED       = 0xd3
+STANDBY_SCAN         = 0xd4
 RAW_VALUE            = 0x80
-ASIC_EEG_POWER       = b'\x83'
+ASIC_EEG_POWER       = 0x83
+
+# ASIC_EEG_POWER bands, in payload order
+EEG_POWER_BANDS = ('delta', 'theta', 'low-alpha', 'high-alpha',
+                   'low-beta', 'high-beta', 'low-gamma', 'mid-gamma')
 
 # Status codes
 STATUS_CONNECTED     = 'connected'
 STATUS_SCANNING      = 'scanning'
 STATUS_STANDBY       = 'standby'
 
+# Raw samples and eSense values per second, used by the sample clocks
+RAW_RATE = 512
+ESENSE_RATE = 1
+
+# Coherent view of the headset readings returned by Headset.snapshot().
+# `seq` is the number of packets published so far; `sample_time` is the
+# sample-clock time of the last raw sample. `waves` is shared with the
+# headset and replaced, never mutated, when new powers arrive.
+# Marks decoder events whose handlers take only the headset
+NO_ARGUMENT = object()
+
+HeadsetState = namedtuple('HeadsetState', (
+    'seq', 'attention', 'meditation', 'poor_signal', 'blink', 'raw_value',
+    'waves', 'count', 'status', 'sample_time'))
+
+
+class HandlerList(list):
+    """
+    Event handler list that keeps an immutable tuple snapshot for dispatch.
+
+    Mutating the list (append, remove, ...) rebuilds `frozen`, so the reader
+    thread iterates a tuple that never changes under it.
+    """
+    __slots__ = ('frozen',)
+
+    def __init__(self, *args):
+        super(HandlerList, self).__init__(*args)
+        self.frozen = tuple(self)
+
+    def _freeze(self):
+        self.frozen = tuple(self)
+
+
+def _freezing(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args):
+        result = method(self, *args)
+        self._freeze()
+        return result
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort',
+              'reverse', '__setitem__', '__delitem__', '__iadd__'):
+    setattr(HandlerList, _name, _freezing(_name))
+del _name
+
+
+def port_identity(device):
+    """Return (vid, pid, serial_number) of a USB serial port, or None."""
+    try:
+        from serial.tools import list_ports
+        path = os.path.realpath(device)
+        for port in list_ports.comports():
+            if port.device in (device, path) and port.vid is not None:
+                return (port.vid, port.pid, port.serial_number)
+    except Exception:
+        pass
+    return None
+
+
+def find_dongle_ports(device, identity=None):
+    """Candidate ports for a dongle, the configured device first.
+
+    After a replug the kernel may enumerate the dongle under another name
+    (/dev/ttyUSB0 -> /dev/ttyUSB1, COM3 -> COM4); ports whose USB identity
+    matches `identity` are returned after the original path.
+    """
+    candidates = []
+    if not device.startswith('/dev/') or os.path.exists(device):
+        candidates.append(device)
+    if identity is not None:
+        try:
+            from serial.tools import list_ports
+            for port in list_ports.comports():
+                if (port.vid, port.pid, port.serial_number) == identity and \
+                        port.device not in candidates:
+                    candidates.append(port.device)
+        except Exception:
+            pass
+    return candidates
+
+
+def encode_packet(payload):
+    """Frame a payload as SYNC SYNC PLENGTH PAYLOAD CHKSUM."""
+    payload = bytes(payload)
+    return SYNC_SYNC + bytes([len(payload)]) + payload + bytes([~sum(payload) & 0xff])
+
+
 # Use me to playback previous recorded files as if they were recorded now.
 # (using the same python class)
 class OfflineHeadset:
@@ -51,6 +153,16 @@ class OfflineHeadset:
         self.f = None
         self.poor_signal = 1
         self.count = 0
+        # Sample clock without arrival times: sample n is at n / 512 s, so
+        # replays produce the same timestamps every time
+        self.clock = SampleClock(RAW_RATE)
+
+    @property
+    def sample_time(self):
+        return self.clock.now()
+
+    # Each row carries the current eSense values
+    esense_time = sample_time
 
     def setup(self):
         pass
@@ -88,6 +200,7 @@ class OfflineHeadset:
             self.attention = data[2]
             self.meditation = data[3]
             self.blink = data[4]
+            self.clock.count += 1
 
             self.readcounter = self.readcounter + 1
             self.count = self.count
@@ -114,199 +227,349 @@ class Headset(object):
         """
         Serial listener for dongle device.
         """
+        # Consecutive unexpected (non-port) read errors tolerated before the
+        # port is treated as failed and handed to _reopen
+        MAX_UNEXPECTED_ERRORS = 5
+        UNEXPECTED_ERROR_BACKOFF = 0.1
+
         def __init__(self, headset, *args, **kwargs):
             """Set up the listener device."""
             self.headset = headset
             self.counter = 0
+            self._buffer = bytearray()
+            self._arrival = None
+            self._decoders = self._build_decoders()
             super(Headset.DongleListener, self).__init__(*args, **kwargs)
 
         def run(self):
-            """Run the listener thread."""
-            s = self.headset.dongle
-            self.headset.running = True
+            """Run the listener thread.
+
+            With headset.reconnect enabled a lost port is not the end of the
+            thread: the headset re-discovers the dongle, reopens it and the
+            listener replays the settings and connect handshake.
+            """
+            headset = self.headset
+            s = headset.dongle
+            headset.running = True
+            failed_at = None
+
+            while True:
+                error = self._setup(s)
+                if error is None:
+                    if failed_at is not None:
+                        headset._recovered(time.monotonic() - failed_at)
+                        failed_at = None
+                    error = self._read_loop(s)
+                if s and s.isOpen():
+                    try:
+                        s.close()
+                    except Exception:
+                        pass
+                if not headset.running or error is None:
+                    break
+                if not headset.reconnect:
+                    headset.running = False
+                    break
+                if failed_at is None:
+                    failed_at = time.monotonic()
+                    headset._lost(error)
+                self._buffer.clear()
+                s = headset._reopen()
+                if s is None:
+                    break
 
-            # Re-apply settings to ensure packet stream
+            print('Closing connection...')
+
+        def _setup(self, s):
+            """Re-apply settings to ensure packet stream; return the error, if any."""
             try:
                 s.write(DISCONNECT)
                 d = s.getSettingsDict()
                 for i in range(2):
                     d['rtscts'] = not d['rtscts']
                     s.applySettingsDict(d)
+                if self.headset._handshake is not None:
+                    self.headset._replay_handshake()
             except Exception as e:
                 print(f"Error inicializando dongle: {e}")
-                self.headset.running = False
-                return
+                return e
+            return None
+
+        def _read_loop(self, s):
+            """Read until the headset stops (returns None) or the port fails (returns the error).
 
+            Unexpected errors are retried with a growing pause; after
+            MAX_UNEXPECTED_ERRORS in a row the last one is returned as a port
+            failure so the reconnect path takes over.
+            """
+            unexpected = 0
             while self.headset.running:
                 try:
-                    if s.read() == SYNC and s.read() == SYNC:
-                        # Packet found, determine plength
-                        while True:
-                            plength = ord(s.read())
-                            if plength != 170:
-                                break
-                        if plength > 170:
-                            continue
-
-                        # Read in the payload
-                        payload = s.read(plength)
-
-                        # Verify its checksum
-                        val = sum(b for b in payload[:-1])
-                        val &= 0xff
-                        val = ~val & 0xff
-                        chksum = ord(s.read())
-
-                        #if val == chksum:
-                        if True: # ignore bad checksums
-                            self.parse_payload(payload)
+                    # Leer todo lo disponible (al menos un byte) y extraer paquetes
+                    data = s.read(max(1, s.in_waiting))
+                    arrival = time.monotonic()
+                    if tracer.enabled:
+                        tracer.begin()
+                    self.feed(data, arrival)
+                    unexpected = 0
                 except (select.error, OSError, serial.SerialException) as e:
                     print(f"Error en la lectura del dongle: {e}")
-                    break
+                    return e
                 except Exception as e:
-                    print(f"Error inesperado: {e}")
-                    break
+                    unexpected += 1
+                    if unexpected >= self.MAX_UNEXPECTED_ERRORS:
+                        print(f"Error inesperado repetido {unexpected} veces, reabriendo el dongle: {e!r}")
+                        return e
+                    # Not a port failure (yet): back off and keep reading
+                    print(f"Error inesperado: {e!r}")
+                    time.sleep(self.UNEXPECTED_ERROR_BACKOFF * unexpected)
+            return None
 
-            print('Closing connection...')
-            if s and s.isOpen():
+        def feed(self, data, arrival=None):
+            """Append raw bytes and parse every complete packet in the buffer.
+
+            Packets are SYNC SYNC PLENGTH PAYLOAD CHKSUM. The checksum is
+            validated over the buffered payload; in strict mode a bad frame is
+            dropped and the parser resyncs with bytes.find on the buffer.
+
+            `arrival` is the time.monotonic() of the read, used to anchor the
+            headset sample clocks; without it timestamps come from the sample
+            counters alone.
+            """
+            headset = self.headset
+            self._arrival = arrival
+            headset.bytes_counter.inc(len(data))
+            buf = self._buffer
+            buf += data
+            n = len(buf)
+            pos = 0
+            while True:
+                start = buf.find(SYNC_SYNC, pos)
+                if start < 0:
+                    # Keep a trailing SYNC, it may start the next packet
+                    pos = n - 1 if n and buf[-1] == 0xaa else n
+                    break
+                i = start + 2
+                while i < n and buf[i] == 0xaa:
+                    i += 1
+                if i >= n:
+                    pos = start
+                    break
+                plength = buf[i]
+                if plength > MAX_PLENGTH:
+                    pos = i
+                    continue
+                end = i + plength + 2
+                if end > n:
+                    pos = start
+                    break
+                payload = bytes(buf[i + 1:end - 1])
+                if (~sum(payload) & 0xff) != buf[end - 1]:
+                    headset.checksum_errors_counter.inc()
+                    if headset.strict_checksum:
+                        # Resync from the byte after this SYNC
+                        pos = start + 1
+                        continue
+                headset.packets_counter.inc()
                 try:
-                    s.close()
-                except Exception:
-                    pass
+                    self.parse_payload(payload)
+                except Exception as e:
+                    # A failing handler or decoder drops this packet only;
+                    # it must not look like a lost port to _read_loop
+                    headset._handler_error(e)
+                pos = end
+            if pos:
+                del buf[:pos]
+            if arrival is not None:
+                # Anchor on the newest sample of the read: the tightest bound
+                headset.clock.observe(arrival)
+
+        def _build_decoders(self):
+            """Build the code -> decoder table used by parse_payload."""
+            decoders = [None] * 256
+            decoders[POOR_SIGNAL] = self._decode_poor_signal
+            decoders[ATTENTION] = self._decode_attention
+            decoders[MEDITATION] = self._decode_meditation
+            decoders[BLINK] = self._decode_blink
+            decoders[RAW_VALUE] = self._decode_raw_value
+            decoders[ASIC_EEG_POWER] = self._decode_eeg_power
+            decoders[HEADSET_CONNECTED] = self._decode_headset_connected
+            decoders[HEADSET_NOT_FOUND] = self._decode_headset_not_found
+            decoders[HEADSET_DISCONNECTED] = self._decode_headset_disconnected
+            decoders[REQUEST_DENIED] = self._decode_request_denied
+            decoders[STANDBY_SCAN] = self._decode_standby_scan
+            return decoders
 
         def parse_payload(self, payload):
-            """Parse the payload to determine an action."""
-            while payload:
+            """Parse the payload, publish the packet's HeadsetState, then run handlers.
+
+            Decoders only update the headset fields and return the handlers to
+            notify, so handlers run after the new state is published and can
+            call snapshot() themselves.
+            """
+            headset = self.headset
+            decoders = self._decoders
+            event = None  # First (handlers, value); raw packets carry only one
+            events = None
+            n = len(payload)
+            i = 0
+            while i < n:
                 # Parse data row
-                excode = 0
-                try:
-                    code, payload = payload[0], payload[1:]
-                    self.headset.count = self.counter
-                    self.counter = self.counter + 1
-                    if (self.counter >= 100):
-                        self.counter = 0
-                except IndexError:
-                    pass
-                while code == EXCODE:
-                    # Count excode bytes
-                    excode += 1
-                    try:
-                        code, payload = payload[0], payload[1:]
-                    except IndexError:
-                        pass
+                code = payload[i]
+                i += 1
+                self.headset.count = self.counter
+                self.counter = self.counter + 1
+                if (self.counter >= 100):
+                    self.counter = 0
+                while code == EXCODE and i < n:
+                    code = payload[i]
+                    i += 1
+                if i >= n:
+                    break
                 if code < 0x80:
                     # This is a single-byte code
-                    try:
-                        value, payload = payload[0], payload[1:]
-                    except IndexError:
-                        pass
-                    if code == POOR_SIGNAL:
-                        # Poor signal
-                        old_poor_signal = self.headset.poor_signal
-                        self.headset.poor_signal = value
-                        if self.headset.poor_signal > 0:
-                            if old_poor_signal == 0:
-                                for handler in \
-                                    self.headset.poor_signal_handlers:
-                                    handler(self.headset,
-                                            self.headset.poor_signal)
-                        else:
-                            if old_poor_signal > 0:
-                                for handler in \
-                                    self.headset.good_signal_handlers:
-                                    handler(self.headset,
-                                            self.headset.poor_signal)
-                    elif code == ATTENTION:
-                        # Attention level
-                        self.headset.attention = value
-                        for handler in self.headset.attention_handlers:
-                            handler(self.headset, self.headset.attention)
-                    elif code == MEDITATION:
-                        # Meditation level
-                        self.headset.meditation = value
-                        for handler in self.headset.meditation_handlers:
-                            handler(self.headset, self.headset.meditation)
-                    elif code == BLINK:
-                        # Blink strength
-                        self.headset.blink = value
-                        for handler in self.headset.blink_handlers:
-                            handler(self.headset, self.headset.blink)
+                    value = payload[i]
+                    i += 1
                 else:
                     # This is a multi-byte code
-                    try:
-                        vlength, payload = payload[0], payload[1:]
-                    except IndexError:
-                        continue
-                    value, payload = payload[:vlength], payload[vlength:]
-
-                    # FIX: accessing value crashes elseway
-                    if code == RAW_VALUE and len(value) >= 2:
-                        raw=value[0]*256+value[1]
-                        if (raw>=32768):
-                            raw=raw-65536
-                        self.headset.raw_value = raw
-                        for handler in self.headset.raw_value_handlers:
-                            handler(self.headset, self.headset.raw_value)
-                    if code == HEADSET_CONNECTED:
-                        # Headset connect success
-                        run_handlers = self.headset.status != STATUS_CONNECTED
-                        self.headset.status = STATUS_CONNECTED
-                        self.headset.headset_id = value.encode('hex')
-                        if run_handlers:
-                            for handler in \
-                                self.headset.headset_connected_handlers:
-                                handler(self.headset)
-                    elif code == HEADSET_NOT_FOUND:
-                        # Headset not found
-                        if vlength > 0:
-                            not_found_id = value.encode('hex')
-                            for handler in \
-                                self.headset.headset_notfound_handlers:
-                                handler(self.headset, not_found_id)
-                        else:
-                            for handler in \
-                                self.headset.headset_notfound_handlers:
-                                handler(self.headset, None)
-                    elif code == HEADSET_DISCONNECTED:
-                        # Headset disconnected
-                        headset_id = value.encode('hex')
-                        for handler in \
-                            self.headset.headset_disconnected_handlers:
-                            handler(self.headset, headset_id)
-                    elif code == REQUEST_DENIED:
-                        # Request denied
-                        for handler in self.headset.request_denied_handlers:
-                            handler(self.headset)
-                    elif code == STANDBY_SCAN:
-                        # Standby/Scan mode
-                        try:
-                            byte = ord(value[0])
-                        except IndexError:
-                            byte = None
-                        if byte:
-                            run_handlers = (self.headset.status !=
-                                            STATUS_SCANNING)
-                            self.headset.status = STATUS_SCANNING
-                            if run_handlers:
-                                for handler in self.headset.scanning_handlers:
-                                    handler(self.headset)
+                    vlength = payload[i]
+                    value = payload[i + 1:i + 1 + vlength]
+                    i += 1 + vlength
+                decoder = decoders[code]
+                if decoder is not None:
+                    result = decoder(value)
+                    if result is not None:
+                        if event is None:
+                            event = result
+                        elif events is None:
+                            events = [result]
                         else:
-                            run_handlers = (self.headset.status !=
-                                            STATUS_STANDBY)
-                            self.headset.status = STATUS_STANDBY
-                            if run_handlers:
-                                for handler in self.headset.standby_handlers:
-                                    handler(self.headset)
-                    elif code == ASIC_EEG_POWER:
-                        j = 0
-                        for i in ['delta', 'theta', 'low-alpha', 'high-alpha', 'low-beta', 'high-beta', 'low-gamma', 'mid-gamma']:
-                            self.headset.waves[i] = ord(value[j])*255*255+ord(value[j+1])*255+ord(value[j+2])
-                            j += 3
-                        for handler in self.headset.waves_handlers:
-                            handler(self.headset, self.headset.waves)
-
-    def __init__(self, device, headset_id=None, open_serial=True):
-        """Initialize the  headset."""
+                            events.append(result)
+            # Publish the packet as one tuple (atomic for readers, see snapshot)
+            headset._published = (
+                headset._published[0] + 1, headset.attention, headset.meditation,
+                headset.poor_signal, headset.blink, headset.raw_value, headset.waves,
+                headset.count, headset.status, headset.clock.count)
+            if event is not None:
+                handlers, value = event
+                if value is NO_ARGUMENT:
+                    for handler in handlers:
+                        handler(headset)
+                else:
+                    for handler in handlers:
+                        handler(headset, value)
+                if events is not None:
+                    for handlers, value in events:
+                        for handler in handlers:
+                            if value is NO_ARGUMENT:
+                                handler(headset)
+                            else:
+                                handler(headset, value)
+
+        # Decoders return (handlers, value) for parse_payload to dispatch, or
+        # None; handlers with no value argument get NO_ARGUMENT
+
+        def _decode_poor_signal(self, value):
+            # POOR_SIGNAL leads the 1 Hz eSense packet
+            headset = self.headset
+            headset.esense_time = headset.esense_clock.tick(self._arrival)
+            old_poor_signal = headset.poor_signal
+            headset.poor_signal = value
+            if value > 0:
+                if old_poor_signal == 0:
+                    return headset.poor_signal_handlers.frozen, value
+            elif old_poor_signal > 0:
+                return headset.good_signal_handlers.frozen, value
+
+        def _decode_attention(self, value):
+            headset = self.headset
+            headset.attention = value
+            handlers = headset.attention_handlers.frozen
+            if handlers:
+                return handlers, value
+
+        def _decode_meditation(self, value):
+            headset = self.headset
+            headset.meditation = value
+            handlers = headset.meditation_handlers.frozen
+            if handlers:
+                return handlers, value
+
+        def _decode_blink(self, value):
+            headset = self.headset
+            headset.blink = value
+            handlers = headset.blink_handlers.frozen
+            if handlers:
+                return handlers, value
+
+        def _decode_raw_value(self, value):
+            if len(value) < 2:
+                return
+            headset = self.headset
+            raw = int.from_bytes(value[:2], 'big', signed=True)
+            headset.raw_value = raw
+            headset.clock.count += 1
+            handlers = headset.raw_value_handlers.frozen
+            if handlers:
+                return handlers, raw
+
+        def _decode_eeg_power(self, value):
+            if len(value) < 24:
+                return
+            headset = self.headset
+            # A new dict: published states keep referencing the previous one
+            waves = {band: int.from_bytes(value[3 * j:3 * j + 3], 'big')
+                     for j, band in enumerate(EEG_POWER_BANDS)}
+            headset.waves = waves
+            return headset.waves_handlers.frozen, waves
+
+        def _decode_headset_connected(self, value):
+            # Headset connect success
+            headset = self.headset
+            run_handlers = headset.status != STATUS_CONNECTED
+            headset.status = STATUS_CONNECTED
+            headset.headset_id = value.hex()
+            if run_handlers:
+                return headset.headset_connected_handlers.frozen, NO_ARGUMENT
+
+        def _decode_headset_not_found(self, value):
+            headset = self.headset
+            not_found_id = value.hex() if value else None
+            return headset.headset_notfound_handlers.frozen, not_found_id
+
+        def _decode_headset_disconnected(self, value):
+            headset = self.headset
+            return headset.headset_disconnected_handlers.frozen, value.hex()
+
+        def _decode_request_denied(self, value):
+            return self.headset.request_denied_handlers.frozen, NO_ARGUMENT
+
+        def _decode_standby_scan(self, value):
+            # Standby/Scan mode
+            headset = self.headset
+            if value and value[0]:
+                run_handlers = headset.status != STATUS_SCANNING
+                headset.status = STATUS_SCANNING
+                if run_handlers:
+                    return headset.scanning_handlers.frozen, NO_ARGUMENT
+            else:
+                run_handlers = headset.status != STATUS_STANDBY
+                headset.status = STATUS_STANDBY
+                if run_handlers:
+                    return headset.standby_handlers.frozen, NO_ARGUMENT
+
+    def __init__(self, device, headset_id=None, open_serial=True,
+                 strict_checksum=False, reconnect=False, min_backoff=0.05,
+                 max_backoff=0.5):
+        """Initialize the  headset.
+
+        With strict_checksum=True packets with a bad checksum are dropped
+        instead of parsed; failures are counted either way.
+
+        With reconnect=True a lost dongle is re-discovered and reopened,
+        retrying with exponential backoff from min_backoff to max_backoff
+        seconds, and the last connect/autoconnect request is replayed.
+        """
         # Initialize headset values
         self.dongle = None
         self.listener = None
@@ -321,27 +584,90 @@ class Headset(object):
         self.status = None
         self.count = 0
         self.running = False
+        self.strict_checksum = strict_checksum
+        self.reconnect = reconnect
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.last_recovery = None  # Seconds from failure to reopened port
+        self._identity = None  # USB (vid, pid, serial) of the dongle
+        self._handshake = None  # Last connect request, replayed on reopen
         self._log_callback = None  # Callback externo para logs/notificaciones
 
+        # Sample clocks: raw samples (512 Hz) and eSense values (1 Hz)
+        self.clock = SampleClock(RAW_RATE)
+        self.esense_clock = SampleClock(ESENSE_RATE, creep=0.05, resync=1.5)
+        self.esense_time = None
+
+        # Métricas por dispositivo
+        labels = {'device': str(device)}
+        self.packets_counter = registry.counter(
+            'mindwave_packets_total', 'Paquetes decodificados del dongle', labels)
+        self.checksum_errors_counter = registry.counter(
+            'mindwave_checksum_errors_total', 'Paquetes con checksum inválido', labels)
+        self.bytes_counter = registry.counter(
+            'mindwave_bytes_read_total', 'Bytes leídos del puerto serie', labels)
+        self.reconnects_counter = registry.counter(
+            'mindwave_reconnects_total', 'Reaperturas del dongle tras perder el puerto', labels)
+        self.handler_errors_counter = registry.counter(
+            'mindwave_handler_errors_total', 'Paquetes cuyo procesado lanzó una excepción', labels)
+        self._handler_error_logged = 0.0
+        self.recovery_gauge = registry.gauge(
+            'mindwave_last_recovery_seconds', 'Tiempo hasta reabrir el dongle en la última caída', labels)
+
         # Create event handler lists
-        self.poor_signal_handlers = []
-        self.good_signal_handlers = []
-        self.attention_handlers = []
-        self.meditation_handlers = []
-        self.blink_handlers = []
-        self.raw_value_handlers = []
-        self.waves_handlers = []
-        self.headset_connected_handlers = []
-        self.headset_notfound_handlers = []
-        self.headset_disconnected_handlers = []
-        self.request_denied_handlers = []
-        self.scanning_handlers = []
-        self.standby_handlers = []
+        self.poor_signal_handlers = HandlerList()
+        self.good_signal_handlers = HandlerList()
+        self.attention_handlers = HandlerList()
+        self.meditation_handlers = HandlerList()
+        self.blink_handlers = HandlerList()
+        self.raw_value_handlers = HandlerList()
+        self.waves_handlers = HandlerList()
+        self.headset_connected_handlers = HandlerList()
+        self.headset_notfound_handlers = HandlerList()
+        self.headset_disconnected_handlers = HandlerList()
+        self.request_denied_handlers = HandlerList()
+        self.scanning_handlers = HandlerList()
+        self.standby_handlers = HandlerList()
+        self.dongle_lost_handlers = HandlerList()
+        self.dongle_recovered_handlers = HandlerList()
+
+        # Readings published as one tuple after each packet (see snapshot)
+        self._published = (0, self.attention, self.meditation, self.poor_signal,
+                           self.blink, self.raw_value, self.waves, self.count,
+                           self.status, 0)
 
         # Open the socket
         if open_serial:
             self.serial_open()
 
+    @property
+    def sample_time(self):
+        """Sample-clock time of the last raw sample."""
+        return self.clock.now()
+
+    def snapshot(self):
+        """Return a coherent HeadsetState without taking locks.
+
+        DongleListener.parse_payload publishes the readings of each packet as
+        one plain tuple, replaced with a single attribute assignment before
+        the packet's handlers run. Reading it never sees a half-applied
+        packet and never waits, even from inside a handler; the HeadsetState
+        and its sample time are only built here, when someone asks.
+        """
+        return self._state(self._published)
+
+    def _state(self, published):
+        samples = published[9]
+        sample_time = self.clock.time_of(samples - 1) if samples else None
+        return HeadsetState._make(published[:9] + (sample_time,))
+
+    def read_state(self, last_seq=-1):
+        """Return (state, True) if a packet arrived after last_seq, else (None, False)."""
+        published = self._published
+        if published[0] == last_seq:
+            return None, False
+        return self._state(published), True
+
     def set_log_callback(self, callback):
         """Permite registrar un callback para logs/notificaciones externas."""
         self._log_callback = callback
@@ -352,6 +678,14 @@ class Headset(object):
         else:
             print(msg)
 
+    def _handler_error(self, error):
+        """Count a packet whose decoder or handler raised; log at most once per second."""
+        self.handler_errors_counter.inc()
+        now = time.monotonic()
+        if now - self._handler_error_logged >= 1.0:
+            self._handler_error_logged = now
+            self._log(f"Error procesando un paquete del dongle: {error!r}")
+
     def connect(self, headset_id=None):
         """Connect to the specified headset id."""
         try:
@@ -362,13 +696,15 @@ class Headset(object):
                 if not headset_id:
                     self.autoconnect()
                     return
-            self.dongle.write(''.join([CONNECT, headset_id.decode('hex')]))
+            self._handshake = (CONNECT, headset_id)
+            self.dongle.write(CONNECT + bytes.fromhex(headset_id))
         except Exception as e:
             self._log(f"Error al conectar: {e}")
 
     def autoconnect(self):
         """Automatically connect device to headset."""
         try:
+            self._handshake = (AUTOCONNECT, None)
             self.dongle.write(AUTOCONNECT)
         except Exception as e:
             self._log(f"Error en autoconnect: {e}")
@@ -376,6 +712,7 @@ class Headset(object):
     def disconnect(self):
         """Disconnect the device from the headset."""
         try:
+            self._handshake = None
             self.dongle.write(DISCONNECT)
         except Exception as e:
             self._log(f"Error al desconectar: {e}")
@@ -385,13 +722,56 @@ class Headset(object):
         try:
             if not self.dongle or not self.dongle.isOpen():
                 self.dongle = serial.Serial(self.device, 115200)
-            if not self.listener or not self.listener.isAlive():
-                self.listener = self.DongleListener(self)
+                self._identity = port_identity(self.device) or self._identity
+            if not self.listener or not self.listener.is_alive():
+                self.listener = self.DongleListener(self, name='DongleListener')
                 self.listener.daemon = True
                 self.listener.start()
         except Exception as e:
             self._log(f"Error abriendo el puerto serie: {e}")
 
+    def _replay_handshake(self):
+        """Repeat the last connect/autoconnect request on a reopened dongle."""
+        code, headset_id = self._handshake
+        if code == CONNECT:
+            self.dongle.write(CONNECT + bytes.fromhex(headset_id))
+        else:
+            self.dongle.write(AUTOCONNECT)
+
+    def _lost(self, error):
+        self._log(f"Dongle perdido ({error}); buscando el puerto de nuevo...")
+        for handler in self.dongle_lost_handlers.frozen:
+            handler(self, error)
+
+    def _reopen(self):
+        """Re-discover and reopen the dongle with bounded exponential backoff.
+
+        Returns the open port, or None if the headset was stopped meanwhile.
+        """
+        delay = self.min_backoff
+        while self.running:
+            for device in find_dongle_ports(self.device, self._identity):
+                try:
+                    dongle = serial.Serial(device, 115200)
+                except (OSError, serial.SerialException):
+                    continue
+                if device != self.device:
+                    self._log(f"Dongle encontrado en {device}")
+                    self.device = device
+                self.dongle = dongle
+                return dongle
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
+        return None
+
+    def _recovered(self, seconds):
+        self.last_recovery = seconds
+        self.reconnects_counter.inc()
+        self.recovery_gauge.set(seconds)
+        self._log(f"Dongle recuperado en {seconds * 1000:.0f} ms")
+        for handler in self.dongle_recovered_handlers.frozen:
+            handler(self, seconds)
+
     def serial_close(self):
         """Close the serial connection."""
         try:
@@ -410,3 +790,63 @@ class Headset(object):
             self.serial_close()
         except Exception:
             pass
+
+
+def _fault_injection_report(seconds=120, flip_rate=2e-4, drop_rate=1e-4, chunk=64):
+    """Report parser throughput and error rates on a fault-injected byte stream."""
+    import random
+    rng = random.Random(0)
+    packets = []
+    for second in range(seconds):
+        for i in range(512):
+            raw = (second * 512 + i) % 1000
+            packets.append(encode_packet([RAW_VALUE, 2, raw >> 8, raw & 0xff]))
+        packets.append(encode_packet([POOR_SIGNAL, 0, ATTENTION, 42, MEDITATION, 42]))
+    clean = b''.join(packets)
+    stream = bytearray()
+    for b in clean:
+        r = rng.random()
+        if r < drop_rate:
+            continue
+        if r < drop_rate + flip_rate:
+            b ^= 1 << rng.randrange(8)
+        stream.append(b)
+    stream = bytes(stream)
+    expected = len(packets)
+
+    print(f"{len(stream)} bytes, {expected} packets, "
+          f"flip={flip_rate:g}/byte drop={drop_rate:g}/byte")
+    for strict in (False, True):
+        mode = 'strict' if strict else 'lenient'
+        headset = Headset('fault-injection-' + mode, open_serial=False,
+                          strict_checksum=strict)
+        listener = Headset.DongleListener(headset)
+        bad_values = [0]
+
+        def check_raw(h, value):
+            if not 0 <= value < 1000:
+                bad_values[0] += 1
+
+        def check_attention(h, value):
+            if value != 42:
+                bad_values[0] += 1
+        headset.raw_value_handlers.append(check_raw)
+        headset.attention_handlers.append(check_attention)
+        exceptions = 0
+        start = time.perf_counter()
+        for i in range(0, len(stream), chunk):
+            try:
+                listener.feed(stream[i:i + chunk])
+            except Exception:
+                exceptions += 1
+                listener._buffer.clear()
+        elapsed = time.perf_counter() - start
+        accepted = headset.packets_counter.value()
+        print(f"{mode:<7}: {len(stream) / elapsed / 1e6:.2f} MB/s, "
+              f"accepted={accepted} ({accepted / float(expected):.4%}), "
+              f"checksum failures={headset.checksum_errors_counter.value()}, "
+              f"corrupted values delivered={bad_values[0]}, parser exceptions={exceptions}")
+
+
+if __name__ == '__main__':
+    _fault_injection_report()
@@ -0,0 +1,586 @@
+'''
+Difusión por red (TCP) de las muestras decodificadas del headset a
+suscriptores remotos: paneles, grabadores... sin que cada uno abra el
+dispositivo.
+
+StreamServer se engancha a Headset (muestras crudas y eSense) o a
+ThinkGearClient (solo eSense y parpadeos) y reparte tramas a cualquier
+número de clientes TCP:
+
+    trama = tipo (u8) | longitud (u32 LE) | carga
+
+    HELLO  0x00  b'BBEEG' | versión (u8) | frecuencia cruda (u16)
+    RAW    0x01  seq de la primera muestra (u64) | n (u32) | tiempo (f64) | códec (u8) | datos
+    ESENSE 0x02  seq (u64) | tiempo (f64) | attention | meditation | poor_signal | blink (u8)
+
+Los bloques crudos int16 se codifican como diferencias entre muestras
+consecutivas (la primera respecto a 0) en zigzag, y después con el menor
+de dos códigos:
+
+ - códec 0, varint: una diferencia de ±63 ocupa 1 byte y cualquier
+   diferencia de int16 como mucho 3
+ - códec 1 + k, Rice con parámetro k (elegido por bloque): primero los
+   cocientes z >> k de todo el bloque en unario, luego los k bits bajos de
+   cada valor. Con diferencias pequeñas (señal poco ruidosa) baja a
+   k + 2 bits por muestra, donde varint nunca baja de 8
+
+Ninguna codificación sin pérdidas baja de la entropía de las diferencias,
+y en el EEG crudo la domina el ruido de banda ancha: con el de tg_emulator
+(σ≈15) son ~6.5 bits por muestra, un techo de ~2.5× frente a int16, y
+varint|Rice logra 2.3× (varint solo, 2.0×). Frente a las líneas JSON
+rawEeg del ThinkGear Connector la reducción sí es de más de 15×.
+La codificación se hace una sola vez por bloque, vectorizada con NumPy, y
+la misma trama se comparte entre todos los clientes.
+
+Cada cliente tiene su propio buffer acotado (`max_buffer` bytes): el hilo
+lector solo encola y un hilo emisor con `selectors` escribe sin bloquear.
+Si un cliente lento llena su buffer se descartan sus tramas más antiguas
+(nunca una a medio enviar); el cliente lo detecta por el salto de `seq`.
+
+El servidor escucha por defecto solo en 127.0.0.1: el flujo no lleva
+autenticación y exponerlo en la red (host='0.0.0.0') tiene que ser una
+decisión explícita.
+
+Uso en el proceso del headset:
+    server = StreamServer(port=13860).start()
+    server.attach(headset)                   # o server.attach_thinkgear(thinkgear)
+
+Uso en otra máquina:
+    client = StreamClient('192.168.1.20', 13860)
+    for block in client.iter_blocks():       # np.int16
+        ...
+    client.esense, client.lost
+'''
+import time
+import socket
+import struct
+import selectors
+import threading
+from collections import deque
+
+import numpy as np
+
+from metrics import registry
+
+STREAM_PORT = 13860
+VERSION = 2
+RAW_RATE = 512
+HELLO_MAGIC = b'BBEEG'
+
+FRAME_HELLO = 0x00
+FRAME_RAW = 0x01
+FRAME_ESENSE = 0x02
+
+CODEC_VARINT = 0
+CODEC_RICE = 1  # 1 + k
+MAX_RICE_K = 16
+
+FRAME_HEADER = struct.Struct('<BI')
+HELLO = struct.Struct('<5sBH')
+RAW_HEADER = struct.Struct('<QIdB')
+ESENSE = struct.Struct('<QdBBBB')
+
+
+def _zigzag_deltas(samples):
+    values = np.asarray(samples, dtype=np.int32)
+    deltas = np.diff(values, prepend=0)
+    return ((deltas << 1) ^ (deltas >> 31)).astype(np.uint32)
+
+
+def _from_zigzag(zigzag):
+    zigzag = zigzag.astype(np.int64)
+    deltas = (zigzag >> 1) ^ -(zigzag & 1)
+    return np.cumsum(deltas).astype(np.int16)
+
+
+def encode_deltas(samples):
+    """Codifica un bloque int16 como diferencias en zigzag + varint (bytes)"""
+    return _encode_varint(_zigzag_deltas(samples))
+
+
+def _encode_varint(zigzag):
+    lengths = 1 + (zigzag >= 0x80) + (zigzag >= 0x4000)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    out = np.empty(int(ends[-1]) if len(ends) else 0, dtype=np.uint8)
+    more1 = lengths > 1
+    more2 = lengths > 2
+    out[starts] = (zigzag & 0x7F) | (more1 << 7)
+    out[starts[more1] + 1] = ((zigzag[more1] >> 7) & 0x7F) | (more2[more1] << 7)
+    out[starts[more2] + 2] = zigzag[more2] >> 14
+    return out.tobytes()
+
+
+def decode_deltas(data, count=None):
+    """Inverso de encode_deltas(): devuelve un array int16"""
+    b = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(b < 0x80)
+    if count is not None and len(ends) != count:
+        raise ValueError(f"Bloque corrupto: {len(ends)} valores en lugar de {count}")
+    if not len(ends):
+        return np.zeros(0, dtype=np.int16)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    if len(lengths) and lengths.max() > 3:
+        raise ValueError("Varint de más de 3 bytes en un bloque int16")
+    zigzag = (b[starts] & 0x7F).astype(np.int64)
+    more1 = lengths > 1
+    more2 = lengths > 2
+    zigzag[more1] |= (b[starts[more1] + 1] & 0x7F).astype(np.int64) << 7
+    zigzag[more2] |= b[starts[more2] + 2].astype(np.int64) << 14
+    return _from_zigzag(zigzag)
+
+
+def _rice_bits(zigzag):
+    """(k, bits) del parámetro Rice que menos bits necesita para el bloque"""
+    ks = np.arange(MAX_RICE_K + 1, dtype=np.uint32)
+    bits = (zigzag[None, :] >> ks[:, None]).sum(axis=1) + len(zigzag) * (ks + 1)
+    k = int(np.argmin(bits))
+    return k, int(bits[k])
+
+
+def encode_rice(samples, k=None):
+    """Codifica un bloque int16 como diferencias en zigzag + Rice; devuelve (k, bytes)
+
+    Primero van los cocientes z >> k de todas las muestras en unario (unos
+    terminados en cero) y después los k bits bajos de cada una, de modo que
+    el decodificador separa ambas partes sin recorrer el flujo bit a bit.
+    """
+    zigzag = _zigzag_deltas(samples)
+    if k is None:
+        k = _rice_bits(zigzag)[0]
+    return k, _encode_rice(zigzag, k)
+
+
+def _encode_rice(zigzag, k):
+    quotients = (zigzag >> k).astype(np.int64)
+    unary = np.ones(int(quotients.sum()) + len(zigzag), dtype=np.uint8)
+    unary[np.cumsum(quotients + 1) - 1] = 0
+    shifts = np.arange(k - 1, -1, -1, dtype=np.uint32)
+    low = ((zigzag[:, None] >> shifts) & 1).astype(np.uint8).ravel()
+    return np.packbits(np.concatenate((unary, low))).tobytes()
+
+
+def decode_rice(data, count, k):
+    """Inverso de encode_rice(): devuelve un array int16"""
+    if not count:
+        return np.zeros(0, dtype=np.int16)
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    ends = np.flatnonzero(bits == 0)[:count]
+    if len(ends) < count:
+        raise ValueError("Bloque Rice corrupto: faltan cocientes")
+    quotients = np.diff(ends, prepend=-1) - 1
+    start = int(ends[-1]) + 1
+    low = bits[start:start + count * k]
+    if len(low) < count * k:
+        raise ValueError("Bloque Rice corrupto: faltan bits bajos")
+    weights = (1 << np.arange(k - 1, -1, -1)).astype(np.int64)
+    remainders = low.reshape(count, k).astype(np.int64) @ weights
+    return _from_zigzag((quotients.astype(np.int64) << k) | remainders)
+
+
+def encode_block(samples):
+    """Codifica un bloque int16 con el código más corto; devuelve (códec, bytes)"""
+    zigzag = _zigzag_deltas(samples)
+    if not len(zigzag):
+        return CODEC_VARINT, b''
+    varint_bytes = int(len(zigzag) + (zigzag >= 0x80).sum() + (zigzag >= 0x4000).sum())
+    k, bits = _rice_bits(zigzag)
+    if (bits + 7) // 8 < varint_bytes:
+        return CODEC_RICE + k, _encode_rice(zigzag, k)
+    return CODEC_VARINT, _encode_varint(zigzag)
+
+
+def decode_block(codec, data, count):
+    """Inverso de encode_block()"""
+    if codec == CODEC_VARINT:
+        return decode_deltas(data, count)
+    if CODEC_RICE <= codec <= CODEC_RICE + MAX_RICE_K:
+        return decode_rice(data, count, codec - CODEC_RICE)
+    raise ValueError(f"Códec de bloque desconocido: {codec}")
+
+
+def _frame(kind, payload):
+    return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+
+class _Client(object):
+    """Conexión de un suscriptor con su cola de tramas acotada en bytes"""
+
+    __slots__ = ('sock', 'address', 'frames', 'buffered', 'current', 'offset',
+                 'dropped', 'sent')
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.frames = deque()
+        self.buffered = 0
+        self.current = None
+        self.offset = 0
+        self.dropped = 0
+        self.sent = 0
+
+
+class StreamServer(object):
+    """Servidor TCP que difunde muestras crudas comprimidas y valores eSense"""
+
+    def __init__(self, host='127.0.0.1', port=STREAM_PORT, block=64, max_buffer=1 << 18,
+                 rate=RAW_RATE):
+        self.host = host
+        self.port = port
+        self.block = block
+        self.max_buffer = max_buffer
+        self.rate = rate
+        self.seq = 0
+        self._pending = []
+        self._pending_time = None
+        self._clients = ()
+        self._lock = threading.Lock()  # Colas y contadores de bytes de los clientes
+        self._selector = selectors.DefaultSelector()
+        self._listener = None
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._woken = False
+        self.running = False
+        self.headset = None
+        self.thinkgear = None
+        self._thinkgear_handlers = ()
+        self._raw_bytes = 0
+        self._encoded_bytes = 0
+        labels = {'port': str(port)}
+        self._sent_counter = registry.counter(
+            'stream_bytes_sent_total', 'Bytes enviados a suscriptores remotos', labels)
+        self._dropped_counter = registry.counter(
+            'stream_frames_dropped_total', 'Tramas descartadas por clientes lentos', labels)
+        registry.gauge('stream_clients', 'Suscriptores conectados', labels,
+                       fn=lambda: len(self._clients))
+
+    def start(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(16)
+        listener.setblocking(False)
+        self._listener = listener
+        self.port = listener.getsockname()[1]
+        self._selector.register(listener, selectors.EVENT_READ, None)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self.running = True
+        threading.Thread(target=self._run, name='stream-server', daemon=True).start()
+        return self
+
+    # ---- Lado productor (hilo lector) ----
+
+    def publish_raw(self, value, timestamp=None):
+        """Añade una muestra cruda; se envía un bloque cada `block` muestras"""
+        if not self._pending:
+            self._pending_time = timestamp
+        self._pending.append(value)
+        if len(self._pending) >= self.block:
+            self.flush()
+
+    def publish_block(self, samples, timestamp=None):
+        """Envía un bloque de muestras crudas int16 de una vez"""
+        self.flush()
+        self._send_raw(np.asarray(samples, dtype=np.int16), timestamp)
+
+    def flush(self):
+        if self._pending:
+            samples = np.array(self._pending, dtype=np.int16)
+            self._pending = []
+            self._send_raw(samples, self._pending_time)
+
+    def _send_raw(self, samples, timestamp):
+        n = len(samples)
+        if not n:
+            return
+        codec, body = encode_block(samples)
+        payload = RAW_HEADER.pack(self.seq, n, float('nan') if timestamp is None else timestamp,
+                                  codec)
+        self.seq += n
+        self._raw_bytes += 2 * n
+        self._encoded_bytes += len(body)
+        self._enqueue(_frame(FRAME_RAW, payload + body))
+
+    def publish_esense(self, attention, meditation, poor_signal=0, blink=0, timestamp=None):
+        payload = ESENSE.pack(self.seq + len(self._pending),
+                              float('nan') if timestamp is None else timestamp,
+                              attention, meditation, min(poor_signal, 255), blink)
+        self._enqueue(_frame(FRAME_ESENSE, payload))
+
+    def _enqueue(self, frame):
+        size = len(frame)
+        limit = self.max_buffer
+        with self._lock:
+            for client in self._clients:
+                frames = client.frames
+                frames.append(frame)
+                client.buffered += size
+                # Cliente lento: descartar sus tramas más antiguas
+                while client.buffered > limit and len(frames) > 1:
+                    client.buffered -= len(frames.popleft())
+                    client.dropped += 1
+                    self._dropped_counter.inc()
+        if self._clients and not self._woken:
+            self._woken = True
+            try:
+                self._wake_w.send(b'\0')
+            except OSError:
+                pass
+
+    # ---- Enganches ----
+
+    def attach(self, headset):
+        """Difunde cada muestra cruda del headset y sus cambios de eSense"""
+        self.headset = headset
+        headset.raw_value_handlers.append(self._on_raw_value)
+        headset.attention_handlers.append(self._on_esense)
+        headset.meditation_handlers.append(self._on_esense)
+        headset.blink_handlers.append(self._on_esense)
+        return self
+
+    def _on_raw_value(self, headset, value):
+        if not self._pending:
+            self._pending_time = headset.sample_time
+        self._pending.append(value)
+        if len(self._pending) >= self.block:
+            self.flush()
+
+    def _on_esense(self, headset, _value):
+        self.publish_esense(headset.attention, headset.meditation, headset.poor_signal,
+                            headset.blink, headset.esense_time)
+
+    def attach_thinkgear(self, thinkgear):
+        """Difunde los valores eSense y parpadeos de ThinkGearClient (sin muestras crudas)"""
+        self.thinkgear = thinkgear
+        state = {'attention': 0, 'meditation': 0, 'blink': 0}
+
+        def handler(name):
+            def on_value(value):
+                state[name] = value
+                self.publish_esense(state['attention'], state['meditation'],
+                                    thinkgear.signal_quality, state['blink'],
+                                    thinkgear.sample_time)
+            return on_value
+
+        self._thinkgear_handlers = (handler('attention'), handler('meditation'),
+                                    handler('blink'))
+        thinkgear.attention_handlers.append(self._thinkgear_handlers[0])
+        thinkgear.meditation_handlers.append(self._thinkgear_handlers[1])
+        thinkgear.blink_handlers.append(self._thinkgear_handlers[2])
+        return self
+
+    def detach(self):
+        headset = self.headset
+        if headset is not None:
+            for handlers, fn in ((headset.raw_value_handlers, self._on_raw_value),
+                                 (headset.attention_handlers, self._on_esense),
+                                 (headset.meditation_handlers, self._on_esense),
+                                 (headset.blink_handlers, self._on_esense)):
+                try:
+                    handlers.remove(fn)
+                except ValueError:
+                    pass
+            self.headset = None
+        thinkgear = self.thinkgear
+        if thinkgear is not None:
+            for handlers, fn in zip((thinkgear.attention_handlers, thinkgear.meditation_handlers,
+                                     thinkgear.blink_handlers), self._thinkgear_handlers):
+                try:
+                    handlers.remove(fn)
+                except ValueError:
+                    pass
+            self.thinkgear = None
+
+    # ---- Hilo emisor ----
+
+    def _run(self):
+        selector = self._selector
+        while self.running:
+            try:
+                events = selector.select(0.5)
+            except OSError:
+                break
+            for key, mask in events:
+                sock = key.fileobj
+                if sock is self._listener:
+                    self._accept()
+                elif sock is self._wake_r:
+                    # Primero vaciar y luego bajar la marca: un productor que
+                    # llegue entre medias ve _woken=True sin enviar byte, pero su
+                    # trama ya está en la cola y se recoge en el recorrido de abajo
+                    self._drain_wakeups()
+                    self._woken = False
+                    for client in self._clients:
+                        if client.frames and client.current is None:
+                            self._write(client)
+                else:
+                    if mask & selectors.EVENT_READ:
+                        self._read(key.data)
+                    if mask & selectors.EVENT_WRITE and key.data.sock.fileno() != -1:
+                        self._write(key.data)
+
+    def _drain_wakeups(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _accept(self):
+        try:
+            sock, address = self._listener.accept()
+        except (BlockingIOError, OSError):
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = _Client(sock, address)
+        hello = _frame(FRAME_HELLO, HELLO.pack(HELLO_MAGIC, VERSION, self.rate))
+        client.current = hello
+        with self._lock:
+            self._clients = self._clients + (client,)
+        self._selector.register(sock, selectors.EVENT_READ, client)
+        self._write(client)
+
+    def _write(self, client):
+        """Envía lo que acepte el socket sin bloquear; al vaciarse deja de pedir EVENT_WRITE"""
+        sock = client.sock
+        try:
+            while True:
+                if client.current is None:
+                    with self._lock:
+                        if not client.frames:
+                            break
+                        client.current = client.frames.popleft()
+                        client.buffered -= len(client.current)
+                    client.offset = 0
+                sent = sock.send(memoryview(client.current)[client.offset:])
+                client.offset += sent
+                client.sent += sent
+                self._sent_counter.inc(sent)
+                if client.offset < len(client.current):
+                    break
+                client.current = None
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._drop(client)
+            return
+        # Solo se pide EVENT_WRITE mientras quede algo por enviar
+        events = selectors.EVENT_READ
+        if client.current is not None or client.frames:
+            events |= selectors.EVENT_WRITE
+        try:
+            self._selector.modify(sock, events, client)
+        except (KeyError, ValueError):
+            pass
+
+    def _read(self, client):
+        """Los suscriptores no envían nada: se descarta lo recibido y se detecta el cierre"""
+        try:
+            if not client.sock.recv(4096):
+                self._drop(client)
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._drop(client)
+
+    def _drop(self, client):
+        with self._lock:
+            self._clients = tuple(c for c in self._clients if c is not client)
+        try:
+            self._selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+
+    def stats(self):
+        """Clientes, tramas descartadas y relación de compresión de los bloques crudos"""
+        return {
+            'clients': [{'address': c.address, 'sent': c.sent, 'dropped': c.dropped,
+                         'buffered': c.buffered} for c in self._clients],
+            'samples': self.seq,
+            'compression': self._raw_bytes / float(self._encoded_bytes)
+            if self._encoded_bytes else None,
+        }
+
+    def close(self):
+        self.detach()
+        self.running = False
+        for client in self._clients:
+            client.sock.close()
+        self._clients = ()
+        if self._listener is not None:
+            self._listener.close()
+        self._wake_w.close()
+        self._wake_r.close()
+        self._selector.close()
+
+
+class StreamClient(object):
+    """Suscriptor de un StreamServer: entrega bloques crudos NumPy y el último eSense"""
+
+    def __init__(self, host='127.0.0.1', port=STREAM_PORT, timeout=5.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.settimeout(None)
+        self._buffer = bytearray()
+        self.esense = None
+        self.expected = None
+        self.lost = 0
+        kind, payload = self._read_frame()
+        if kind != FRAME_HELLO:
+            raise ValueError("El servidor no envió HELLO")
+        magic, self.version, self.rate = HELLO.unpack_from(payload)
+        if magic != HELLO_MAGIC:
+            raise ValueError("No es un servidor de flujo EEG")
+        if self.version != VERSION:
+            raise ValueError(f"Versión de protocolo {self.version} no soportada (se espera {VERSION})")
+
+    def _recv_exact(self, n):
+        buffer = self._buffer
+        while len(buffer) < n:
+            chunk = self.sock.recv(max(65536, n - len(buffer)))
+            if not chunk:
+                raise EOFError("Conexión cerrada por el servidor")
+            buffer += chunk
+        data = bytes(buffer[:n])
+        del buffer[:n]
+        return data
+
+    def _read_frame(self):
+        kind, length = FRAME_HEADER.unpack(self._recv_exact(FRAME_HEADER.size))
+        return kind, self._recv_exact(length)
+
+    def read(self):
+        """Siguiente mensaje: ('raw', (seq, tiempo, array int16)) o ('esense', dict)"""
+        while True:
+            kind, payload = self._read_frame()
+            if kind == FRAME_RAW:
+                seq, n, timestamp, codec = RAW_HEADER.unpack_from(payload)
+                samples = decode_block(codec, payload[RAW_HEADER.size:], n)
+                if self.expected is not None and seq > self.expected:
+                    self.lost += seq - self.expected
+                self.expected = seq + n
+                return 'raw', (seq, timestamp, samples)
+            if kind == FRAME_ESENSE:
+                seq, timestamp, attention, meditation, poor_signal, blink = ESENSE.unpack(payload)
+                self.esense = {'seq': seq, 'time': timestamp, 'attention': attention,
+                               'meditation': meditation, 'poor_signal': poor_signal,
+                               'blink': blink}
+                return 'esense', self.esense
+            # Tipos desconocidos (versiones futuras): se ignoran
+
+    def iter_blocks(self, timeout=None):
+        """Generador de bloques crudos np.int16; actualiza self.esense y self.lost por el camino"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            try:
+                kind, data = self.read()
+            except EOFError:
+                return
+            if kind == 'raw':
+                yield data[2]
+
+    def close(self):
+        self.sock.close()
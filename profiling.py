@@ -0,0 +1,195 @@
+'''
+Perfilado bajo demanda de la aplicación en marcha, sin reiniciarla.
+
+StackSampler toma cada `interval` segundos la pila de todos los hilos con
+sys._current_frames() (DongleListener, _read_data_loop, _control_loop,
+_status_polling...) y cuenta cada pila. El resultado se escribe en formato
+"collapsed stacks", una línea por pila:
+
+    hilo;función (fichero:línea);...;función (fichero:línea) <muestras>
+
+compatible con flamegraph.pl, speedscope o inferno. El coste es el de un
+hilo que se despierta cada 5 ms; fuera de una sesión no hay ninguno.
+
+Con memory=True se activa además tracemalloc durante la sesión y al final
+se guarda un informe con las líneas que más memoria han reservado.
+
+Disparadores:
+ - botón "Perfilar" de la GUI (también en modo multiproceso, en el worker)
+ - señal SIGUSR1 al proceso (install_signal_handler)
+ - GET /profile?seconds=10&memory=1 en el servidor de métricas
+   (BRAINBULB_METRICS_PORT), que devuelve las pilas en la respuesta
+'''
+import os
+import sys
+import time
+import signal
+import threading
+import tracemalloc
+from collections import Counter
+
+PROFILE_DIR = os.environ.get("BRAINBULB_PROFILE_DIR", "perfiles")
+DEFAULT_SECONDS = 10
+DEFAULT_INTERVAL = 0.005
+
+_session_lock = threading.Lock()
+
+
+class StackSampler(object):
+    """Muestreo periódico de las pilas de todos los hilos"""
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+        self._codes = {}
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def _label(self, frame):
+        code = frame.f_code
+        label = self._codes.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._codes[code] = label
+        return label
+
+    def _run(self):
+        own = threading.get_ident()
+        interval = self.interval
+        while self.running:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+            time.sleep(interval)
+
+    def collapsed(self):
+        """Texto en formato collapsed stacks"""
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+def allocation_report(snapshot, limit=25):
+    """Líneas que más memoria tienen reservada en la instantánea de tracemalloc"""
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+    stats = snapshot.statistics('lineno')
+    total = sum(stat.size for stat in stats)
+    lines = [f"Memoria reservada durante la sesión: {total / 1024:.1f} KiB"]
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} bloques  "
+                     f"{frame.filename}:{frame.lineno}")
+    return '\n'.join(lines) + '\n'
+
+
+def profile(seconds=DEFAULT_SECONDS, memory=False, interval=DEFAULT_INTERVAL,
+            directory=PROFILE_DIR, tag=None):
+    """Perfila el proceso durante `seconds` segundos (bloquea al llamante)
+
+    Devuelve un dict con las rutas escritas ('stacks' y, con memory=True,
+    'allocations') y el texto collapsed ('collapsed'). Solo se admite una
+    sesión a la vez; si ya hay una en curso lanza RuntimeError.
+    """
+    if not _session_lock.acquire(blocking=False):
+        raise RuntimeError("Ya hay una sesión de perfilado en curso")
+    try:
+        started_tracemalloc = False
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(8)
+            started_tracemalloc = True
+        sampler = StackSampler(interval).start()
+        try:
+            time.sleep(seconds)
+        finally:
+            sampler.stop()
+            snapshot = tracemalloc.take_snapshot() if memory else None
+            if started_tracemalloc:
+                tracemalloc.stop()
+
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(directory, f"perfil-{tag or os.getpid()}-{stamp}")
+        result = {'collapsed': sampler.collapsed(), 'samples': sampler.samples}
+        result['stacks'] = base + '.collapsed'
+        with open(result['stacks'], 'w') as f:
+            f.write(result['collapsed'])
+        if snapshot is not None:
+            result['allocations'] = base + '.alloc.txt'
+            with open(result['allocations'], 'w') as f:
+                f.write(allocation_report(snapshot))
+        return result
+    finally:
+        _session_lock.release()
+
+
+def profile_async(seconds=DEFAULT_SECONDS, memory=False, callback=None, **kwargs):
+    """Lanza profile() en un hilo; `callback(resultado, error)` al terminar"""
+    def run():
+        try:
+            result, error = profile(seconds, memory, **kwargs), None
+        except Exception as e:
+            result, error = None, e
+        if callback:
+            callback(result, error)
+
+    thread = threading.Thread(target=run, name='profiler', daemon=True)
+    thread.start()
+    return thread
+
+
+def install_signal_handler(seconds=DEFAULT_SECONDS, memory=False, signum=None, log=print):
+    """Perfila `seconds` segundos al recibir SIGUSR1 (en ejecuciones sin GUI)
+
+    Devuelve False si la plataforma no tiene la señal (Windows).
+    """
+    signum = signum or getattr(signal, 'SIGUSR1', None)
+    if signum is None:
+        return False
+
+    def done(result, error):
+        if error is not None:
+            log(f"Perfilado no realizado: {error}")
+        else:
+            log(f"Perfil guardado en {result['stacks']} ({result['samples']} muestras)")
+
+    def handler(_signum, _frame):
+        profile_async(seconds, memory, callback=done)
+
+    signal.signal(signum, handler)
+    return True
+
+
+def http_route(query):
+    """Ruta /profile del servidor de métricas: ?seconds=N&memory=1
+
+    Responde con las pilas; las rutas de los ficheros escritos van en las
+    cabeceras X-Profile-Stacks y X-Profile-Allocations.
+    """
+    seconds = min(float(query.get('seconds', [DEFAULT_SECONDS])[0]), 120.0)
+    memory = query.get('memory', ['0'])[0] == '1'
+    result = profile(seconds, memory)
+    headers = {'X-Profile-Stacks': result['stacks']}
+    if 'allocations' in result:
+        headers['X-Profile-Allocations'] = result['allocations']
+    return 'text/plain; charset=utf-8', result['collapsed'], headers
@@ -0,0 +1,82 @@
+'''
+Reloj de muestras: marcas de tiempo monotónicas derivadas del contador de
+muestras del headset.
+
+El headset produce muestras crudas a 512 Hz y eSense a 1 Hz con su propio
+oscilador, pero los bytes llegan al PC en ráfagas y con el retraso del
+planificador de hilos. En lugar de sellar cada evento con la hora de
+llegada, SampleClock asigna a la muestra n el tiempo
+
+    origen + n / rate
+
+y ajusta `origen` con las horas de llegada (time.monotonic):
+
+ - una muestra no puede llegar antes de producirse, así que si llega antes
+   de lo previsto el origen se adelanta de inmediato (envolvente inferior);
+ - si llega más tarde, el origen avanza solo una fracción `creep` del
+   residuo, lo que absorbe la deriva del oscilador sin meter el jitter;
+ - si el residuo supera `resync` segundos (paquetes perdidos, reconexión)
+   el reloj se reancla a la llegada.
+
+Sin horas de llegada (reproducción offline) el tiempo es exactamente
+n / rate, reproducible en cada ejecución.
+'''
+
+
+class SampleClock(object):
+    """Convierte el índice de cada muestra en un tiempo monotónico corregido
+
+    En la ruta caliente basta con incrementar `count` por muestra; observe()
+    ancla el reloj una vez por lectura con la hora de llegada y now() calcula
+    el tiempo de la última muestra solo cuando alguien lo pide.
+    """
+
+    def __init__(self, rate=512.0, creep=0.01, resync=0.25):
+        self.rate = float(rate)
+        self.period = 1.0 / rate
+        self.creep = creep
+        self.resync = resync
+        self.count = 0
+        self.origin = None
+        self.resyncs = 0
+
+    def observe(self, arrival):
+        """Ajusta el origen con la hora de llegada de la última muestra contada"""
+        if not self.count:
+            return
+        n = self.count - 1
+        origin = self.origin
+        if origin is None:
+            self.origin = arrival - n * self.period
+            return
+        residual = arrival - (origin + n * self.period)
+        if residual < 0:
+            # Llegó antes de lo previsto: la predicción iba adelantada
+            self.origin = origin + residual
+        elif residual > self.resync:
+            self.origin = arrival - n * self.period
+            self.resyncs += 1
+        else:
+            self.origin = origin + self.creep * residual
+
+    def time_of(self, index):
+        """Marca de tiempo de la muestra `index` (desde 0 si no hay anclaje)"""
+        origin = self.origin
+        return (0.0 if origin is None else origin) + index * self.period
+
+    def now(self):
+        """Marca de tiempo de la última muestra contada, o None si no hay ninguna"""
+        if not self.count:
+            return None
+        return self.time_of(self.count - 1)
+
+    def tick(self, arrival=None):
+        """Cuenta una muestra, ancla con `arrival` si se da y devuelve su marca"""
+        self.count += 1
+        if arrival is not None:
+            self.observe(arrival)
+        return self.time_of(self.count - 1)
+
+    def reset(self):
+        self.count = 0
+        self.origin = None
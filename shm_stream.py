@@ -0,0 +1,217 @@
+'''
+Difusión de las muestras decodificadas del headset a otros procesos locales
+mediante un anillo en memoria compartida (multiprocessing.shared_memory).
+
+El publicador escribe registros de tamaño fijo (raw, attention, meditation,
+poor_signal, blink) en el anillo y después avanza un contador de secuencia en
+la cabecera. Cualquier número de suscriptores puede adjuntarse por nombre y
+leer vistas NumPy directamente sobre la memoria compartida, sin copias ni
+pickle. El productor nunca espera: un suscriptor lento que se queda más de
+`capacity` registros atrás salta al dato más antiguo disponible y contabiliza
+lo perdido solo para sí.
+
+Uso en el proceso del headset:
+    pub = SharedRingPublisher('brainbulb-eeg')
+    pub.attach(headset)
+
+Uso en otro proceso:
+    sub = SharedRingSubscriber('brainbulb-eeg')
+    block, lost = sub.read()
+    block['raw']  # vista int16 sin copia
+'''
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+RECORD_DTYPE = np.dtype([
+    ('raw', '<i2'),
+    ('attention', 'u1'),
+    ('meditation', 'u1'),
+    ('poor_signal', 'u1'),
+    ('blink', 'u1'),
+])
+
+MAGIC = 0x4242454547  # "BBEEG"
+HEADER_SIZE = 64
+# Índices de la cabecera (uint64)
+_H_MAGIC, _H_CAPACITY, _H_RECORD_SIZE, _H_WRITE_SEQ, _H_TRACKER = range(5)
+
+
+def _tracker_pid():
+    try:
+        from multiprocessing import resource_tracker
+        return resource_tracker._resource_tracker._pid or 0
+    except Exception:
+        return 0
+
+
+def _attach(name):
+    """Adjunta un segmento existente sin que el resource_tracker lo elimine al salir"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Python < 3.13: el tracker registra también los segmentos adjuntados. Si el
+    # tracker es propio (no heredado del publicador) hay que desregistrarlo.
+    shm = shared_memory.SharedMemory(name=name)
+    header = np.ndarray((HEADER_SIZE // 8,), dtype='<u8', buffer=shm.buf)
+    publisher_tracker = int(header[_H_TRACKER])
+    del header
+    if _tracker_pid() != publisher_tracker:
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+    return shm
+
+
+class SharedRingPublisher(object):
+    """Productor de registros EEG en un anillo de memoria compartida"""
+
+    def __init__(self, name=None, capacity=1 << 16, batch=16):
+        self.capacity = capacity
+        self.batch = batch
+        size = HEADER_SIZE + capacity * RECORD_DTYPE.itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self.shm.name
+        self.header = np.ndarray((HEADER_SIZE // 8,), dtype='<u8', buffer=self.shm.buf)
+        self.records = np.ndarray((capacity,), dtype=RECORD_DTYPE,
+                                  buffer=self.shm.buf, offset=HEADER_SIZE)
+        self.header[:] = 0
+        self.header[_H_CAPACITY] = capacity
+        self.header[_H_RECORD_SIZE] = RECORD_DTYPE.itemsize
+        self.header[_H_TRACKER] = _tracker_pid()
+        self.header[_H_MAGIC] = MAGIC
+        self._seq = 0
+        self._pending = []
+        self.headset = None
+
+    def publish(self, raw, attention=0, meditation=0, poor_signal=0, blink=0):
+        """Encola un registro; se escribe en el anillo cada `batch` registros"""
+        self._pending.append((raw, attention, meditation, min(poor_signal, 255), blink))
+        if len(self._pending) >= self.batch:
+            self.flush()
+
+    def publish_block(self, block):
+        """Escribe un bloque de registros (array con RECORD_DTYPE o compatible)"""
+        self.flush()
+        self._write(np.asarray(block, dtype=RECORD_DTYPE))
+
+    def flush(self):
+        if self._pending:
+            block = np.array(self._pending, dtype=RECORD_DTYPE)
+            self._pending = []
+            self._write(block)
+
+    def _write(self, block):
+        n = len(block)
+        if n > self.capacity:
+            block = block[-self.capacity:]
+            self._seq += n - self.capacity
+            n = self.capacity
+        start = self._seq % self.capacity
+        first = min(n, self.capacity - start)
+        self.records[start:start + first] = block[:first]
+        if first < n:
+            self.records[:n - first] = block[first:]
+        # Publicar los datos solo después de escribirlos
+        self._seq += n
+        self.header[_H_WRITE_SEQ] = self._seq
+
+    def attach(self, headset):
+        """Publica cada muestra cruda del headset junto con sus últimos valores eSense"""
+        self.headset = headset
+        headset.raw_value_handlers.append(self._on_raw_value)
+
+    def detach(self):
+        if self.headset is not None:
+            try:
+                self.headset.raw_value_handlers.remove(self._on_raw_value)
+            except ValueError:
+                pass
+            self.headset = None
+
+    def _on_raw_value(self, headset, value):
+        self.publish(value, headset.attention, headset.meditation,
+                     headset.poor_signal, headset.blink)
+
+    def close(self, unlink=True):
+        self.detach()
+        self.flush()
+        self.header = None
+        self.records = None
+        self.shm.close()
+        if unlink:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SharedRingSubscriber(object):
+    """Lector independiente de un anillo publicado por SharedRingPublisher"""
+
+    def __init__(self, name, start='latest'):
+        self.shm = _attach(name)
+        self.header = np.ndarray((HEADER_SIZE // 8,), dtype='<u8', buffer=self.shm.buf)
+        if int(self.header[_H_MAGIC]) != MAGIC:
+            self.shm.close()
+            raise ValueError(f"El segmento {name} no es un anillo EEG")
+        self.capacity = int(self.header[_H_CAPACITY])
+        self.records = np.ndarray((self.capacity,), dtype=RECORD_DTYPE,
+                                  buffer=self.shm.buf, offset=HEADER_SIZE)
+        write_seq = int(self.header[_H_WRITE_SEQ])
+        if start == 'latest':
+            self.cursor = write_seq
+        else:
+            self.cursor = max(0, write_seq - self.capacity)
+        self._view_start = self.cursor
+        self.lost = 0
+
+    def available(self):
+        return int(self.header[_H_WRITE_SEQ]) - self.cursor
+
+    def read(self, max_items=None):
+        """Devuelve (vista, perdidos) con los registros nuevos contiguos en el anillo
+
+        La vista apunta a la memoria compartida; si el consumidor tarda más de
+        lo que el productor tarda en dar la vuelta al anillo puede ser
+        sobrescrita, lo que se comprueba con overrun(). Si el bloque nuevo
+        cruza el final del anillo se devuelve solo la primera parte.
+        """
+        write_seq = int(self.header[_H_WRITE_SEQ])
+        lost = 0
+        if write_seq - self.cursor > self.capacity:
+            lost = write_seq - self.cursor - self.capacity
+            self.cursor = write_seq - self.capacity
+            self.lost += lost
+        n = write_seq - self.cursor
+        if max_items is not None:
+            n = min(n, max_items)
+        start = self.cursor % self.capacity
+        n = min(n, self.capacity - start)
+        view = self.records[start:start + n]
+        self._view_start = self.cursor
+        self.cursor += n
+        return view, lost
+
+    def overrun(self):
+        """True si el último bloque leído pudo ser sobrescrito por el productor"""
+        return int(self.header[_H_WRITE_SEQ]) - self._view_start > self.capacity
+
+    def iter_blocks(self, poll=0.005, timeout=None):
+        """Generador de bloques nuevos, esperando con sondeo si no hay datos"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            view, _lost = self.read()
+            if len(view):
+                yield view
+            else:
+                time.sleep(poll)
+
+    def close(self):
+        self.header = None
+        self.records = None
+        self.shm.close()
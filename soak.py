@@ -0,0 +1,239 @@
+'''
+Prueba de resistencia (soak) de memoria e hilos para sesiones largas.
+
+Recorre el pipeline completo sin GUI a velocidad acelerada: el emulador del
+ThinkGear Connector (tg_emulator.py, en otro proceso) emite eSense y
+parpadeos sintéticos a `speed` veces el tiempo real hacia un
+ThinkGearClient supervisado; BrainSignalProcessor detecta los gestos y un
+bucle de control como el de la aplicación los envía por HTTP a dos
+sustitutos locales del ESP8266. Cada hora virtual se repite lo que hace
+"Reconectar" en la GUI (se alterna el foco entre los dos sustitutos y se
+reconecta ThinkGear) y se anotan la RSS y el número de hilos.
+
+Al final una fase de "basura" envía bytes sin '\\r' al cliente durante unos
+segundos para comprobar el límite ThinkGearClient.MAX_LINE, y si hay
+pantalla disponible se comprueba el límite de líneas de los registros de la
+GUI (MAX_TEXT_LINES).
+
+La prueba falla (código de salida 1) si, pasado el calentamiento, la RSS
+crece más de --rss-slack MB o el número de hilos más de --thread-slack.
+
+Uso:
+    python soak.py                       # 24 h virtuales a x500 (~3 min)
+    python soak.py --hours 4 --speed 1000
+'''
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import multiprocessing
+from http.server import ThreadingHTTPServer
+
+from benchmark import _BulbStandIn
+from sampleclock import SampleClock
+import tg_emulator
+
+
+def rss_bytes():
+    """Memoria residente actual del proceso (pico si no hay /proc)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _bulb_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _BulbStandIn)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _garbage_server(chunk=b'x' * 4096):
+    """Conector defectuoso: acepta un cliente y le envía bytes sin separador"""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    running = [True]
+
+    def serve():
+        while running[0]:
+            try:
+                conn, _addr = listener.accept()
+            except OSError:
+                return
+            try:
+                while running[0]:
+                    conn.sendall(chunk)
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    def stop():
+        running[0] = False
+        listener.close()
+    return listener.getsockname()[1], stop
+
+
+def soak(hours=24.0, speed=500.0, warmup=2, rss_slack=16.0, thread_slack=4,
+         garbage_seconds=5.0, log=print):
+    """Ejecuta la prueba y devuelve True si memoria e hilos se mantienen acotados"""
+    from BrainHomeController import (BrainSignalProcessor, SmartBulbController, ThinkGearClient,
+                                     MAX_TEXT_LINES)
+
+    ready = multiprocessing.Queue()
+    emulator = multiprocessing.Process(target=tg_emulator._serve,
+                                       args=(0, speed, 0, None, ready), daemon=True)
+    emulator.start()
+    tg_port = ready.get(timeout=10)
+    bulb_servers = [_bulb_server(), _bulb_server()]
+
+    processor = BrainSignalProcessor()
+    thinkgear = ThinkGearClient(port=tg_port, reconnect=True)
+    # El emulador acelera el tiempo: el reloj de eSense va a `speed` Hz reales
+    thinkgear.clock = SampleClock(speed, creep=0.05)
+    received = [0]
+
+    def on_attention(value):
+        received[0] += 1
+        processor.update('attention', value, thinkgear.sample_time)
+    thinkgear.attention_handlers.append(on_attention)
+    thinkgear.meditation_handlers.append(
+        lambda value: processor.update('meditation', value, thinkgear.sample_time))
+    thinkgear.blink_handlers.append(
+        lambda value: processor.update('blink', value, thinkgear.sample_time))
+    thinkgear.connect()
+
+    components = {'bulb': SmartBulbController('127.0.0.1', bulb_servers[0].server_port)}
+    commands = [0]
+    running = [True]
+
+    def control_loop():
+        # Igual que BrainBulbApp._control_loop, sin la interfaz
+        while running[0]:
+            command = processor.get_command()
+            if not command:
+                time.sleep(0.01)
+                continue
+            bulb = components['bulb']
+            if command == "foco_on":
+                bulb.turn_on()
+            elif command == "foco_off":
+                bulb.turn_off()
+            elif command == "ajustar_brillo":
+                bulb.set_brightness(50)
+            commands[0] += 1
+    threading.Thread(target=control_loop, name='control-loop', daemon=True).start()
+
+    samples = []
+    deadline = time.monotonic() + hours * 3600 / speed * 3 + 30
+    hour = 0
+    log(f"{'hora':>4} {'RSS (MB)':>9} {'hilos':>6} {'eSense':>8} {'comandos':>9}")
+    while hour < hours and time.monotonic() < deadline:
+        time.sleep(0.05)
+        if received[0] < (hour + 1) * 3600:
+            continue
+        hour += 1
+        # Lo mismo que "Reconectar" en la GUI con otra dirección del foco
+        previous = components['bulb']
+        server = bulb_servers[hour % 2]
+        components['bulb'] = SmartBulbController('127.0.0.1', server.server_port)
+        previous.close()
+        thinkgear.reconnect_to()
+        samples.append((hour, rss_bytes(), threading.active_count()))
+        log(f"{hour:>4} {samples[-1][1] / 1e6:>9.1f} {samples[-1][2]:>6} "
+            f"{received[0]:>8} {commands[0]:>9}")
+
+    ok = True
+    if hour < hours:
+        log(f"FALLO: solo {hour} de {hours:g} horas virtuales antes del límite de tiempo")
+        ok = False
+
+    # Fase de basura: bytes sin '\r' hacia el cliente
+    garbage_port, stop_garbage = _garbage_server()
+    thinkgear.reconnect_to(port=garbage_port)
+    before = rss_bytes()
+    time.sleep(garbage_seconds)
+    growth = (rss_bytes() - before) / 1e6
+    overflows = thinkgear.overflow_counter.value()
+    log(f"Basura sin separador durante {garbage_seconds:g} s: {overflows} líneas descartadas, "
+        f"RSS {growth:+.1f} MB")
+    if overflows == 0 or growth > rss_slack:
+        log("FALLO: el buffer de ThinkGearClient no está acotado")
+        ok = False
+    stop_garbage()
+
+    running[0] = False
+    thinkgear.disconnect()
+    components['bulb'].close()
+    emulator.terminate()
+    for server in bulb_servers:
+        server.shutdown()
+
+    baseline = [s for s in samples if s[0] >= warmup]
+    if baseline:
+        _h, rss0, threads0 = baseline[0]
+        rss_growth = (max(s[1] for s in baseline) - rss0) / 1e6
+        thread_growth = max(s[2] for s in baseline) - threads0
+        log(f"Tras {warmup} h de calentamiento: RSS {rss_growth:+.1f} MB, "
+            f"hilos {thread_growth:+d}")
+        if rss_growth > rss_slack:
+            log(f"FALLO: la RSS crece más de {rss_slack:g} MB")
+            ok = False
+        if thread_growth > thread_slack:
+            log(f"FALLO: el número de hilos crece en {thread_growth}")
+            ok = False
+
+    if not _check_text_cap(MAX_TEXT_LINES, log):
+        ok = False
+    log("OK" if ok else "FALLO")
+    return ok
+
+
+def _check_text_cap(max_lines, log):
+    """Comprueba BrainBulbApp._append_text con un widget Text real si hay pantalla"""
+    import tkinter as tk
+    from BrainHomeController import BrainBulbApp
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        log("Sin pantalla: se omite la comprobación de los registros de la GUI")
+        return True
+    try:
+        widget = tk.Text(root, state="disabled")
+        for i in range(max_lines * 10):
+            BrainBulbApp._append_text(None, widget, f"línea {i}\n", max_lines)
+        lines = int(widget.index("end-1c").split(".")[0]) - 1
+        log(f"Registro de la GUI tras {max_lines * 10} líneas: {lines} conservadas")
+        if lines > max_lines:
+            log("FALLO: los registros de la GUI no están acotados")
+            return False
+        return True
+    finally:
+        root.destroy()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de resistencia de memoria e hilos")
+    parser.add_argument('--hours', type=float, default=24.0, help="Horas virtuales")
+    parser.add_argument('--speed', type=float, default=500.0, help="Aceleración del emulador")
+    parser.add_argument('--warmup', type=int, default=2, help="Horas virtuales de calentamiento")
+    parser.add_argument('--rss-slack', type=float, default=16.0,
+                        help="Crecimiento máximo de la RSS tras el calentamiento (MB)")
+    parser.add_argument('--thread-slack', type=int, default=4,
+                        help="Crecimiento máximo del número de hilos tras el calentamiento")
+    args = parser.parse_args(argv)
+    ok = soak(args.hours, args.speed, args.warmup, args.rss_slack, args.thread_slack)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,391 @@
+'''
+Cálculo de potencia por bandas EEG en el host a partir de las muestras crudas.
+
+BandPowerEngine aplica el método de Welch de forma incremental: cada `hop`
+muestras calcula la FFT real de un segmento con ventana y promedia los
+últimos `n_segments` periodogramas. Todos los buffers se reservan una sola
+vez y las ventanas se cachean por tamaño, de modo que el coste por salto es
+una FFT de `segment` puntos y un producto matriz-vector para las bandas.
+
+Las bandas reproducen las de ASIC_EEG_POWER del headset (delta a mid-gamma)
+y se entregan a `waves_handlers` con la misma firma que mindwave.Headset.
+'''
+import numpy as np
+
+# Bandas de ASIC_EEG_POWER (Hz), mismas claves que Headset.waves
+EEG_BANDS = (
+    ('delta', 0.5, 2.75),
+    ('theta', 3.5, 6.75),
+    ('low-alpha', 7.5, 9.25),
+    ('high-alpha', 10.0, 11.75),
+    ('low-beta', 13.0, 16.75),
+    ('high-beta', 18.0, 29.75),
+    ('low-gamma', 31.0, 39.75),
+    ('mid-gamma', 41.0, 49.75),
+)
+
+_WINDOWS = {}
+
+
+def get_window(name, n):
+    """Devuelve la ventana `name` de `n` puntos, cacheada y de solo lectura"""
+    key = (name, n)
+    window = _WINDOWS.get(key)
+    if window is None:
+        if name == 'hann':
+            window = np.hanning(n)
+        elif name == 'hamming':
+            window = np.hamming(n)
+        elif name == 'blackman':
+            window = np.blackman(n)
+        elif name == 'boxcar':
+            window = np.ones(n)
+        else:
+            raise ValueError(f"Ventana desconocida: {name}")
+        window.flags.writeable = False
+        _WINDOWS[key] = window
+    return window
+
+
+def band_matrix(bands, segment, sample_rate, window):
+    """Matriz (bandas x bins) que convierte un periodograma |X|^2 en potencia por banda
+
+    Incluye la normalización de Welch (fs * sum(w^2)), la resolución df y el
+    factor 2 del espectro unilateral.
+    """
+    freqs = np.fft.rfftfreq(segment, 1.0 / sample_rate)
+    df = freqs[1] - freqs[0]
+    scale = np.full(len(freqs), 2.0 * df / (sample_rate * np.sum(window ** 2)))
+    scale[0] /= 2.0
+    if segment % 2 == 0:
+        scale[-1] /= 2.0
+    matrix = np.zeros((len(bands), len(freqs)))
+    for i, (_name, low, high) in enumerate(bands):
+        mask = (freqs >= low) & (freqs <= high)
+        matrix[i, mask] = scale[mask]
+    return matrix
+
+
+class BandPowerEngine(object):
+    """Potencia por bandas EEG estilo Welch con segmentos solapados y salto configurable"""
+
+    def __init__(self, sample_rate=512, segment=256, hop=128, n_segments=4,
+                 window='hann', bands=EEG_BANDS):
+        if not 0 < hop <= segment:
+            raise ValueError("hop debe estar entre 1 y segment")
+        self.sample_rate = sample_rate
+        self.segment = segment
+        self.hop = hop
+        self.n_segments = n_segments
+        self.band_names = tuple(name for name, _low, _high in bands)
+        self.window = get_window(window, segment)
+        self.matrix = band_matrix(bands, segment, sample_rate, self.window)
+
+        # Buffers preasignados
+        n_bins = segment // 2 + 1
+        self._buf = np.zeros(segment)
+        self._work = np.zeros(segment)
+        self._stage = np.zeros(hop)
+        self._staged = 0
+        self._filled = 0
+        self._psd_ring = np.zeros((n_segments, n_bins))
+        self._psd_sum = np.zeros(n_bins)
+        self._mag = np.zeros(n_bins)
+        self._powers = np.zeros(len(bands))
+        self._ring_index = 0
+        self._ring_count = 0
+
+        self.headset = None
+        self.waves = {}
+        self.handlers = []
+        self.hops = 0
+
+    def reset(self):
+        """Descarta el historial acumulado"""
+        self._staged = 0
+        self._filled = 0
+        self._ring_index = 0
+        self._ring_count = 0
+        self._psd_ring.fill(0.0)
+
+    def push_sample(self, value):
+        """Añade una muestra cruda; devuelve las potencias si se completó un salto"""
+        self._stage[self._staged] = value
+        self._staged += 1
+        if self._staged == self.hop:
+            self._staged = 0
+            return self._process_hop(self._stage)
+        return None
+
+    def push(self, samples):
+        """Añade un bloque de muestras crudas; devuelve las últimas potencias emitidas o None"""
+        samples = np.asarray(samples, dtype=np.float64)
+        result = None
+        pos = 0
+        n = len(samples)
+        hop = self.hop
+        # Completar el salto pendiente
+        if self._staged:
+            take = min(hop - self._staged, n)
+            self._stage[self._staged:self._staged + take] = samples[:take]
+            self._staged += take
+            pos = take
+            if self._staged == hop:
+                self._staged = 0
+                result = self._process_hop(self._stage)
+        # Saltos completos directamente desde el bloque
+        while n - pos >= hop:
+            result = self._process_hop(samples[pos:pos + hop])
+            pos += hop
+        rest = n - pos
+        if rest:
+            self._stage[:rest] = samples[pos:]
+            self._staged = rest
+        return result
+
+    def _process_hop(self, chunk):
+        hop = self.hop
+        buf = self._buf
+        buf[:-hop] = buf[hop:]
+        buf[-hop:] = chunk
+        self._filled = min(self._filled + hop, self.segment)
+        if self._filled < self.segment:
+            return None
+
+        # Periodograma del segmento más reciente
+        np.subtract(buf, buf.mean(), out=self._work)
+        self._work *= self.window
+        spectrum = np.fft.rfft(self._work)
+        np.abs(spectrum, out=self._mag)
+        np.square(self._mag, out=self._psd_ring[self._ring_index])
+        self._ring_index = (self._ring_index + 1) % self.n_segments
+        if self._ring_count < self.n_segments:
+            self._ring_count += 1
+
+        # Promedio de Welch y potencia por banda
+        np.sum(self._psd_ring[:self._ring_count], axis=0, out=self._psd_sum)
+        self._psd_sum /= self._ring_count
+        np.dot(self.matrix, self._psd_sum, out=self._powers)
+        self.hops += 1
+        self._emit()
+        return self._powers
+
+    def _emit(self):
+        waves = self.waves
+        for name, value in zip(self.band_names, self._powers.tolist()):
+            waves[name] = value
+        for handler in self.handlers:
+            handler(waves)
+        headset = self.headset
+        if headset is not None:
+            # Se sustituye el dict: los HeadsetState publicados conservan el anterior
+            headset.waves = dict(headset.waves, **waves)
+            for handler in headset.waves_handlers:
+                handler(headset, headset.waves)
+
+    def attach(self, headset):
+        """Alimenta el motor con raw_value_handlers y publica en headset.waves_handlers"""
+        self.headset = headset
+        headset.raw_value_handlers.append(self._on_raw_value)
+
+    def detach(self):
+        if self.headset is not None:
+            try:
+                self.headset.raw_value_handlers.remove(self._on_raw_value)
+            except ValueError:
+                pass
+            self.headset = None
+
+    def _on_raw_value(self, headset, value):
+        self.push_sample(value)
+
+
+# Bandas para el seguimiento incremental de gestos de control (Hz)
+TRACKER_BANDS = (
+    ('theta', 4.0, 7.0),
+    ('alpha', 8.0, 12.0),
+    ('beta', 13.0, 30.0),
+)
+
+
+class SlidingDFTTracker(object):
+    """Seguimiento incremental de unas pocas bandas mediante DFT deslizante
+
+    Cada muestra actualiza solo los bins seleccionados en O(bins):
+    X_k <- (X_k + x_nuevo - x_viejo) * e^(j2πk/N). La ventana de Hann se
+    aplica en el dominio de la frecuencia al consultar las potencias, y cada
+    N muestras los bins se recalculan de forma exacta para evitar la deriva
+    numérica de la recursión.
+    """
+
+    def __init__(self, sample_rate=512, window=512, bands=TRACKER_BANDS):
+        self.sample_rate = sample_rate
+        self.window = window
+        self.band_names = tuple(name for name, _low, _high in bands)
+        df = float(sample_rate) / window
+
+        # Bins de cada banda más un vecino a cada lado para la ventana de Hann
+        band_bins = []
+        needed = set()
+        for _name, low, high in bands:
+            ks = list(range(int(np.ceil(low / df)), int(np.floor(high / df)) + 1))
+            band_bins.append(ks)
+            for k in ks:
+                needed.update((k - 1, k, k + 1))
+        bins = np.array(sorted(needed))
+        position = {k: i for i, k in enumerate(bins.tolist())}
+        centers = sorted(set(k for ks in band_bins for k in ks))
+        self._center = np.array([position[k] for k in centers])
+        self._left = np.array([position[k - 1] for k in centers])
+        self._right = np.array([position[k + 1] for k in centers])
+
+        # Hann periódica: sum(w^2) = 3N/8; espectro unilateral
+        scale = 2.0 * df / (sample_rate * 3.0 * window / 8.0)
+        self._matrix = np.zeros((len(bands), len(centers)))
+        for i, ks in enumerate(band_bins):
+            for k in ks:
+                self._matrix[i, centers.index(k)] = scale
+
+        self.bins = bins
+        self._twiddle = np.exp(2j * np.pi * bins / window)
+        self._basis = np.exp(-2j * np.pi * np.outer(bins, np.arange(window)) / window)
+        self._X = np.zeros(len(bins), dtype=complex)
+        self._ring = [0.0] * window
+        self._pos = 0
+        self._since_resync = 0
+        self._filled = 0
+
+        self.headset = None
+        self.processor = None
+        self.feature_every = 0
+        self._since_feature = 0
+
+    def push_sample(self, value):
+        """Añade una muestra cruda y actualiza los bins seleccionados"""
+        pos = self._pos
+        old = self._ring[pos]
+        self._ring[pos] = value
+        pos += 1
+        if pos == self.window:
+            pos = 0
+        self._pos = pos
+        X = self._X
+        X += value - old
+        X *= self._twiddle
+        self._since_resync += 1
+        if self._since_resync == self.window:
+            self._resync()
+        if self.processor is not None:
+            self._since_feature += 1
+            if self._since_feature >= self.feature_every:
+                self._since_feature = 0
+                self._feed_processor()
+
+    def push(self, samples):
+        """Añade un bloque de muestras crudas"""
+        for value in np.asarray(samples, dtype=np.float64).tolist():
+            self.push_sample(value)
+
+    def _resync(self):
+        """Recalcula los bins de forma exacta a partir de la ventana actual"""
+        self._since_resync = 0
+        if self._filled < self.window:
+            self._filled += self.window
+        pos = self._pos
+        ordered = np.array(self._ring[pos:] + self._ring[:pos])
+        np.dot(self._basis, ordered, out=self._X)
+
+    def band_powers(self):
+        """Devuelve la potencia actual de cada banda"""
+        X = self._X
+        hann = 0.5 * X[self._center] - 0.25 * (X[self._left] + X[self._right])
+        powers = np.dot(self._matrix, hann.real ** 2 + hann.imag ** 2)
+        return dict(zip(self.band_names, powers.tolist()))
+
+    def engagement(self, powers=None):
+        """Índice de implicación beta / (theta + alfa + beta) escalado a 0-100"""
+        if powers is None:
+            powers = self.band_powers()
+        total = powers.get('theta', 0.0) + powers.get('alpha', 0.0) + powers.get('beta', 0.0)
+        if total <= 0:
+            return 0.0
+        return 100.0 * powers.get('beta', 0.0) / total
+
+    def attach(self, headset):
+        """Alimenta el seguimiento desde raw_value_handlers del headset"""
+        self.headset = headset
+        headset.raw_value_handlers.append(self._on_raw_value)
+
+    def detach(self):
+        if self.headset is not None:
+            try:
+                self.headset.raw_value_handlers.remove(self._on_raw_value)
+            except ValueError:
+                pass
+            self.headset = None
+
+    def _on_raw_value(self, headset, value):
+        self.push_sample(value)
+
+    def attach_processor(self, processor, every=64):
+        """Envía 'alpha', 'beta' y 'engagement' a BrainSignalProcessor cada `every` muestras"""
+        self.processor = processor
+        processor.feature_producers.update(('alpha', 'beta', 'engagement'))
+        self.feature_every = every
+        self._since_feature = 0
+
+    def _feed_processor(self):
+        if self._filled < self.window:
+            return
+        powers = self.band_powers()
+        processor = self.processor
+        processor.update('alpha', powers['alpha'])
+        processor.update('beta', powers['beta'])
+        processor.update('engagement', self.engagement(powers))
+
+
+def benchmark(seconds=60, sample_rate=512):
+    """Compara coste por muestra y potencias de BandPowerEngine y SlidingDFTTracker"""
+    import time
+
+    t = np.arange(seconds * sample_rate) / float(sample_rate)
+    rng = np.random.default_rng(0)
+    signal = (80 * np.sin(2 * np.pi * 10 * t) + 30 * np.sin(2 * np.pi * 20 * t)
+              + 20 * np.sin(2 * np.pi * 5 * t) + 5 * rng.standard_normal(len(t)))
+    samples = signal.tolist()
+
+    engine = BandPowerEngine(sample_rate=sample_rate, segment=512, hop=128)
+    start = time.perf_counter()
+    for value in samples:
+        engine.push_sample(value)
+    fft_us = (time.perf_counter() - start) * 1e6 / len(samples)
+
+    tracker = SlidingDFTTracker(sample_rate=sample_rate)
+    start = time.perf_counter()
+    for value in samples:
+        tracker.push_sample(value)
+    sdft_us = (time.perf_counter() - start) * 1e6 / len(samples)
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        tracker.band_powers()
+    query_us = (time.perf_counter() - start) * 1e3
+
+    # Potencias equivalentes desde la FFT con los mismos límites de banda
+    fft_engine = BandPowerEngine(sample_rate=sample_rate, segment=512, hop=128,
+                                 bands=TRACKER_BANDS)
+    fft_engine.push(signal)
+    fft_powers = fft_engine.waves
+    sdft_powers = tracker.band_powers()
+
+    print(f"FFT (Welch, hop 128):  {fft_us:.2f} us/muestra, latencia de banda {128 * 1e3 / sample_rate:.0f} ms")
+    print(f"DFT deslizante:        {sdft_us:.2f} us/muestra, {len(tracker.bins)} bins, "
+          f"consulta de bandas {query_us:.2f} us")
+    for name in tracker.band_names:
+        a, b = fft_powers[name], sdft_powers[name]
+        diff = abs(a - b) / a * 100 if a else 0.0
+        print(f"  {name:<6} FFT={a:10.1f}  DFT deslizante={b:10.1f}  diferencia={diff:.1f}%")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,286 @@
+'''
+Emulador local del ThinkGear Connector para pruebas de carga de ThinkGearClient.
+
+Habla el mismo protocolo JSON sobre TCP que el conector real: espera la
+configuración del cliente ({"enableRawOutput": ..., "format": "Json"}) y
+después envía mensajes separados por '\\r':
+
+    {"eSense": {"attention": 53, "meditation": 47}, "eegPower": {...}, "poorSignalLevel": 0}
+    {"blinkStrength": 65}
+    {"rawEeg": 123}            (solo si enableRawOutput es true)
+
+Las señales pueden ser sintéticas (deterministas a partir de una semilla) o
+una sesión grabada en el formato de OfflineHeadset, y se emiten a `speed`
+veces el tiempo real a cualquier número de clientes simultáneos.
+
+Uso:
+    python tg_emulator.py --port 13854 --speed 1
+    python tg_emulator.py --bench --clients 16 --speed 20 --duration 10
+'''
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import socketserver
+
+RAW_RATE = 512
+TICK = 0.01  # Granularidad de envío (s)
+
+
+class SyntheticSource(object):
+    """Señales sintéticas reproducibles: episodios de concentración, relajación y triples parpadeos"""
+
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.attention = 40.0
+        self.meditation = 40.0
+
+    def second(self, k):
+        """Devuelve (attention, meditation, poor_signal, blink_offsets) para el segundo k"""
+        rng = self.rng
+        cycle = k % 60
+        target_att = 85 if 20 <= cycle < 26 else 40
+        target_med = 85 if 45 <= cycle < 51 else 40
+        self.attention += 0.5 * (target_att - self.attention) + rng.gauss(0, 4)
+        self.meditation += 0.5 * (target_med - self.meditation) + rng.gauss(0, 4)
+        self.attention = min(100.0, max(0.0, self.attention))
+        self.meditation = min(100.0, max(0.0, self.meditation))
+        blinks = []
+        if cycle == 35:
+            blinks = [(0.1, 90), (0.4, 92), (0.7, 88)]
+        elif rng.random() < 0.1:
+            blinks = [(rng.random(), rng.randint(30, 70))]
+        return int(self.attention), int(self.meditation), 0, blinks
+
+    def raw(self, k):
+        """Muestras crudas del segundo k (alfa + beta + ruido)"""
+        rng = self.rng
+        samples = []
+        for i in range(RAW_RATE):
+            t = k + i / float(RAW_RATE)
+            v = (60 * math.sin(2 * math.pi * 10 * t) + 25 * math.sin(2 * math.pi * 21 * t)
+                 + rng.gauss(0, 15))
+            samples.append(int(v))
+        return samples
+
+
+class RecordedSource(object):
+    """Reproduce una sesión grabada en formato OfflineHeadset ("<t> <raw> <att> <med> <blink>")"""
+
+    def __init__(self, path):
+        self.rows = []
+        with open(path, 'r') as f:
+            for line in f:
+                data = line.split()
+                if len(data) >= 5:
+                    self.rows.append([int(float(v)) for v in data[1:5]])
+        if not self.rows:
+            raise ValueError(f"Sesión vacía: {path}")
+
+    def _slice(self, k):
+        n = len(self.rows)
+        start = (k * RAW_RATE) % n
+        return [self.rows[(start + i) % n] for i in range(RAW_RATE)]
+
+    def second(self, k):
+        rows = self._slice(k)
+        blinks = []
+        previous = 0
+        for i, row in enumerate(rows):
+            if row[3] > 0 and row[3] != previous:
+                blinks.append((i / float(RAW_RATE), row[3]))
+            previous = row[3]
+        return rows[0][1], rows[0][2], 0, blinks
+
+    def raw(self, k):
+        return [row[0] for row in self._slice(k)]
+
+
+def iter_messages(source, raw_output):
+    """Generador infinito de (tiempo_virtual, mensaje) en orden temporal"""
+    k = 0
+    while True:
+        attention, meditation, poor_signal, blinks = source.second(k)
+        power = {name: int(1e4 / (i + 1)) for i, name in enumerate(
+            ('delta', 'theta', 'lowAlpha', 'highAlpha', 'lowBeta', 'highBeta',
+             'lowGamma', 'highGamma'))}
+        events = [(float(k), json.dumps({
+            'eSense': {'attention': attention, 'meditation': meditation},
+            'eegPower': power,
+            'poorSignalLevel': poor_signal}))]
+        for offset, strength in blinks:
+            events.append((k + offset, '{"blinkStrength": %d}' % strength))
+        if raw_output:
+            for i, v in enumerate(source.raw(k)):
+                events.append((k + i / float(RAW_RATE), '{"rawEeg": %d}' % v))
+        events.sort(key=lambda e: e[0])
+        for event in events:
+            yield event
+        k += 1
+
+
+class EmulatorHandler(socketserver.BaseRequestHandler):
+    """Atiende a un cliente: lee la configuración y emite mensajes al ritmo configurado"""
+
+    def _read_config(self):
+        self.request.settimeout(2.0)
+        data = b''
+        try:
+            while True:
+                chunk = self.request.recv(1024)
+                if not chunk:
+                    break
+                data += chunk
+                try:
+                    return json.loads(data.decode('utf-8'))
+                except ValueError:
+                    continue
+        except OSError:
+            pass
+        return {}
+
+    def handle(self):
+        server = self.server
+        config = self._read_config()
+        self.request.settimeout(None)
+        raw_output = bool(config.get('enableRawOutput', False))
+        source = server.make_source()
+        messages = iter_messages(source, raw_output)
+        pending = next(messages)
+        start = time.monotonic()
+        with server.lock:
+            server.clients += 1
+        try:
+            while server.running:
+                virtual_now = (time.monotonic() - start) * server.speed
+                batch = []
+                while pending[0] <= virtual_now:
+                    batch.append(pending[1])
+                    pending = next(messages)
+                if batch:
+                    self.request.sendall(('\r'.join(batch) + '\r').encode('utf-8'))
+                    with server.lock:
+                        server.messages_sent += len(batch)
+                if server.duration and virtual_now >= server.duration:
+                    break
+                time.sleep(TICK)
+        except OSError:
+            pass
+        finally:
+            with server.lock:
+                server.clients -= 1
+
+
+class ThinkGearEmulator(socketserver.ThreadingTCPServer):
+    """Servidor TCP que emula el ThinkGear Connector para muchos clientes"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=13854, speed=1.0, seed=0,
+                 recording=None, duration=None):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), EmulatorHandler)
+        self.speed = speed
+        self.seed = seed
+        self.recording = recording
+        self.duration = duration
+        self.running = True
+        self.lock = threading.Lock()
+        self.clients = 0
+        self.messages_sent = 0
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def make_source(self):
+        if self.recording:
+            return RecordedSource(self.recording)
+        return SyntheticSource(self.seed)
+
+    def start(self):
+        """Arranca el servidor en un hilo en segundo plano"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.shutdown()
+        self.server_close()
+
+
+def _serve(port, speed, seed, recording, ready):
+    emulator = ThinkGearEmulator(port=port, speed=speed, seed=seed, recording=recording)
+    ready.put(emulator.port)
+    emulator.serve_forever()
+
+
+def benchmark(clients=8, speed=20.0, duration=10.0, recording=None):
+    """Mide mensajes/s y CPU por conexión de ThinkGearClient contra el emulador
+
+    El emulador corre en otro proceso para que la CPU medida aquí sea solo la
+    de los clientes.
+    """
+    import multiprocessing
+    from BrainHomeController import ThinkGearClient
+
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(0, speed, 0, recording, ready),
+                                     daemon=True)
+    server.start()
+    port = ready.get(timeout=10)
+
+    connections = [ThinkGearClient(port=port) for _ in range(clients)]
+    received = [0] * clients
+    for i, client in enumerate(connections):
+        def count(value, i=i):
+            received[i] += 1
+        client.attention_handlers.append(count)
+        client.connect()
+
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    time.sleep(duration)
+    wall = time.monotonic() - wall_start
+    cpu = time.process_time() - cpu_start
+    # Todas las conexiones comparten el contador etiquetado con host:puerto
+    messages = connections[0].messages_counter.value()
+    for client in connections:
+        client.disconnect()
+    server.terminate()
+
+    print(f"{clients} clientes, velocidad x{speed:g}, {wall:.1f} s")
+    print(f"  mensajes/s totales: {messages / wall:.0f} "
+          f"(~{messages / wall / clients:.0f} por conexión)")
+    print(f"  eSense recibidos por conexión: {sum(received) / float(clients):.0f}")
+    print(f"  CPU de clientes: {cpu / wall * 100:.1f}% de un núcleo, "
+          f"{cpu / wall * 100 / clients:.2f}% por conexión")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Emulador del ThinkGear Connector")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=13854)
+    parser.add_argument('--speed', type=float, default=1.0, help="Veces el tiempo real")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--recording', help="Sesión grabada en formato OfflineHeadset")
+    parser.add_argument('--bench', action='store_true', help="Medir ThinkGearClient contra el emulador")
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        benchmark(args.clients, args.speed, args.duration, args.recording)
+        return
+    emulator = ThinkGearEmulator(args.host, args.port, args.speed, args.seed, args.recording)
+    print(f"Emulador ThinkGear en {args.host}:{emulator.port} (x{args.speed:g})")
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+'''
+Trazado de latencia por etapas, desde el byte leído hasta la respuesta HTTP del foco.
+
+Cada lectura (DongleListener.run / ThinkGearClient._read_data_loop) abre una
+traza con marca 'read'. Si esa lectura produce un gesto, la traza se copia al
+gesto ('detected'), se marca al salir de la cola en el bucle de control
+('dequeued') y al enviar y recibir la respuesta del ESP8266 ('sent',
+'response'). BrainSignalProcessor.pop_command devuelve la traza del gesto y
+el bucle de control la pasa explícitamente a SmartBulbController. Cada
+intervalo entre marcas consecutivas, y el total, se acumula en un
+histograma logarítmico estilo HDR.
+
+Con el trazado desactivado el coste en cada punto es una única comprobación
+de `tracer.enabled`. Se activa con tracer.enable() o con la variable de
+entorno BRAINBULB_TRACE=1.
+'''
+import os
+import json
+import time
+import threading
+
+_now = time.monotonic_ns
+
+
+class LatencyHistogram(object):
+    """Histograma log-lineal de latencias en nanosegundos (precisión relativa ~1.6%)"""
+
+    SUB_BITS = 7
+
+    def __init__(self, max_value=2 ** 40):
+        self._sub = 1 << self.SUB_BITS
+        self._half = self._sub >> 1
+        size = self._index(max_value) + 1
+        self.counts = [0] * size
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self._lock = threading.Lock()
+
+    def _index(self, value):
+        if value < self._sub:
+            return value
+        e = value.bit_length() - self.SUB_BITS
+        return self._sub + (e - 1) * self._half + ((value >> e) - self._half)
+
+    def _value(self, index):
+        """Valor central del bucket `index`"""
+        if index < self._sub:
+            return index
+        e = (index - self._sub) // self._half + 1
+        m = (index - self._sub) % self._half + self._half
+        return (m << e) + (1 << (e - 1))
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        index = min(self._index(value), len(self.counts) - 1)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+            if self.min is None or value < self.min:
+                self.min = value
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        target = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(self._value(index), self.max)
+        return self.max
+
+    def summary(self):
+        """Resumen en microsegundos"""
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_us': self.total / self.count / 1e3,
+            'min_us': self.min / 1e3,
+            'p50_us': self.percentile(50) / 1e3,
+            'p90_us': self.percentile(90) / 1e3,
+            'p99_us': self.percentile(99) / 1e3,
+            'p999_us': self.percentile(99.9) / 1e3,
+            'max_us': self.max / 1e3,
+        }
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * len(self.counts)
+            self.count = 0
+            self.total = 0
+            self.min = None
+            self.max = 0
+
+
+class Trace(object):
+    """Marcas de tiempo monotónicas (etapa, ns) de un evento"""
+    __slots__ = ('stamps',)
+
+    def __init__(self, stamps=None):
+        self.stamps = stamps if stamps is not None else []
+
+    def fork(self):
+        return Trace(list(self.stamps))
+
+
+class Tracer(object):
+    """Registro de trazas por etapa con histogramas de latencia"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def begin(self, stage='read'):
+        """Abre una traza nueva y la deja como actual en este hilo"""
+        trace = Trace([(stage, _now())])
+        self._local.current = trace
+        return trace
+
+    def current(self):
+        return getattr(self._local, 'current', None)
+
+    def activate(self, trace):
+        self._local.current = trace
+
+    def stamp(self, trace, stage):
+        """Añade una marca y registra el intervalo desde la anterior"""
+        now = _now()
+        previous, t = trace.stamps[-1]
+        trace.stamps.append((stage, now))
+        self._histogram(f"{previous}->{stage}").record(now - t)
+
+    def finish(self, trace, stage=None):
+        """Cierra la traza registrando su latencia total"""
+        if stage is not None:
+            self.stamp(trace, stage)
+        first, t0 = trace.stamps[0]
+        last, t1 = trace.stamps[-1]
+        self._histogram(f"{first}->{last} (total)").record(t1 - t0)
+        if self.current() is trace:
+            self._local.current = None
+
+    def _histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def snapshot(self):
+        """Resumen de todos los histogramas por etapa"""
+        return {name: h.summary() for name, h in sorted(self.histograms.items())}
+
+    def report(self):
+        """Texto con los percentiles de cada etapa"""
+        lines = []
+        for name, s in self.snapshot().items():
+            if not s['count']:
+                continue
+            lines.append(f"{name:<32} n={s['count']:<7} p50={s['p50_us']:.0f}us "
+                         f"p99={s['p99_us']:.0f}us max={s['max_us']:.0f}us")
+        return '\n'.join(lines)
+
+    def export(self, path):
+        """Guarda el resumen en JSON"""
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def reset(self):
+        for histogram in list(self.histograms.values()):
+            histogram.reset()
+
+
+tracer = Tracer(enabled=os.environ.get('BRAINBULB_TRACE') == '1')
@@ -0,0 +1,339 @@
+'''
+Modo multiproceso: adquisición, detección y control del foco en un proceso
+aparte de la interfaz Tk.
+
+En el modo normal el mainloop de Tk, los redibujados de matplotlib, el hilo
+lector de ThinkGear, BrainSignalProcessor y las peticiones HTTP al ESP8266
+comparten intérprete y GIL, y un canvas.draw() completo retrasa el
+procesado de muestras. Con BRAINBULB_WORKER=1 la aplicación arranca
+run_worker() en un proceso hijo que contiene ThinkGearClient,
+BrainSignalProcessor y SmartBulbController y ejecuta él mismo los gestos.
+
+La GUI habla con el proceso por un Pipe:
+ - el worker envía ('state', dict) unas pocas veces por segundo (los buffers
+   de señal solo cuando cambian), ('command', gesto, hora) por cada gesto
+   ejecutado y ('calibration_done', ok) al terminar una calibración
+ - la GUI envía órdenes: ('bulb', método, args), ('thresholds', dict),
+   ('calibrate',), ('reconnect', dict), ('blink_brightness', n),
+   ('profile', segundos, memoria), ('stop',)
+
+El worker responde a ('profile', ...) con ('profile_done', resultado, error)
+y también perfila al recibir SIGUSR1 (profiling.install_signal_handler).
+
+WorkerClient expone processor/bulb/thinkgear con los atributos que lee la
+interfaz, alimentados con el último estado recibido.
+'''
+import time
+import threading
+import collections
+import multiprocessing
+
+STATE_INTERVAL = 0.25  # Segundos entre estados enviados a la GUI
+
+
+def run_worker(conn, esp_ip, esp_port=80, tg_host='127.0.0.1', tg_port=13854,
+               blink_brightness=50, interval=STATE_INTERVAL):
+    """Punto de entrada del proceso worker"""
+    from BrainHomeController import (BrainSignalProcessor, SmartBulbController, ThinkGearClient,
+                                     load_calibration, apply_calibration, attach_optional_stages,
+                                     start_stream_server)
+    import profiling
+    from metrics import registry
+
+    send_lock = threading.Lock()
+
+    def send(*message):
+        with send_lock:
+            try:
+                conn.send(message)
+            except (OSError, EOFError, BrokenPipeError):
+                pass
+
+    processor = BrainSignalProcessor()
+    cal = load_calibration()
+    apply_calibration(processor, cal)
+    attach_optional_stages(processor, cal)
+    registry.gauge("brainbulb_gesture_queue_depth", "Gestos pendientes de ejecutar",
+                   fn=lambda: len(processor.detected_gestures))
+    components = {
+        'bulb': SmartBulbController(esp_ip, esp_port),
+        'thinkgear': ThinkGearClient(tg_host, tg_port, reconnect=True),
+        'blink_brightness': blink_brightness,
+    }
+    thinkgear = components['thinkgear']
+    thinkgear.attention_handlers.append(
+        lambda value: processor.update('attention', value, thinkgear.sample_time))
+    thinkgear.meditation_handlers.append(
+        lambda value: processor.update('meditation', value, thinkgear.sample_time))
+    thinkgear.blink_handlers.append(
+        lambda value: processor.update('blink', value, thinkgear.sample_time))
+    thinkgear.connect()
+    stream_server = start_stream_server(thinkgear)
+    running = [True]
+
+    def control_loop():
+        # Mismo bucle que BrainBulbApp._control_loop, sin tocar la interfaz
+        while running[0]:
+            command, trace = processor.pop_command()
+            if command:
+                bulb = components['bulb']
+                if command == "foco_on":
+                    bulb.turn_on(trace)
+                elif command == "foco_off":
+                    bulb.turn_off(trace)
+                elif command == "ajustar_brillo":
+                    bulb.set_brightness(components['blink_brightness'], trace)
+                send('command', command, time.time())
+            else:
+                time.sleep(0.01)
+
+    def state_loop():
+        last_buffers = None
+        while running[0]:
+            bulb = components['bulb']
+            tg = components['thinkgear']
+            buffers = (processor.attention_buffer[:], processor.meditation_buffer[:],
+                       processor.blink_buffer[:])
+            state = {
+                'thinkgear_connected': tg.connected,
+                'signal_quality': tg.signal_quality,
+                'bulb_connected': bulb.connected,
+                'bulb_status': dict(bulb.bulb_status),
+                'calibration': processor.get_calibration(),
+            }
+            if buffers != last_buffers:
+                state['buffers'] = buffers
+                last_buffers = buffers
+            send('state', state)
+            time.sleep(interval)
+
+    def on_calibrated(ok):
+        send('calibration_done', ok)
+
+    def on_profiled(result, error):
+        if result is not None:
+            result = {k: v for k, v in result.items() if k != 'collapsed'}
+        send('profile_done', result, None if error is None else str(error))
+
+    profiling.install_signal_handler()
+
+    threading.Thread(target=control_loop, daemon=True).start()
+    threading.Thread(target=state_loop, daemon=True).start()
+
+    while running[0]:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        kind = message[0]
+        if kind == 'stop':
+            break
+        elif kind == 'bulb':
+            _method, args = message[1], message[2]
+            # Las peticiones HTTP no bloquean la recepción de órdenes
+            threading.Thread(target=getattr(components['bulb'], _method), args=args,
+                             daemon=True).start()
+        elif kind == 'thresholds':
+            values = message[1]
+            processor.attention_threshold = values['attention']
+            processor.meditation_threshold = values['meditation']
+            processor.blink_threshold = values['blink']
+            if processor.adaptive is not None:
+                processor.adaptive.anchor('attention', processor.attention_threshold)
+                processor.adaptive.anchor('meditation', processor.meditation_threshold)
+        elif kind == 'calibrate':
+            processor.calibrate(callback=on_calibrated)
+        elif kind == 'blink_brightness':
+            components['blink_brightness'] = message[1]
+        elif kind == 'profile':
+            profiling.profile_async(message[1], message[2], callback=on_profiled, tag='worker')
+        elif kind == 'reconnect':
+            target = message[1]
+            bulb = components['bulb']
+            if (target['esp_ip'], target['esp_port']) != (bulb.ip_address, bulb.port):
+                components['bulb'] = SmartBulbController(target['esp_ip'], target['esp_port'])
+                bulb.close()  # Detiene el polling y la reconexión del anterior
+            components['thinkgear'].reconnect_to(target['tg_host'], target['tg_port'])
+
+    running[0] = False
+    components['thinkgear'].disconnect()
+    if stream_server is not None:
+        stream_server.close()
+    conn.close()
+
+
+class RemoteProcessor(object):
+    """Vista de BrainSignalProcessor en la GUI, alimentada por el worker"""
+
+    def __init__(self, client):
+        self.client = client
+        self.attention_buffer = []
+        self.meditation_buffer = []
+        self.blink_buffer = []
+        self.attention_threshold = 60
+        self.meditation_threshold = 70
+        self.blink_threshold = 80
+        self.attention_window = 5
+        self.meditation_window = 5
+        self.adaptive = None
+        self.calibration = {}
+        self.executed = collections.deque(maxlen=20)
+        self._calibration_callback = None
+
+    def get_command(self):
+        """Devuelve el siguiente gesto ya ejecutado por el worker (solo para mostrarlo)"""
+        try:
+            return self.executed.popleft()
+        except IndexError:
+            return None
+
+    def calibrate(self, callback=None):
+        self._calibration_callback = callback
+        self.client.send('calibrate')
+
+    def get_calibration(self):
+        calibration = dict(self.calibration)
+        calibration.update({
+            "attention": self.attention_threshold,
+            "meditation": self.meditation_threshold,
+            "blink": self.blink_threshold,
+            "attention_window": self.attention_window,
+            "meditation_window": self.meditation_window,
+        })
+        return calibration
+
+    def _apply_state(self, state):
+        calibration = state['calibration']
+        self.calibration = calibration
+        self.attention_threshold = calibration['attention']
+        self.meditation_threshold = calibration['meditation']
+        self.blink_threshold = calibration['blink']
+        self.attention_window = calibration['attention_window']
+        self.meditation_window = calibration['meditation_window']
+        if 'buffers' in state:
+            self.attention_buffer, self.meditation_buffer, self.blink_buffer = state['buffers']
+
+
+class RemoteBulb(object):
+    """Vista de SmartBulbController en la GUI; las órdenes se ejecutan en el worker"""
+
+    def __init__(self, client, ip_address, port):
+        self.client = client
+        self.ip_address = ip_address
+        self.port = port
+        self.connected = False
+        self.bulb_status = {"state": "off", "brightness": 100}
+
+    def get_status(self):
+        return self.bulb_status
+
+    def turn_on(self):
+        self.client.send('bulb', 'turn_on', ())
+        return True
+
+    def turn_off(self):
+        self.client.send('bulb', 'turn_off', ())
+        return True
+
+    def set_brightness(self, brightness):
+        self.client.send('bulb', 'set_brightness', (brightness,))
+        return True
+
+
+class RemoteThinkGear(object):
+    """Vista de ThinkGearClient en la GUI"""
+
+    def __init__(self, client, host, port):
+        self.client = client
+        self.host = host
+        self.port = port
+        self.connected = False
+        self.signal_quality = 200
+
+
+class WorkerClient(object):
+    """Lado GUI del modo multiproceso: arranca el worker y refleja su estado"""
+
+    def __init__(self, esp_ip, esp_port=80, tg_host='127.0.0.1', tg_port=13854):
+        self.esp_ip = esp_ip
+        self.esp_port = esp_port
+        self.tg_host = tg_host
+        self.tg_port = tg_port
+        self.processor = RemoteProcessor(self)
+        self.bulb = RemoteBulb(self, esp_ip, esp_port)
+        self.thinkgear = RemoteThinkGear(self, tg_host, tg_port)
+        self.states = 0
+        self.conn = None
+        self.process = None
+        self._profile_callback = None
+        self._send_lock = threading.Lock()
+
+    def start(self, blink_brightness=50):
+        # 'spawn': no heredar el estado de Tk/matplotlib del proceso de la GUI
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=run_worker, name='brainbulb-worker', daemon=True,
+            args=(child, self.esp_ip, self.esp_port, self.tg_host, self.tg_port,
+                  blink_brightness))
+        self.process.start()
+        child.close()
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+        return self
+
+    def send(self, *message):
+        with self._send_lock:
+            try:
+                self.conn.send(message)
+            except (OSError, EOFError, BrokenPipeError):
+                pass
+
+    def set_thresholds(self, attention, meditation, blink):
+        self.send('thresholds', {'attention': attention, 'meditation': meditation,
+                                 'blink': blink})
+
+    def reconnect(self, esp_ip, esp_port, tg_host, tg_port):
+        self.bulb.ip_address, self.bulb.port = esp_ip, esp_port
+        self.thinkgear.host, self.thinkgear.port = tg_host, tg_port
+        self.send('reconnect', {'esp_ip': esp_ip, 'esp_port': esp_port,
+                                'tg_host': tg_host, 'tg_port': tg_port})
+
+    def profile(self, seconds, memory=False, callback=None):
+        """Perfila el proceso worker; `callback(resultado, error)` al terminar"""
+        self._profile_callback = callback
+        self.send('profile', seconds, memory)
+
+    def _receive_loop(self):
+        while True:
+            try:
+                message = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            kind = message[0]
+            if kind == 'state':
+                state = message[1]
+                self.states += 1
+                self.processor._apply_state(state)
+                self.bulb.connected = state['bulb_connected']
+                self.bulb.bulb_status = state['bulb_status']
+                self.thinkgear.connected = state['thinkgear_connected']
+                self.thinkgear.signal_quality = state['signal_quality']
+            elif kind == 'command':
+                self.processor.executed.append(message[1])
+            elif kind == 'calibration_done':
+                callback = self.processor._calibration_callback
+                if callback:
+                    callback(message[1])
+            elif kind == 'profile_done':
+                callback = self._profile_callback
+                if callback:
+                    callback(message[1], message[2])
+        self.thinkgear.connected = False
+        self.bulb.connected = False
+
+    def stop(self, timeout=2.0):
+        self.send('stop')
+        if self.process is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()